@@ -0,0 +1,72 @@
+"""
+Compares the binary encoding with JSON on blocks: size, encode, decode and header hash throughput
+
+    $ pipenv run python benchmarks/bench_encoding.py -n 2000 -t 100
+"""
+import hashlib
+import json
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import encoding
+from blocks import BLOCK_VERSION, header, merkle_root
+
+
+def build_blocks(count, transactions):
+    blocks = []
+    for index in range(1, count + 1):
+        block_transactions = [{'sender': 1, 'recipient': 2, 'amount': 3, 'fee': 1, 'size': 50,
+                               'id': f'{index:016x}{t:016x}'} for t in range(transactions)]
+        blocks.append({
+            'version': BLOCK_VERSION,
+            'index': index,
+            'timestamp': 1600000000.0 + index,
+            'transactions': block_transactions,
+            'proof': index,
+            'previous_hash': f'{index:064x}',
+            'size': 50 * transactions,
+            'merkle_root': merkle_root([t['id'] for t in block_transactions]),
+            'node': 'benchmark',
+            'difficulty': 20,
+        })
+    return blocks
+
+
+def rate(function, items):
+    started = perf_counter()
+    for item in items:
+        function(item)
+    return len(items) / (perf_counter() - started)
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--blocks', default=2000, type=int, help='blocks to encode')
+    parser.add_argument('-t', '--transactions', default=100, type=int, help='transactions per block')
+    args = parser.parse_args()
+
+    blocks = build_blocks(args.blocks, args.transactions)
+    headers = [header(block) for block in blocks]
+    formats = {
+        'json': (lambda value: json.dumps(value, sort_keys=True).encode(), json.loads),
+        'binary': (encoding.encode, encoding.decode),
+    }
+
+    print(f'{args.blocks} blocks, {args.transactions} transactions each')
+    print(f'{"":8}{"bytes/block":>14}{"encode/s":>12}{"decode/s":>12}{"hash/s":>12}')
+    for name, (encode, decode) in formats.items():
+        encoded = [encode(block) for block in blocks]
+        size = sum(len(data) for data in encoded) / len(encoded)
+        encodes = rate(encode, blocks)
+        decodes = rate(decode, encoded)
+        hashes = rate(lambda value: hashlib.sha256(encode(value)).hexdigest(), headers)
+        print(f'{name:8}{size:14.0f}{encodes:12.0f}{decodes:12.0f}{hashes:12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Compares the hash rate of the midstate proof search with the string based valid_proof
+
+    $ pipenv run python benchmarks/bench_pow.py -n 500000
+"""
+import hashlib
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import proofofwork
+
+
+def bench_valid_proof(hashes, last_proof, last_hash):
+    started = time()
+    for proof in range(hashes):
+        proofofwork.valid_proof(last_proof, proof, last_hash)
+    return hashes / (time() - started)
+
+
+def bench_midstate(hashes, last_proof, last_hash):
+    checks = hashes // proofofwork.CHECK_INTERVAL
+    calls = iter(range(checks + 1))
+
+    # Stop after the requested number of hashes, with a difficulty no proof meets
+    prefix = proofofwork.guess_prefix({'proof': last_proof}, {}, last_hash)
+    _, done, seconds = proofofwork.search(prefix, 0, 1, lambda: next(calls) == checks, 256)
+    return done / seconds
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--hashes', default=500000, type=int, help='hashes per run')
+    args = parser.parse_args()
+
+    last_proof = 35293
+    last_hash = hashlib.sha256(b'benchmark').hexdigest()
+
+    legacy = bench_valid_proof(args.hashes, last_proof, last_hash)
+    midstate = bench_midstate(args.hashes, last_proof, last_hash)
+    print(f'valid_proof: {legacy:12.0f} hashes/s')
+    print(f'midstate:    {midstate:12.0f} hashes/s')
+    print(f'speedup:     {midstate / legacy:12.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Verifications per second of signed transactions: one at a time, in batches on
+the process pool and from the verified cache
+
+    $ pipenv run python benchmarks/bench_signatures.py -n 50000
+"""
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import signatures
+from signatures import Verifier, new_key, sign
+
+
+def build_transactions(count):
+    private_key, address = new_key()
+    return [sign({'sender': address, 'recipient': 'bench', 'amount': 1, 'fee': 1, 'nonce': nonce}, private_key)
+            for nonce in range(count)]
+
+
+def rate(verify, transactions):
+    started = perf_counter()
+    results = verify(transactions)
+    seconds = perf_counter() - started
+    assert all(results)
+    return len(transactions) / seconds
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--transactions', default=50000, type=int, help='signed transactions to verify')
+    args = parser.parse_args()
+
+    started = perf_counter()
+    transactions = build_transactions(args.transactions)
+    signing = args.transactions / (perf_counter() - started)
+
+    verifier = Verifier(cache_size=args.transactions)
+    # Start the pool's workers before timing it
+    Verifier(cache_size=0).verify(transactions[:signatures.CHUNK_SIZE + 1])
+
+    print(f'{args.transactions} transactions, {os.cpu_count()} cores')
+    print(f'signing:       {signing:12.0f} /s')
+    print(f'sequential:    {rate(signatures.verify_chunk, transactions):12.0f} verifications/s')
+    print(f'process pool:  {rate(verifier.verify, transactions):12.0f} verifications/s')
+    print(f'cached:        {rate(verifier.verify, transactions):12.0f} verifications/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Times validation of a long chain in this process and on the process pool
+
+    $ pipenv run python benchmarks/bench_validation.py -n 100000 -t 10
+"""
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import validation
+from blocks import block_hash
+
+
+def build_chain(length, transactions):
+    chain = [{'index': 1, 'timestamp': 0, 'transactions': [], 'proof': 100, 'previous_hash': '1', 'size': 0}]
+    last_hash = block_hash(chain[0])
+    for index in range(2, length + 1):
+        block = {
+            'index': index,
+            'timestamp': index,
+            'transactions': [{'sender': 1, 'recipient': 2, 'amount': 3, 'fee': 1, 'size': 50, 'id': f'{index:016x}{t:016x}'}
+                             for t in range(transactions)],
+            'proof': index,
+            'previous_hash': last_hash,
+            'size': 50 * transactions,
+            'node': 'benchmark',
+        }
+        chain.append(block)
+        last_hash = block_hash(block)
+    return chain
+
+
+def bench(chain, parallel):
+    started = time()
+    hashes = validation.validate(chain, parallel=parallel)
+    seconds = time() - started
+    assert hashes is not None and len(hashes) == len(chain) - 1
+    return seconds
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--blocks', default=100000, type=int, help='length of the chain')
+    parser.add_argument('-t', '--transactions', default=10, type=int, help='transactions per block')
+    args = parser.parse_args()
+
+    chain = build_chain(args.blocks, args.transactions)
+
+    sequential = bench(chain, parallel=False)
+    parallel = bench(chain, parallel=True)
+    print(f'{args.blocks} blocks, {args.transactions} transactions each, {os.cpu_count()} cores')
+    print(f'sequential: {sequential:8.2f} s {args.blocks / sequential:12.0f} blocks/s')
+    print(f'parallel:   {parallel:8.2f} s {args.blocks / parallel:12.0f} blocks/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Runs a local cluster of managers and miners under a seeded transaction load
+and reports throughput, block interval, confirmation latency, orphaned blocks
+and CPU usage as JSON
+
+    $ pipenv run python benchmarks/cluster.py -n 2 -m 2 -d 60 -r 20 -o report.json
+    $ pipenv run python benchmarks/cluster.py --compare before.json after.json
+"""
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from time import sleep, time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def start_managers(count, base_port, min_fill, fill_timeout):
+    """
+    :return: List of (address, <subprocess.Popen>)
+    """
+    managers = []
+    for port in range(base_port, base_port + count):
+        command = [sys.executable, 'manager.py', '-p', str(port), '--min-fill', str(min_fill),
+                   '--fill-timeout', str(fill_timeout)]
+        # A session of its own, so the manager's worker processes are stopped with it
+        process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   start_new_session=True)
+        managers.append((f'127.0.0.1:{port}', process))
+    return managers
+
+
+def wait_until_up(session, addresses, timeout=30):
+    deadline = time() + timeout
+    for address in addresses:
+        while True:
+            try:
+                session.get(f'http://{address}/address', timeout=1)
+                break
+            except requests.exceptions.RequestException:
+                if time() > deadline:
+                    raise RuntimeError(f'Manager {address} did not start')
+                sleep(0.2)
+
+
+def connect(session, addresses, miners):
+    nodes = [f'http://0.0.0.0:{address.split(":")[1]}' for address in addresses]
+    for address in addresses:
+        session.post(f'http://{address}/nodes/register', json={'nodes': nodes})
+        if miners:
+            session.get(f'http://{address}/cluster/add_miner', params={'processes': miners})
+    for address in addresses:
+        session.get(f'http://{address}/cluster/start')
+
+
+def generate_load(session, addresses, rate, duration, seed):
+    """
+    Send transactions between the numbered test accounts at random times and
+    to random managers, all drawn from the seed. Test accounts have no keys nor
+    funds, so they go through /transactions/generate. The managers choose the ids.
+
+    :return: Dict of transaction id to the time it was sent
+    """
+    rng = random.Random(seed)
+    sent = dict()
+    started = time()
+    due = started
+    while due - started < duration:
+        due += rng.expovariate(rate)
+        transaction = {
+            'sender': rng.randint(1, 100),
+            'recipient': rng.randint(1, 100),
+            'amount': rng.randint(1, 1000),
+            'fee': rng.randint(0, 10),
+        }
+        address = rng.choice(addresses)
+
+        delay = due - time()
+        if delay > 0:
+            sleep(delay)
+        try:
+            r = session.post(f'http://{address}/transactions/generate', json={'transactions': [transaction]}, timeout=5)
+            for transaction_id in r.json()['ids']:
+                sent[transaction_id] = time()
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+    return sent
+
+
+def block_time(block):
+    timestamp = block['timestamp']
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()
+    return timestamp
+
+
+def scrape_metrics(session, address):
+    """
+    :return: Dict of metric name to the sum of its samples
+    """
+    totals = dict()
+    try:
+        text = session.get(f'http://{address}/metrics', timeout=5).text
+    except requests.exceptions.RequestException:
+        return totals
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        sample, value = line.rsplit(' ', 1)
+        name = sample.split('{', 1)[0]
+        totals[name] = totals.get(name, 0) + float(value)
+    return totals
+
+
+def process_tree_cpu(pids):
+    """
+    CPU seconds used by the processes and all their descendants, read from /proc
+
+    :return: <float>, None where /proc is not available
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    children = dict()
+    usage = dict()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        pid, parent = int(entry), int(fields[1])
+        children.setdefault(parent, []).append(pid)
+        usage[pid] = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    total = 0
+    pending = list(pids)
+    while pending:
+        pid = pending.pop()
+        total += usage.get(pid, 0)
+        pending.extend(children.get(pid, []))
+    return total
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def measure(session, addresses, sent, started, finished, cpu_seconds):
+    chain = session.get(f'http://{addresses[0]}/chain', timeout=30).json()['chain']
+    blocks = [block for block in chain[1:] if started <= block_time(block) <= finished]
+    times = [block_time(block) for block in blocks]
+    intervals = [later - earlier for earlier, later in zip(times, times[1:])]
+
+    latencies = []
+    confirmed = set()
+    duplicates = 0
+    for block in blocks:
+        for transaction in block['transactions']:
+            if transaction['id'] in confirmed:
+                duplicates += 1
+            elif transaction['id'] in sent:
+                confirmed.add(transaction['id'])
+                latencies.append(block_time(block) - sent[transaction['id']])
+
+    scraped = [scrape_metrics(session, address) for address in addresses]
+    mined = sum(metrics.get('manager_blocks_mined_total', 0) for metrics in scraped)
+    hashes = sum(metrics.get('supervisor_hashes_total', 0) for metrics in scraped)
+    duration = finished - started
+
+    return {
+        'duration': duration,
+        'transactions_sent': len(sent),
+        'transactions_confirmed': len(latencies),
+        'duplicate_confirmations': duplicates,
+        'throughput_tx_per_second': len(latencies) / duration,
+        'blocks': len(blocks),
+        'blocks_per_minute': 60 * len(blocks) / duration,
+        'block_interval_mean': statistics.mean(intervals) if intervals else None,
+        'block_interval_median': statistics.median(intervals) if intervals else None,
+        'confirmation_latency_median': percentile(latencies, 0.5),
+        'confirmation_latency_p95': percentile(latencies, 0.95),
+        'blocks_mined': mined,
+        'orphaned_blocks': max(mined - (len(chain) - 1), 0),
+        'hashes_per_second': hashes / duration,
+        'cpu_seconds': cpu_seconds,
+        'cpu_seconds_per_transaction': cpu_seconds / len(latencies) if cpu_seconds and latencies else None,
+    }
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    session = requests.Session()
+    managers = start_managers(args.managers, args.base_port, args.min_fill, args.fill_timeout)
+    addresses = [address for address, _ in managers]
+    pids = [process.pid for _, process in managers]
+    try:
+        wait_until_up(session, addresses)
+        connect(session, addresses, args.miners)
+
+        cpu_before = process_tree_cpu(pids)
+        started = time()
+        sent = generate_load(session, addresses, args.rate, args.duration, args.seed)
+
+        # Give the last transactions time to be mined
+        sleep(args.drain)
+        finished = time()
+        cpu_after = process_tree_cpu(pids)
+        cpu_seconds = cpu_after - cpu_before if cpu_before is not None else None
+
+        results = measure(session, addresses, sent, started, finished, cpu_seconds)
+    finally:
+        for _, process in managers:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for _, process in managers:
+            process.wait()
+
+    config = {key: getattr(args, key) for key in ('managers', 'miners', 'duration', 'rate', 'seed', 'min_fill',
+                                                  'fill_timeout', 'drain')}
+    config['cores'] = os.cpu_count()
+    return {'commit': commit(), 'config': config, 'results': results}
+
+
+def compare(paths):
+    reports = []
+    for path in paths:
+        with open(path) as report_file:
+            reports.append(json.load(report_file))
+
+    def cell(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return f'{value:.3f}'
+        return str(value)
+
+    rows = [('report', [os.path.basename(path) for path in paths]),
+            ('commit', [report['commit'] for report in reports])]
+    for key in reports[0]['config']:
+        rows.append((key, [report['config'].get(key) for report in reports]))
+    for key in reports[0]['results']:
+        rows.append((key, [report['results'].get(key) for report in reports]))
+
+    width = max(len(name) for name, _ in rows)
+    for name, values in rows:
+        print(f'{name:<{width}}  ' + ''.join(f'{cell(value):>16}' for value in values))
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--managers', default=2, type=int, help='manager nodes to start')
+    parser.add_argument('-m', '--miners', default=1, type=int, help='miner processes per manager')
+    parser.add_argument('-d', '--duration', default=60, type=float, help='seconds to send transactions for')
+    parser.add_argument('-r', '--rate', default=20, type=float, help='transactions per second')
+    parser.add_argument('-s', '--seed', default=1, type=int, help='seed of the transaction load')
+    parser.add_argument('--min-fill', default=0.5, type=float, help='fraction of a block to fill before mining it')
+    parser.add_argument('--fill-timeout', default=10, type=float, help='seconds to wait for a block to fill up')
+    parser.add_argument('--drain', default=15, type=float, help='seconds to keep mining after the load stops')
+    parser.add_argument('--base-port', default=5000, type=int, help='port of the first manager')
+    parser.add_argument('-o', '--output', help='file to write the JSON report to')
+    parser.add_argument('--compare', nargs='+', metavar='REPORT', help='print reports side by side instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,15 @@ from urllib.parse import urlparse
 from uuid import uuid4
 import random
 import threading
-import datetime
+import logging
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from blocks import block_hash, merkle_root, valid_body
+
+logger = logging.getLogger('blockchain')
+
 
 class Blockchain:
     def __init__(self):
@@ -17,6 +22,10 @@ class Blockchain:
         self.chain = []
         self.nodes = set()
 
+        # Hash of every block in the chain, computed once when the block is added
+        self.block_hashes = []
+        self.block_heights = dict()
+
         # Create the genesis block
         self.new_genesis_block(previous_hash='1', proof=100, block_transactions=[])
 
@@ -53,68 +62,151 @@ class Blockchain:
                 if node != node_address:
                     response = requests.post(url=f'http://{node}/nodes/register', json=payload, headers=headers)
 
-    def valid_chain(self, chain):
+    def valid_chain(self, chain, hashes=None):
         """
         Determine if a given blockchain is valid
 
         :param chain: A blockchain
+        :param hashes: Hashes of the blocks in the chain, computed if not given
         :return: True if valid, False if not
         """
 
+        if hashes is None:
+            hashes = [self.hash(block) for block in chain]
+
         last_block = chain[0]
         current_index = 1
 
         while current_index < len(chain):
             block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{block}')
-            print("\n-----------\n")
-            # Check that the hash of the block is correct
-            last_block_hash = self.hash(last_block)
-            if block['previous_hash'] != last_block_hash:
-                return False
-
-            # Check that the Proof of Work is correct
-            if not self.valid_proof(last_block['proof'], block['proof'], last_block_hash):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Validating block %s against block %s', block['index'], last_block['index'])
+            if not self.valid_link(last_block, hashes[current_index-1], block):
                 return False
 
             last_block = block
             current_index += 1
-
         return True
 
+    def valid_link(self, last_block, last_hash, block):
+        """
+        Determine if a block correctly follows the block before it
+
+        :param last_block: The previous block
+        :param last_hash: Hash of the previous block
+        :param block: The block
+        :return: True if valid, False if not
+        """
+
+        # Check that the hash of the block is correct
+        if block['previous_hash'] != last_hash:
+            return False
+
+        # Check that the transactions match the merkle root of the header
+        if not valid_body(block):
+            return False
+
+        # Check that the Proof of Work is correct
+        return self.valid_proof(last_block['proof'], block['proof'], last_hash)
+
     def resolve_conflicts(self):
         """
         This is our consensus algorithm, it resolves conflicts
         by replacing our chain with the longest one in the network.
 
+        Only the blocks we are missing are transferred, see missing_blocks().
+
         :return: True if our chain was replaced, False if not
         """
 
         neighbours = self.nodes
-        new_chain = None
+        new_blocks = None
+        new_hashes = None
+        fork_height = 0
 
         # We're only looking for chains longer than ours
         max_length = len(self.chain)
 
-        # Grab and verify the chains from all the nodes in our network
+        # Grab and verify the missing part of the chains from all the nodes in our network
         for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
+            result = self.missing_blocks(node, max_length)
+            if result:
+                fork_height, new_blocks, new_hashes = result
+                max_length = fork_height + len(new_blocks)
+
+        # Replace the divergent part of our chain if we discovered a new, valid chain longer than ours
+        if new_blocks:
+            self.truncate_chain(fork_height)
+            for block, block_hash in zip(new_blocks, new_hashes):
+                self.append_block(block, block_hash)
+            return True
+        return False
 
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
+    def missing_blocks(self, node, min_length):
+        """
+        Fetch the blocks of a neighbour's chain that are not in ours
 
-                # Check if the length is longer and the chain is valid
-                if length >= max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
+        Asks for the blocks above our own height first. If they do not link onto
+        our chain the neighbour is on a fork, so we step back exponentially until
+        a common ancestor is found, ending with the full chain at height 0.
 
-        # Replace our chain if we discovered a new, valid chain longer than ours
-        if new_chain:
-            self.chain = new_chain
-            return True
-        return False
+        :param node: Address of the neighbour node. Eg. '192.168.0.5:5000'
+        :param min_length: Only chains longer than this are of interest
+        :return: (fork height, blocks after the fork, their hashes) if valid, None if not
+        """
+
+        height = len(self.chain)
+        step = 1
+
+        while True:
+            response = requests.get(f'http://{node}/chain', params={'start': height, 'format': 'ndjson'}, stream=True)
+            if response.status_code != 200:
+                return None
+
+            with response:
+                result = self.read_blocks(response.iter_lines(), height, min_length)
+            if result != 'fork':
+                return result
+
+            height = max(0, height - step)
+            step *= 2
+
+    def read_blocks(self, lines, height, min_length):
+        """
+        Read and validate a neighbour's blocks one at a time as they are streamed
+
+        :param lines: NDJSON lines from /chain, a header followed by one block per line
+        :param height: Height the neighbour's blocks start above
+        :param min_length: Only chains longer than this are of interest
+        :return: (height, blocks, their hashes) if valid, 'fork' if the blocks
+                 do not link onto our chain at height, None if not valid
+        """
+
+        header = next(lines, None)
+        if not header or json.loads(header)['length'] <= min_length:
+            return None
+
+        last_block = self.chain[height-1] if height else None
+        last_hash = self.block_hashes[height-1] if height else None
+        blocks = []
+        hashes = []
+
+        for line in lines:
+            block = json.loads(line)
+            if last_block is not None:
+                if not blocks and block['previous_hash'] != last_hash:
+                    return 'fork'
+                if not self.valid_link(last_block, last_hash, block):
+                    return None
+
+            last_block = block
+            last_hash = self.hash(block)
+            blocks.append(block)
+            hashes.append(last_hash)
+
+        if not blocks:
+            return None
+        return height, blocks, hashes
 
     def compose_block_transactions(self):
         # Max size of block in "kilobytes"
@@ -155,15 +247,16 @@ class Blockchain:
 
             block = {
                 'index': len(self.chain) + 1,
-                'timestamp': datetime.datetime.now(),
+                'timestamp': time(),
                 'transactions': block_transactions,
                 'proof': proof,
                 'previous_hash': previous_hash or self.hash(self.chain[-1]),
                 'size': block_size,   # 2MB max size
+                'merkle_root': merkle_root([t['id'] for t in block_transactions]),
                 'node': node_identifier
             }
 
-            self.chain.append(block)
+            self.append_block(block)
             return block
     
     def new_genesis_block(self, proof, previous_hash, block_transactions):
@@ -179,9 +272,10 @@ class Blockchain:
                 'proof': proof,
                 'previous_hash': previous_hash or self.hash(self.chain[-1]),
                 'size': block_size,   # 2MB max size
+                'merkle_root': merkle_root([t['id'] for t in block_transactions]),
             }
 
-            self.chain.append(block)
+            self.append_block(block)
             return block
 
     def new_transaction(self, sender, recipient, amount):
@@ -214,19 +308,58 @@ class Blockchain:
             return self.chain[-1]
         return 0
 
+    def append_block(self, block, block_hash=None):
+        """
+        Append a block to the chain and index its hash
+
+        :param block: The block to append
+        :param block_hash: Hash of the block, computed if not given
+        """
+        if block_hash is None:
+            block_hash = self.hash(block)
+        self.chain.append(block)
+        self.block_hashes.append(block_hash)
+        self.block_heights[block_hash] = len(self.chain)
+
+    def truncate_chain(self, height):
+        """
+        Remove all blocks above a given height from the chain and the hash index
+
+        :param height: Number of blocks to keep
+        """
+        for block_hash in self.block_hashes[height:]:
+            self.block_heights.pop(block_hash, None)
+        del self.chain[height:]
+        del self.block_hashes[height:]
+
+    @property
+    def last_hash(self):
+        if self.block_hashes:
+            return self.block_hashes[-1]
+        return None
+
+    def block_by_hash(self, block_hash):
+        """
+        Look up a block in our chain by its hash
+
+        :param block_hash: <str> Hash of the block
+        :return: The block, or None if it is not in our chain
+        """
+        height = self.block_heights.get(block_hash)
+        if height is None:
+            return None
+        return self.chain[height-1]
+
     @staticmethod
     def hash(block):
         """
-        Creates a SHA-256 hash of a Block
+        Creates a SHA-256 hash of a Block's header
 
         :param block: Block
         """
+        return block_hash(block)
 
-        # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
-
-    def proof_of_work(self, last_block):
+    def proof_of_work(self, last_block, last_hash=None):
         """
         Simple Proof of Work Algorithm:
 
@@ -234,11 +367,13 @@ class Blockchain:
          - Where p is the previous proof, and p' is the new proof
          
         :param last_block: <dict> last Block
+        :param last_hash: <str> Hash of the last Block, computed if not given
         :return: <int>
         """
 
         last_proof = last_block['proof']
-        last_hash = self.hash(last_block)
+        if last_hash is None:
+            last_hash = self.hash(last_block)
 
         proof = 0
         while self.valid_proof(last_proof, proof, last_hash) is False:
@@ -294,10 +429,11 @@ class Mine(threading.Thread):
             if block_transactions:
                 # We run the proof of work algorithm to get the next proof...
                 last_block = blockchain.last_block
-                proof = blockchain.proof_of_work(last_block)
+                last_hash = blockchain.last_hash
+                proof = blockchain.proof_of_work(last_block, last_hash)
 
                 # Forge the new Block by adding it to the chain
-                previous_hash = blockchain.hash(last_block)
+                previous_hash = last_hash
                 block = blockchain.new_block(proof, previous_hash, block_transactions, node_identifier)
                 if block != None:
                     response = {
@@ -414,9 +550,27 @@ def sync_transactions(self):
 
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    # A page of the chain, Eg. ?start=100&limit=50. Syncing nodes ask for the blocks above their height
+    length = len(blockchain.chain)
+    start = max(request.args.get('start', default=request.args.get('from', default=0, type=int), type=int), 0)
+    limit = request.args.get('limit', default=length, type=int)
+    end = min(start + max(limit, 0), length)
+
+    # ?format=ndjson streams one block per line as it is serialized, after a header line
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            yield json.dumps({'length': length, 'start': start}) + '\n'
+            for height in range(start, end):
+                if height >= len(blockchain.chain):
+                    break
+                block = blockchain.chain[height]
+                yield json.dumps(block) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
     response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain),
+        'chain': blockchain.chain[start:end],
+        'length': length,
+        'start': start,
     }
     return jsonify(response), 200
 
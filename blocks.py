@@ -0,0 +1,109 @@
+import hashlib
+import json
+
+import encoding
+
+# Fields of a block covered by its hash, the transactions are covered through the merkle root
+HEADER_FIELDS = ('version', 'index', 'timestamp', 'previous_hash', 'merkle_root', 'proof', 'node', 'difficulty')
+
+# Format of new blocks. Blocks without a version have their header hashed as JSON,
+# from version 2 on the header is hashed in the binary encoding. From version 3 on
+# the miner's reward is a transaction of the block, see ledger.valid_rewards(). From
+# version 4 on the proof covers the whole header, see proofofwork.guess_prefix().
+# From version 5 on the header is hashed as JSON again, which the json module
+# encodes at about twice the rate of the pure Python binary encoder.
+BLOCK_VERSION = 5
+
+# Versions whose header is hashed in the binary encoding
+BINARY_HEADER_VERSIONS = range(2, 5)
+
+
+def merkle_root(transaction_ids):
+    """
+    Root of a Merkle tree over transaction ids. Each level hashes pairs of the
+    level below, the last hash of an odd level is paired with itself.
+
+    :param transaction_ids: Ids of the transactions, in block order
+    :return: <str> Hex digest of the root
+    """
+    level = [hashlib.sha256(transaction_id.encode()).digest() for transaction_id in transaction_ids]
+    if not level:
+        return '0' * 64
+
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i+1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def header(block):
+    """
+    The fixed-size part of a block that its hash covers. Blocks from before
+    headers existed are hashed whole, so their header is the whole block.
+
+    :param block: Block
+    :return: <dict>
+    """
+    if 'merkle_root' not in block:
+        return block
+    return {field: block[field] for field in HEADER_FIELDS if field in block}
+
+
+def body(block):
+    """
+    The part of a block that is transferred separately from its header
+
+    :param block: Block
+    :return: <dict>
+    """
+    return {'transactions': block['transactions'], 'size': block['size']}
+
+
+def valid_body(block):
+    """
+    Determine if the transactions of a block match its merkle root
+
+    :param block: Block with its transactions
+    :return: True if valid, False if not
+    """
+    if 'merkle_root' not in block:
+        return True
+    return merkle_root([transaction['id'] for transaction in block['transactions']]) == block['merkle_root']
+
+
+def header_bytes(block_header):
+    """
+    The bytes a header is hashed as, in the format of its version
+
+    :param block_header: Header of a block, or the part of it a proof covers
+    :return: <bytes>
+    """
+    if block_header.get('version', 1) in BINARY_HEADER_VERSIONS:
+        return encoding.encode(block_header)
+
+    # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
+    return json.dumps(block_header, sort_keys=True).encode()
+
+
+def block_hash(block):
+    """
+    Creates a SHA-256 hash of a Block, or of its header
+
+    :param block: Block
+    :return: <str> Hex digest of the hash
+    """
+    return hashlib.sha256(header_bytes(header(block))).hexdigest()
+
+
+def block_work(block):
+    """
+    Expected number of hashes it took to find the proof of a block. Blocks
+    mined before the difficulty was recorded were never checked and count as one.
+
+    :param block: Block or its header
+    :return: <int>
+    """
+    if 'difficulty' in block:
+        return 2 ** block['difficulty']
+    return 1
@@ -0,0 +1,481 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from threading import Lock, RLock, Thread
+from time import sleep, time
+
+from hashtable import HashTable
+
+# Index record of a block: segment number, offset and length of the block in the segment, block hash,
+# total work of the chain up to the block. Work is 2 ** difficulty per block with difficulties up to 256.
+RECORD = struct.Struct('>IQI32s40s')
+
+# Location of a transaction in the transactions table: height of its block, position in the block
+LOCATION = struct.Struct('>II')
+
+# State derived from the blocks, see BlockStore.save_checkpoint()
+CHECKPOINT = 'checkpoint.json'
+
+
+class BlockStore:
+    def __init__(self, directory, segment_size=64*1024*1024, cache_size=256, sync_every=32, sync_interval=1.0):
+        """
+        Append-only store of the chain on disk. Blocks are appended to segment
+        files and a fixed-size record per block is appended to an index file,
+        which is memory-mapped to find blocks by height. Hash tables on disk
+        find blocks by hash and, filled in by the owner of the store,
+        transactions by id, see StoreTransactions.
+
+        Writes are fsynced in batches, block data before the index, so after
+        a crash the index never points at data that did not reach the disk.
+        The mark of each table is the number of blocks it was flushed with,
+        the blocks after it are added to the table again on the next start.
+
+        :param directory: <str> Directory to keep the files in
+        :param segment_size: <int> Bytes after which a new segment file is started
+        :param cache_size: <int> Number of recent blocks kept in memory
+        :param sync_every: <int> Blocks written between fsyncs
+        :param sync_interval: <float> Max seconds a written block waits for its fsync
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.cache_size = cache_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self.lock = RLock()
+        self.checkpoint_lock = Lock()
+        self.cache = OrderedDict()
+        self.readers = dict()
+        self.unsynced = 0
+        self.last_sync = time()
+        self.pending_checkpoint = None
+        self.closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.dat')
+        self.recover()
+
+        self.index_file = open(self.index_path, 'ab')
+        self.segment_file = open(self.segment_path(self.segment), 'ab')
+        self.map_index()
+
+        # Block hash to height, counting the genesis block as 1
+        self.heights = HashTable(os.path.join(directory, 'heights.dat'), 32, 4)
+        # Transaction id digest to LOCATION
+        self.transactions = HashTable(os.path.join(directory, 'transactions.dat'), 16, LOCATION.size)
+        for height in range(min(self.heights.mark, self.length), self.length):
+            self.heights.put(self.record(height)[3], (height + 1).to_bytes(4, 'big'))
+
+        flusher = Thread(target=self.flush_loop, name='Block store flush', daemon=True)
+        flusher.start()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'blocks_{segment:05d}.dat')
+
+    def recover(self):
+        """
+        Drop whatever a crash left half written: a partial index record,
+        records of blocks whose data is missing and data no record points at
+        """
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'wb').close()
+
+        with open(self.index_path, 'r+b') as index:
+            length = os.path.getsize(self.index_path) // RECORD.size
+            while length:
+                index.seek((length-1) * RECORD.size)
+                segment, offset, size, _, _ = RECORD.unpack(index.read(RECORD.size))
+                path = self.segment_path(segment)
+                if os.path.exists(path) and os.path.getsize(path) >= offset + size:
+                    break
+                length -= 1
+            index.truncate(length * RECORD.size)
+
+        if length:
+            segment, offset, size, _, _ = self.read_record_file(length - 1)
+            end = offset + size
+        else:
+            segment, end = 0, 0
+        self.truncate_segments(segment, end)
+
+        self.length = length
+        self.segment = segment
+        self.segment_end = end
+
+    def read_record_file(self, height):
+        with open(self.index_path, 'rb') as index:
+            index.seek(height * RECORD.size)
+            return RECORD.unpack(index.read(RECORD.size))
+
+    def truncate_segments(self, segment, end):
+        """
+        Cut segment files so that segment ends at end and no later segment exists
+        """
+        path = self.segment_path(segment)
+        with open(path, 'ab') as segment_file:
+            segment_file.truncate(end)
+
+        later = segment + 1
+        while os.path.exists(self.segment_path(later)):
+            os.remove(self.segment_path(later))
+            later += 1
+
+    def map_index(self):
+        """
+        Memory-map the synced part of the index, records written after it are kept in tail
+        """
+        self.index_map = None
+        self.mapped = 0
+        self.tail = []
+        if self.length:
+            with open(self.index_path, 'rb') as index:
+                self.index_map = mmap.mmap(index.fileno(), self.length * RECORD.size, access=mmap.ACCESS_READ)
+            self.mapped = self.length
+
+    def record(self, height):
+        if height < self.mapped:
+            return RECORD.unpack_from(self.index_map, height * RECORD.size)
+        return self.tail[height - self.mapped]
+
+    def hash_at(self, height):
+        """
+        :param height: <int> Position of the block in the chain, 0 for the genesis block
+        :return: <str> Hash of the block
+        """
+        with self.lock:
+            return self.record(height)[3].hex()
+
+    def work_at(self, height):
+        """
+        :param height: <int> Position of the block in the chain, 0 for the genesis block
+        :return: <int> Total work of the chain up to and including the block
+        """
+        with self.lock:
+            return int.from_bytes(self.record(height)[4], 'big')
+
+    def height_of(self, block_hash):
+        """
+        :return: <int> Height of the block with the hash, counting the genesis block as 1, or None
+        """
+        with self.lock:
+            value = self.heights.get(bytes.fromhex(block_hash))
+            if value is None:
+                return None
+            # Entries of blocks a crash or truncate() removed may remain, the index has the last word
+            height = int.from_bytes(value, 'big')
+            if height > self.length or self.hash_at(height - 1) != block_hash:
+                return None
+            return height
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for height in range(self.length):
+            yield self[height]
+
+    def __getitem__(self, key):
+        with self.lock:
+            if isinstance(key, slice):
+                return [self.read(height) for height in range(*key.indices(self.length))]
+            if key < 0:
+                key += self.length
+            if not 0 <= key < self.length:
+                raise IndexError('block store index out of range')
+            return self.read(key)
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice) or key.stop is not None or key.step is not None:
+            raise TypeError('only the blocks above a height can be removed from a block store')
+        self.truncate(min(key.start or 0, self.length))
+
+    def read(self, height):
+        block = self.cache.get(height)
+        if block is not None:
+            self.cache.move_to_end(height)
+            return block
+
+        segment, offset, size, _, _ = self.record(height)
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = self.readers[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+        block = json.loads(os.pread(reader, size, offset))
+        self.cache_block(height, block)
+        return block
+
+    def cache_block(self, height, block):
+        self.cache[height] = block
+        self.cache.move_to_end(height)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def append(self, block, block_hash, work=0):
+        """
+        Append a block to the store
+
+        :param block: <dict> The block
+        :param block_hash: <str> Hash of the block
+        :param work: <int> Total work of the chain up to and including the block
+        """
+        data = json.dumps(block, sort_keys=True).encode()
+        with self.lock:
+            if self.segment_end and self.segment_end + len(data) > self.segment_size:
+                self.sync()
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_end = 0
+                self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+            self.segment_file.write(data)
+            self.segment_file.flush()
+            record = (self.segment, self.segment_end, len(data), bytes.fromhex(block_hash), work.to_bytes(40, 'big'))
+            self.index_file.write(RECORD.pack(*record))
+            self.index_file.flush()
+
+            self.tail.append(record)
+            self.segment_end += len(data)
+            self.heights.put(record[3], (self.length + 1).to_bytes(4, 'big'))
+            self.cache_block(self.length, block)
+            self.length += 1
+
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every:
+                self.sync()
+
+    def truncate(self, height):
+        """
+        Remove all blocks above a given height
+
+        :param height: <int> Number of blocks to keep
+        """
+        with self.lock:
+            if height >= self.length:
+                return
+
+            # The tables no longer cover the removed heights, whose blocks are replaced
+            removed = [self.record(number)[3] for number in range(height, self.length)]
+            for table in (self.heights, self.transactions):
+                table.mark = min(table.mark, height)
+                table.flush()
+            for number in range(height, self.length):
+                self.cache.pop(number, None)
+
+            segment, offset, _, _, _ = self.record(height)
+            self.index_file.close()
+            self.segment_file.close()
+            self.close_readers()
+            if self.index_map is not None:
+                self.index_map.close()
+
+            with open(self.index_path, 'r+b') as index:
+                index.truncate(height * RECORD.size)
+                os.fsync(index.fileno())
+            self.truncate_segments(segment, offset)
+
+            self.length = height
+            self.segment = segment
+            self.segment_end = offset
+            self.index_file = open(self.index_path, 'ab')
+            self.segment_file = open(self.segment_path(segment), 'ab')
+            self.map_index()
+            self.unsynced = 0
+
+            for block_hash in removed:
+                self.heights.delete(block_hash)
+
+    def sync(self):
+        """
+        Flush written blocks to disk, the data before the index that points at it,
+        then the tables and their marks
+        """
+        with self.lock:
+            if self.unsynced:
+                os.fsync(self.segment_file.fileno())
+                os.fsync(self.index_file.fileno())
+                if self.index_map is not None:
+                    self.index_map.close()
+                self.map_index()
+                self.unsynced = 0
+                self.last_sync = time()
+
+            for table in (self.heights, self.transactions):
+                table.flush()
+                if table.mark != self.length:
+                    table.mark = self.length
+                    table.flush()
+
+    def flush_loop(self):
+        while not self.closed:
+            sleep(self.sync_interval)
+            if self.unsynced and time() - self.last_sync >= self.sync_interval:
+                self.sync()
+            self.write_checkpoint()
+
+    def save_checkpoint(self, state):
+        """
+        Keep state derived from all blocks of the store, so it does not have to be
+        rebuilt from every block on the next start. Only the state is copied here,
+        the checkpoint is written by the flush thread, or on close(). It goes to a
+        new file that replaces the old one, a crash leaves one or the other.
+
+        :param state: JSON-serializable state as of the last block in the store, not changed afterwards
+        """
+        with self.lock:
+            height = self.length
+            last_hash = self.hash_at(height - 1) if height else None
+            self.pending_checkpoint = {'height': height, 'hash': last_hash, 'state': state}
+
+    def write_checkpoint(self):
+        """
+        Write the checkpoint saved last, if it was not written yet
+        """
+        with self.checkpoint_lock:
+            with self.lock:
+                checkpoint, self.pending_checkpoint = self.pending_checkpoint, None
+            if checkpoint is None:
+                return
+
+            path = os.path.join(self.directory, CHECKPOINT)
+            with open(path + '.tmp', 'w') as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
+            os.replace(path + '.tmp', path)
+
+    def load_checkpoint(self):
+        """
+        :return: (height, state) of the last checkpoint if the store still has the blocks
+                 it was taken at, (0, None) if not
+        """
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT)) as checkpoint:
+                checkpoint = json.load(checkpoint)
+        except (OSError, ValueError):
+            return 0, None
+
+        height = checkpoint['height']
+        with self.lock:
+            # Blocks lost in a crash or replaced since the checkpoint make it stale
+            if height > self.length or (height and self.hash_at(height - 1) != checkpoint['hash']):
+                return 0, None
+        return height, checkpoint['state']
+
+    def close_readers(self):
+        for reader in self.readers.values():
+            os.close(reader)
+        self.readers = dict()
+
+    def close(self):
+        self.write_checkpoint()
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.sync()
+            self.index_file.close()
+            self.segment_file.close()
+            self.close_readers()
+            self.heights.close()
+            self.transactions.close()
+
+
+class StoreList:
+    def __init__(self, store, read):
+        """
+        A field of the blocks of a store as a read-only list, read from its
+        index when asked for instead of being copied into memory
+
+        :param store: <BlockStore> The store
+        :param read: Reads the field by height, such as store.hash_at
+        """
+        self.store = store
+        self.read = read
+
+    def __len__(self):
+        return len(self.store)
+
+    def __iter__(self):
+        for height in range(len(self.store)):
+            yield self.read(height)
+
+    def __getitem__(self, key):
+        with self.store.lock:
+            length = len(self.store)
+            if isinstance(key, slice):
+                return [self.read(height) for height in range(*key.indices(length))]
+            if key < 0:
+                key += length
+            if not 0 <= key < length:
+                raise IndexError('block store index out of range')
+            return self.read(key)
+
+
+class StoreHeights:
+    def __init__(self, store):
+        """
+        The heights of the blocks of a store by hash, like the dict a chain
+        in memory keeps, read from the store's table on disk
+
+        :param store: <BlockStore> The store
+        """
+        self.store = store
+
+    def get(self, block_hash, default=None):
+        height = self.store.height_of(block_hash)
+        return default if height is None else height
+
+    def __contains__(self, block_hash):
+        return self.store.height_of(block_hash) is not None
+
+
+class StoreTransactions:
+    def __init__(self, store):
+        """
+        The location of each transaction of a store's blocks by id, like the
+        dict a chain in memory keeps, in the store's transactions table. Ids
+        are kept as digests, and an entry only counts if its block is still
+        in the store and has the transaction at that position, so entries of
+        blocks lost in a crash or replaced do no harm.
+
+        :param store: <BlockStore> The store
+        """
+        self.store = store
+
+    @staticmethod
+    def key(transaction_id):
+        return hashlib.sha256(transaction_id.encode()).digest()[:16]
+
+    def get(self, transaction_id, default=None):
+        """
+        :param transaction_id: <str> Id of the transaction
+        :return: (height, position) of the transaction, counting the genesis block as 1
+        """
+        if not isinstance(transaction_id, str):
+            return default
+        value = self.store.transactions.get(self.key(transaction_id))
+        if value is None:
+            return default
+
+        height, position = LOCATION.unpack(value)
+        with self.store.lock:
+            if height > len(self.store):
+                return default
+            transactions = self.store[height - 1]['transactions']
+        if position >= len(transactions) or transactions[position]['id'] != transaction_id:
+            return default
+        return height, position
+
+    def __contains__(self, transaction_id):
+        return self.get(transaction_id) is not None
+
+    def __setitem__(self, transaction_id, location):
+        self.store.transactions.put(self.key(transaction_id), LOCATION.pack(*location))
+
+    def pop(self, transaction_id, default=None):
+        location = self.get(transaction_id, default)
+        self.store.transactions.delete(self.key(transaction_id))
+        return location
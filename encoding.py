@@ -0,0 +1,224 @@
+import re
+import struct
+
+# Content type of request and response bodies in the binary encoding
+CONTENT_TYPE = 'application/x-blockchain'
+
+# Type tags
+NONE, FALSE, TRUE, INT, NEGATIVE_INT, FLOAT, STR, HEX, LIST, DICT = range(10)
+
+# Keys of blocks, transactions and messages written as a number instead of their name.
+# Codes are never reused or reordered, new keys are appended.
+KEYS = (
+    'index', 'timestamp', 'transactions', 'proof', 'previous_hash', 'size', 'merkle_root', 'node', 'difficulty',
+    'version', 'sender', 'recipient', 'amount', 'fee', 'id', 'signature', 'public_key', 'chain', 'length', 'start',
+    'last_block', 'last_hash', 'interval', 'start_value', 'count', 'round', 'block', 'sent', 'headers', 'bodies',
+    'nonce',
+)
+KEY_CODES = {key: code for code, key in enumerate(KEYS)}
+
+FLOAT_FORMAT = struct.Struct('>d')
+
+# Lists and dicts nested deeper than this are not decoded, blocks and messages nest a few levels at most
+MAX_DEPTH = 32
+
+# Strings of lowercase hex digits, such as hashes and ids, are written as the bytes they spell
+HEX_STRING = re.compile('(?:[0-9a-f]{2})+')
+
+
+class Encoder:
+    def __init__(self):
+        self.out = bytearray()
+        self.encoders = {
+            type(None): self.encode_none,
+            bool: self.encode_bool,
+            int: self.encode_int,
+            float: self.encode_float,
+            str: self.encode_str,
+            list: self.encode_list,
+            tuple: self.encode_list,
+            dict: self.encode_dict,
+        }
+
+    def varint(self, number):
+        out = self.out
+        while number > 0x7f:
+            out.append((number & 0x7f) | 0x80)
+            number >>= 7
+        out.append(number)
+
+    def encode(self, value):
+        encoder = self.encoders.get(type(value))
+        if encoder is None:
+            raise TypeError(f'Object of type {type(value).__name__} can not be encoded')
+        encoder(value)
+
+    def encode_none(self, value):
+        self.out.append(NONE)
+
+    def encode_bool(self, value):
+        self.out.append(TRUE if value else FALSE)
+
+    def encode_int(self, value):
+        if value >= 0:
+            self.out.append(INT)
+            self.varint(value)
+        else:
+            self.out.append(NEGATIVE_INT)
+            self.varint(-value - 1)
+
+    def encode_float(self, value):
+        self.out.append(FLOAT)
+        self.out += FLOAT_FORMAT.pack(value)
+
+    def encode_str(self, value):
+        if HEX_STRING.fullmatch(value):
+            data = bytes.fromhex(value)
+            self.out.append(HEX)
+        else:
+            data = value.encode()
+            self.out.append(STR)
+        self.varint(len(data))
+        self.out += data
+
+    def encode_list(self, value):
+        self.out.append(LIST)
+        self.varint(len(value))
+        for item in value:
+            self.encode(item)
+
+    def encode_dict(self, value):
+        self.out.append(DICT)
+        self.varint(len(value))
+        for key in sorted(value):
+            code = KEY_CODES.get(key)
+            if code is not None:
+                self.varint(code << 1)
+            elif isinstance(key, str):
+                data = key.encode()
+                self.varint(len(data) << 1 | 1)
+                self.out += data
+            else:
+                raise TypeError(f'Keys must be str, not {type(key).__name__}')
+            self.encode(value[key])
+
+
+class Decoder:
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.position = 0
+
+    def varint(self):
+        data = self.data
+        number = 0
+        shift = 0
+        while True:
+            byte = data[self.position]
+            self.position += 1
+            number |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def take(self, length):
+        start = self.position
+        self.position += length
+        if self.position > len(self.data):
+            raise ValueError('Truncated data')
+        return self.data[start:self.position]
+
+    def decode(self, depth=0):
+        tag = self.data[self.position]
+        self.position += 1
+        if tag in (DICT, LIST) and depth >= MAX_DEPTH:
+            raise ValueError('Nested too deeply')
+        if tag == DICT:
+            value = dict()
+            for _ in range(self.varint()):
+                key = self.varint()
+                if key & 1:
+                    key = self.take(key >> 1).decode()
+                else:
+                    key = KEYS[key >> 1]
+                value[key] = self.decode(depth + 1)
+            return value
+        if tag == STR:
+            return self.take(self.varint()).decode()
+        if tag == HEX:
+            return self.take(self.varint()).hex()
+        if tag == INT:
+            return self.varint()
+        if tag == LIST:
+            return [self.decode(depth + 1) for _ in range(self.varint())]
+        if tag == NEGATIVE_INT:
+            return -self.varint() - 1
+        if tag == FLOAT:
+            return FLOAT_FORMAT.unpack(self.take(FLOAT_FORMAT.size))[0]
+        if tag == NONE:
+            return None
+        if tag == FALSE:
+            return False
+        if tag == TRUE:
+            return True
+        raise ValueError(f'Unknown type tag {tag}')
+
+
+def encode(value):
+    """
+    Canonical binary encoding of a block, transaction or message in their JSON form.
+    Equal values always give the same bytes: keys are sorted and numbers
+    are written in their shortest form.
+
+    :param value: None, bool, int, float, str, list or dict of these with str keys
+    :return: <bytes>
+    """
+    encoder = Encoder()
+    encoder.encode(value)
+    return bytes(encoder.out)
+
+
+def decode(data):
+    """
+    The JSON form of a value from its binary encoding
+
+    :param data: <bytes> Output of encode()
+    :return: The value
+    """
+    decoder = Decoder(data)
+    try:
+        value = decoder.decode()
+    except (IndexError, UnicodeDecodeError) as error:
+        raise ValueError(f'Invalid encoding: {error}')
+    if decoder.position != len(decoder.data):
+        raise ValueError('Trailing data after encoded value')
+    return value
+
+
+def decode_request(request):
+    """
+    The body of a request, in the binary encoding or JSON depending on its content type
+
+    :param request: <flask.Request>
+    :return: The value, None if the body is missing or invalid
+    """
+    if request.mimetype == CONTENT_TYPE:
+        try:
+            return decode(request.get_data())
+        except ValueError:
+            return None
+    return request.get_json(silent=True)
+
+
+def wants_binary(request):
+    """
+    :return: True if a request asked for a response in the binary encoding,
+             with ?format=binary or an Accept header
+    """
+    return request.args.get('format') == 'binary' or request.accept_mimetypes.best == CONTENT_TYPE
+
+
+def response(value, status=200):
+    """
+    A Flask response with the value in the binary encoding
+    """
+    return encode(value), status, {'Content-Type': CONTENT_TYPE}
@@ -0,0 +1,180 @@
+import mmap
+import os
+import struct
+from threading import RLock
+
+# File header: number of slots, number of keys in use, mark of the owner
+HEADER = struct.Struct('>QQQ')
+
+
+class HashTable:
+    def __init__(self, path, key_size, value_size, capacity=1 << 16):
+        """
+        Hash table of fixed-size keys and values kept in a memory-mapped file,
+        so lookups do not need the table in memory and it survives restarts.
+        Keys must already be uniformly distributed, like hashes, their first
+        bytes choose the slot. Collisions probe the following slots.
+
+        The table doubles when it is half full, rewriting the file once.
+        The mark is a number kept in the header for the owner of the table,
+        such as how many blocks of a chain the table is known to cover.
+
+        :param path: <str> File of the table
+        :param key_size: <int> Bytes per key
+        :param value_size: <int> Bytes per value
+        :param capacity: <int> Slots of a new table, a power of two
+        """
+        self.path = path
+        self.key_size = key_size
+        self.value_size = value_size
+        # Slot: 1 if in use, key, value
+        self.slot = struct.Struct(f'>B{key_size}s{value_size}s')
+        self.lock = RLock()
+
+        if not os.path.exists(path) or not self.valid_file():
+            self.create(path, capacity)
+        self.open()
+
+    def valid_file(self):
+        with open(self.path, 'rb') as table:
+            header = table.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return False
+        capacity, _, _ = HEADER.unpack(header)
+        return capacity > 0 and os.path.getsize(self.path) == HEADER.size + capacity * self.slot.size
+
+    def create(self, path, capacity, mark=0):
+        with open(path, 'wb') as table:
+            table.write(HEADER.pack(capacity, 0, mark))
+            table.truncate(HEADER.size + capacity * self.slot.size)
+
+    def open(self):
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.capacity, self.count, self.mark_value = HEADER.unpack_from(self.map, 0)
+
+    def write_header(self):
+        HEADER.pack_into(self.map, 0, self.capacity, self.count, self.mark_value)
+
+    @property
+    def mark(self):
+        return self.mark_value
+
+    @mark.setter
+    def mark(self, value):
+        with self.lock:
+            self.mark_value = value
+            self.write_header()
+
+    def __len__(self):
+        return self.count
+
+    def offset(self, number):
+        return HEADER.size + number * self.slot.size
+
+    def home(self, key):
+        return int.from_bytes(key[:8], 'big') & (self.capacity - 1)
+
+    def find(self, key):
+        """
+        :return: (slot number, True) where the key is, or (first free slot on its probe, False)
+        """
+        number = self.home(key)
+        while True:
+            used, slot_key, _ = self.slot.unpack_from(self.map, self.offset(number))
+            if not used:
+                return number, False
+            if slot_key == key:
+                return number, True
+            number = (number + 1) & (self.capacity - 1)
+
+    def get(self, key):
+        """
+        :param key: <bytes> Key of key_size bytes
+        :return: <bytes> Its value, None if the key is not in the table
+        """
+        with self.lock:
+            number, found = self.find(key)
+            if not found:
+                return None
+            return self.slot.unpack_from(self.map, self.offset(number))[2]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def put(self, key, value):
+        """
+        Add a key or replace its value
+
+        :param key: <bytes> Key of key_size bytes
+        :param value: <bytes> Value of value_size bytes
+        """
+        with self.lock:
+            number, found = self.find(key)
+            if not found and 2 * (self.count + 1) > self.capacity:
+                self.grow()
+                number, found = self.find(key)
+            self.slot.pack_into(self.map, self.offset(number), 1, key, value)
+            if not found:
+                self.count += 1
+                self.write_header()
+
+    def delete(self, key):
+        """
+        Remove a key. The keys after it on its probe that could sit in
+        its slot are moved back, so no probe meets a gap before its key.
+
+        :param key: <bytes> Key of key_size bytes
+        :return: True if the key was in the table
+        """
+        with self.lock:
+            empty, found = self.find(key)
+            if not found:
+                return False
+
+            mask = self.capacity - 1
+            number = empty
+            while True:
+                number = (number + 1) & mask
+                slot = self.slot.unpack_from(self.map, self.offset(number))
+                if not slot[0]:
+                    break
+                # A key may move back to the empty slot unless its home lies between the two
+                if (number - self.home(slot[1])) & mask >= (number - empty) & mask:
+                    self.slot.pack_into(self.map, self.offset(empty), *slot)
+                    empty = number
+
+            self.slot.pack_into(self.map, self.offset(empty), 0, bytes(self.key_size), bytes(self.value_size))
+            self.count -= 1
+            self.write_header()
+            return True
+
+    def grow(self):
+        """
+        Copy the table to a file with twice the slots, which replaces this one once complete
+        """
+        path = self.path + '.tmp'
+        self.create(path, self.capacity * 2, self.mark_value)
+        larger = HashTable(path, self.key_size, self.value_size)
+        for number in range(self.capacity):
+            used, key, value = self.slot.unpack_from(self.map, self.offset(number))
+            if used:
+                larger.put(key, value)
+        larger.flush()
+        larger.close()
+
+        self.close()
+        os.replace(path, self.path)
+        self.open()
+
+    def flush(self):
+        """
+        Write the changes to disk
+        """
+        with self.lock:
+            self.map.flush()
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+            self.file.close()
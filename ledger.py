@@ -0,0 +1,168 @@
+import os
+from numbers import Real
+
+# Sender of the transactions that create new coins, such as mining rewards
+MINT = '0'
+
+# New coins paid to the miner of a block
+BLOCK_REWARD = 1
+
+
+def address(value):
+    """
+    Addresses arrive as numbers from the generator and as strings from clients, both are the same account
+
+    :param value: Sender or recipient of a transaction
+    :return: <str>
+    """
+    return str(value)
+
+
+def test_account(sender):
+    """
+    Numbered accounts, as made by /transactions/generate, are not owned by
+    anyone. They send without a signature and without funds, so they may only
+    pay each other: see valid_test_transfer().
+
+    :param sender: Sender of a transaction
+    :return: True if the sender is a numbered test account
+    """
+    return isinstance(sender, int) and not isinstance(sender, bool) and sender > 0
+
+
+def valid_test_transfer(transaction):
+    """
+    Coins of test accounts come from nowhere, they must not reach an account
+    that anyone could spend from
+
+    :param transaction: <dict> Transaction
+    :return: False if a test account pays an account that is not a test account
+    """
+    return not test_account(transaction['sender']) or test_account(transaction['recipient'])
+
+
+def spent(transaction):
+    """
+    :param transaction: <dict> Transaction
+    :return: Amount the sender pays with the transaction, fee included. Nothing for new coins.
+    """
+    if address(transaction.get('sender', MINT)) == MINT:
+        return 0
+    return transaction.get('amount', 0) + transaction.get('fee', 0)
+
+
+def valid_amounts(transaction):
+    """
+    :param transaction: <dict> Transaction
+    :return: True if the amount is positive and the fee is not negative
+    """
+    amount = transaction.get('amount')
+    fee = transaction.get('fee', 0)
+    return (isinstance(amount, Real) and not isinstance(amount, bool) and amount > 0
+            and isinstance(fee, Real) and not isinstance(fee, bool) and fee >= 0)
+
+
+def valid_transaction(transaction):
+    """
+    Determine if a transaction of a block has every field the chain's indexes
+    and balances use, with values of the right types
+
+    :param transaction: Transaction, as sent by a neighbour
+    :return: True if valid, False if not
+    """
+    if not isinstance(transaction, dict) or not all(k in transaction for k in ('sender', 'recipient', 'amount', 'size', 'id')):
+        return False
+    size = transaction['size']
+    return (valid_amounts(transaction) and isinstance(transaction['id'], str)
+            and isinstance(size, int) and not isinstance(size, bool) and size >= 0)
+
+
+def reward_transaction(recipient):
+    """
+    The transaction paying the miner of a block, the first one of the block
+
+    :param recipient: Address of the miner
+    :return: <dict> Transaction
+    """
+    return {
+        'sender': MINT,
+        'recipient': recipient,
+        'amount': BLOCK_REWARD,
+        'fee': 0,
+        'size': 0,
+        'id': os.urandom(16).hex(),
+    }
+
+
+def valid_rewards(block):
+    """
+    A block creates at most one reward of new coins, which its miner adds.
+    Blocks from before versions existed got their rewards through the pool,
+    validation.valid_link() keeps versioned blocks from dropping to older formats.
+
+    :param block: The block
+    :return: True if the block does not create more coins than it may
+    """
+    if 'version' not in block:
+        return True
+    mints = [transaction for transaction in block['transactions'] if address(transaction['sender']) == MINT]
+    return len(mints) <= 1 and all(t.get('amount') == BLOCK_REWARD and not t.get('fee') for t in mints)
+
+
+class Balances:
+    def __init__(self, balances=None):
+        """
+        Balance of every address in the chain, updated block by block as the
+        chain grows and shrinks so no lookup has to scan the chain. Fees are
+        paid to the node that mined the block, except the fees of test accounts
+        which have no funds to pay them from.
+
+        :param balances: <dict> Balances by address to start from, as in a checkpoint
+        """
+        self.balances = balances or dict()
+
+    def __len__(self):
+        return len(self.balances)
+
+    def balance(self, account):
+        """
+        :param account: Address
+        :return: Balance of the address, 0 if it never appeared in the chain
+        """
+        return self.balances.get(address(account), 0)
+
+    def credit(self, account, amount):
+        account = address(account)
+        balance = self.balances.get(account, 0) + amount
+        if balance:
+            self.balances[account] = balance
+        else:
+            # Accounts that are back to nothing take no space
+            self.balances.pop(account, None)
+
+    def apply_block(self, block, sign=1):
+        """
+        Apply the transactions of a block appended to the chain
+
+        :param block: The block
+        :param sign: -1 reverts the block instead
+        """
+        fees = 0
+        for transaction in block['transactions']:
+            paid = spent(transaction)
+            if paid:
+                self.credit(transaction['sender'], -sign * paid)
+                if not test_account(transaction['sender']):
+                    fees += transaction.get('fee', 0)
+            self.credit(transaction['recipient'], sign * transaction['amount'])
+
+        if fees:
+            self.credit(block.get('node', MINT), sign * fees)
+
+    def revert_block(self, block):
+        """
+        Undo apply_block() for a block removed from the top of the chain
+
+        :param block: The block
+        """
+        self.apply_block(block, sign=-1)
@@ -3,6 +3,8 @@ from flask import Flask, jsonify, request
 
 import csv
 from datetime import datetime
+from threading import Lock, Thread
+from time import sleep
 
 app = Flask(__name__)
 
@@ -10,22 +12,49 @@ timestamp = datetime.now()
 timestamp = timestamp.strftime('%Y-%m-%d_%H:%M:%S')
 current_file = f'tmp/cluster_data_{timestamp}.tsv'
 
-with open(current_file, 'a+') as out_file:
-    tsv_writer = csv.writer(out_file, delimiter='\t')
-    tsv_writer.writerow(['Chain Height', 'Transaction pool size', 'Miner id', 'Manager id', 'Timestamp'])
+# One buffered writer for all reports, flushed to disk on a timer
+out_file = open(current_file, 'a+', newline='')
+tsv_writer = csv.writer(out_file, delimiter='\t')
+tsv_writer.writerow(['Chain Height', 'Transaction pool size', 'Miner id', 'Manager id', 'Timestamp'])
+write_lock = Lock()
+
+# Seconds between flushes of the file
+flush_interval = 1.0
+
+
+class Flush(Thread):
+    def __init__(self, task_id):
+        Thread.__init__(self)
+        self.task_id = task_id
+
+    def run(self):
+        while True:
+            sleep(flush_interval)
+            with write_lock:
+                out_file.flush()
+
 
 @app.route('/report', methods=['POST'])
 def report():
     data = request.get_json()
+    if data is None:
+        return 'Missing values', 400
 
-    with open(current_file, 'a') as out_file:
-        tsv_writer = csv.writer(out_file, delimiter='\t')
-        tsv_writer.writerow([data['chain_height'], data['transaction_pool_size'], data['miner_id'], data['manager_id'], data['time']])
-    return 'Data logged!', 200
+    # Managers send {'reports': [...]}, a single report is accepted as well
+    reports = data.get('reports', [data])
+    rows = [[r['chain_height'], r['transaction_pool_size'], r['miner_id'], r['manager_id'], r['time']] for r in reports]
+    with write_lock:
+        tsv_writer.writerows(rows)
+    return f'{len(rows)} reports logged!', 200
 
 
 def main():
-    app.run(host='0.0.0.0', port=4000, threaded=False)
+    flush_task = Flush(task_id=1)
+    flush_task.setName('Flush reports')
+    flush_task.daemon = True
+    flush_task.start()
+
+    app.run(host='0.0.0.0', port=4000, threaded=True)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,30 +1,93 @@
-import hashlib
 import json
 from time import time
 from time import sleep
 from urllib.parse import urlparse
 from uuid import uuid4
 import random
-from threading import Thread
+from threading import Thread, Lock
 from datetime import datetime
 import subprocess
-import miner
-import importlib
 import os
+import logging
 from pathlib import Path
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
+from werkzeug.routing import BaseConverter
+
+import encoding
+import metrics
+import outbound
+import proofofwork
+import validation
+from blocks import BLOCK_VERSION, block_hash, block_work, body, header, merkle_root, valid_body
+from blockstore import BlockStore, StoreHeights, StoreList, StoreTransactions
+from ledger import (MINT, Balances, address, reward_transaction, spent, test_account, valid_amounts, valid_rewards,
+                    valid_test_transfer, valid_transaction)
+from mempool import Mempool
+from reporter import Reporter
+from scheduler import NonceScheduler
+from signatures import Verifier, transaction_id
+from supervisor import MinerSupervisor
+from workchannel import WorkChannel
+
+blocks_mined = metrics.counter('manager_blocks_mined_total', 'Blocks found by our cluster and added to the chain')
+blocks_received = metrics.counter('manager_blocks_received_total', 'Blocks announced by neighbours and added to the chain')
+template_seconds = metrics.histogram('manager_block_template_seconds', 'Time from handing out a block template to accepting its block')
+propagation_seconds = metrics.histogram('manager_block_propagation_seconds', 'Time from a neighbour announcing a block to receiving it')
+resolve_seconds = metrics.histogram('manager_resolve_conflicts_seconds', 'Time taken to sync the chain with the neighbours')
+reorganized_blocks = metrics.counter('manager_reorganized_blocks_total', 'Blocks of our chain replaced by a branch of more work')
+restored_transactions = metrics.counter('manager_restored_transactions_total', 'Transactions returned to the pool from replaced blocks')
+
+# Raised while reading what a neighbour streams: JSON that is not valid or not shaped like
+# blocks, or a connection that breaks off
+NEIGHBOUR_ERRORS = (ValueError, KeyError, TypeError, AttributeError, IndexError, requests.exceptions.RequestException)
 
 class Blockchain:
     def __init__(self):
-        self.current_transactions = dict()
+        self.current_transactions = Mempool()
         self.chain = []
         self.nodes = set()
+
+        # Hash of every block in the chain, computed once when the block is added
+        self.block_hashes = []
+        self.block_heights = dict()
+
+        # Total work of the chain up to every block, see block_work()
+        self.chain_work = []
+
+        # Height of the block and position in it of every transaction in the chain, by id
+        self.transaction_index = dict()
+
+        # Balance of every address, follows the chain block by block
+        self.balances = Balances()
+
+        # Checks the signatures of new transactions and remembers the valid ones
+        self.verifier = Verifier()
+
+        # Ids of new transactions waiting to be announced to the neighbours
+        self.announcements = []
+        self.announce_lock = Lock()
+        # Ids of the miner nodes polling us for work, miners are never contacted by address
         self.slave_nodes = set()
         self.address = ''
         self.cluster_start_port = 0
 
+        # Max size of block in "kilobytes"
+        self.max_block_size = 2000
+
+        # Blocks appended between checkpoints of the balances, when the chain is kept in a block store
+        self.checkpoint_every = 1000
+
+        # Blocks asked for per request when syncing, a branch is validated and staged a page at a time
+        self.sync_page = 2000
+        self.staging_store = None
+
+        # Blocks filled less than this fraction are only mined once the
+        # oldest pending transaction has waited block_fill_timeout seconds
+        self.min_block_fill = 0.5
+        self.block_fill_timeout = 10
+
         # Create the genesis block
         self.new_genesis_block(previous_hash='1', proof=100, block_transactions=[])
 
@@ -56,126 +119,352 @@ class Blockchain:
         Spread node list to neighbor nodes
         """
         # TODO: Ability to remove adress completely from network
-        neighbors = self.nodes
+        neighbors = list(self.nodes)
         if len(neighbors) > 1:
-            payload = {'nodes': list(neighbors)}
+            payload = {'nodes': neighbors}
             headers = {'content-type': 'application/json'}
-            for node in neighbors:
-                # Do not request node list from itself
-                if node != self.address:
-                    requests.post(url=f'http://{node}/nodes/register', json=payload, headers=headers)
-
+            # Do not request node list from itself
+            urls = [f'http://{node}/nodes/register' for node in self.neighbours()]
+            outbound.client.fan_out('POST', urls, json=payload, headers=headers)
 
-    @staticmethod
-    def valid_proof(last_proof, proof, last_hash):
+    def neighbours(self):
         """
-        Validates the Proof
-
-        :param last_proof: <int> Previous Proof
-        :param proof: <int> Current Proof
-        :param last_hash: <str> The hash of the Previous Block
-        :return: <bool> True if correct, False if not.
+        :return: The other manager nodes in the network
         """
+        return [node for node in list(self.nodes) if node != self.address]
 
-        guess = f'{last_proof}{proof}{last_hash}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        #return guess_hash[:2] == "00"
-        return True           # Hash made easy to simulate mining
-    
 
-    def valid_chain(self, chain):
+    def valid_chain(self, chain, hashes=None):
         """
         Determine if a given manager is valid
 
         :param chain: A manager
+        :param hashes: Hashes of the blocks in the chain, computed if not given
         :return: True if valid, False if not
         """
 
-        last_block = chain[0]
-        current_index = 1
-
-        while current_index < len(chain):
-            block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{block}')
-            print("\n-----------\n")
-            # Check that the hash of the block is correct
-            last_block_hash = self.hash(last_block)
-            if block['previous_hash'] != last_block_hash:
-                return False
+        first_hash = hashes[0] if hashes else None
+        return validation.validate(chain, first_hash) is not None
 
-            # Check that the Proof of Work is correct
-            # TODO: FIX!!!!!!!!!
-            if not self.valid_proof(last_block['proof'], block['proof'], last_block_hash):
-                return False
+    def valid_link(self, last_block, last_hash, block):
+        """
+        Determine if a block correctly follows the block before it
 
-            last_block = block
-            current_index += 1
-        return True
+        :param last_block: The previous block
+        :param last_hash: Hash of the previous block
+        :param block: The block
+        :return: True if valid, False if not
+        """
+        return validation.valid_link(last_block, last_hash, block)
 
     def resolve_conflicts(self):
         """
         This is our consensus algorithm, it resolves conflicts
-        by replacing our chain with the longest one in the network.
+        by replacing our chain with the one of the most work in the network.
+
+        Only the headers we are missing are transferred from every neighbour,
+        see missing_headers(). The blocks are then fetched only from the
+        neighbour with the most work, see stage_branch(). Both go a page at a
+        time, so the memory a sync takes does not grow with the branch.
 
         :return: True if our chain was replaced, False if not
         """
 
-        neighbours = self.nodes
-        new_chain = None
+        with resolve_seconds.time():
+            neighbours = outbound.client.by_latency(self.neighbours())
+
+            # We're only looking for chains with more work than ours
+            max_work = self.total_work()
+
+            # Grab and verify the missing headers of the chains from all the nodes in our network at once
+            results = outbound.client.map(lambda node: (node, self.missing_headers(node, max_work)), neighbours)
+            candidates = [(result[1], node, result[0]) for node, result in results if result]
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+            # Replace the divergent part of our chain with the chain of the most work whose blocks we can get
+            for _, node, fork_height in candidates:
+                branch = self.stage_branch(node, fork_height)
+                if branch is None:
+                    continue
 
-        # We're only looking for chains longer than ours
-        max_length = len(self.chain)
+                new_blocks, hashes = branch
+                self.reorganize(fork_height, new_blocks, hashes)
+                if isinstance(new_blocks, BlockStore):
+                    del new_blocks[0:]
+                return True
+            return False
 
-        # Grab and verify the chains from all the nodes in our network
-        for node in neighbours:
-            if node != self.address:
-                response = requests.get(f'http://{node}/chain')
+    def reorganize(self, fork_height, new_blocks, hashes):
+        """
+        Replace the blocks above the fork point with the blocks of another branch.
+        Only the divergent blocks are touched, the indexes follow them block by block.
+        Transactions of the dropped blocks go back to the pool, the ones the new
+        branch includes leave the pool again as its blocks are appended.
+
+        :param fork_height: Number of blocks both branches share
+        :param new_blocks: The blocks of the other branch above the fork point, read one at a time
+        :param hashes: Hashes of new_blocks
+        """
+        restored = []
+        # Dropped from the top a page at a time, a long branch of ours is never read at once
+        while len(self.chain) > fork_height:
+            dropped = self.truncate_chain(max(fork_height, len(self.chain) - self.sync_page))
+            reorganized_blocks.inc(len(dropped))
+            for block in dropped:
+                # The rewards of the dropped blocks were never earned
+                restored += [transaction['id'] for transaction in block['transactions']
+                             if address(transaction['sender']) != MINT and self.add_transaction(transaction)]
+
+        for block, block_hash in zip(new_blocks, hashes):
+            self.append_block(block, block_hash)
+            for transaction in block['transactions']:
+                self.current_transactions.pop(transaction['id'])
+
+        restored_transactions.inc(sum(1 for transaction_id in restored if transaction_id in self.current_transactions))
 
-                if response.status_code == requests.codes.ok:
-                    length = response.json()['length']
-                    chain = response.json()['chain']
+    def missing_headers(self, node, min_work):
+        """
+        Walk the headers of a neighbour's chain that are not in ours, a page at a time
 
-                    # Check if the length is longer and the chain is valid
-                    if length >= max_length and self.valid_chain(chain):
-                        max_length = length
-                        new_chain = chain
+        Asks for the headers above our own height first. If they do not link onto
+        our chain the neighbour is on a fork, so we step back exponentially until
+        a common ancestor is found, ending with the full chain at height 0. Each
+        page is validated against the last header of the page before, which is
+        all that is kept of it.
 
-        # Replace our chain if we discovered a new, valid chain longer than ours
-        if new_chain:
-            self.chain = new_chain
-            return True
-        return False
+        :param node: Address of the neighbour node. Eg. '192.168.0.5:5000'
+        :param min_work: Only chains of more work than this are of interest
+        :return: (fork height, total work of the neighbour's chain) if valid and of more work, None if not
+        """
+
+        height = len(self.chain)
+        step = 1
+        while True:
+            page = self.read_page(node, 'headers', height, lambda lines: self.read_blocks(lines, height, min_work))
+            if page != 'fork':
+                break
+            height = max(0, height - step)
+            step *= 2
+
+        fork_height = None
+        work = 0
+        while page:
+            length, headers, hashes = page
+            for block_header, block_hash in zip(headers, hashes):
+                # Stepping back may have gone below the fork, the blocks we share are not part of the branch
+                if fork_height is None:
+                    if height < len(self.block_hashes) and block_hash == self.block_hashes[height]:
+                        height += 1
+                        continue
+                    fork_height = height
+                    work = self.work_at(height)
+                work += block_work(block_header)
+                height += 1
+
+            if not headers or height >= length:
+                break
+            last = headers[-1], hashes[-1]
+            page = self.read_page(node, 'headers', height, lambda lines: self.read_blocks(lines, height, min_work, last))
+
+        if page is None or fork_height is None or work <= min_work:
+            return None
+        return fork_height, work
+
+    def stage_branch(self, node, fork_height):
+        """
+        Fetch the blocks of a neighbour's branch above the fork point a page at a
+        time, headers then bodies, validating each page before it is staged
+
+        :param node: Address of the neighbour node. Eg. '192.168.0.5:5000'
+        :param fork_height: Fork height returned by missing_headers()
+        :return: (blocks, hashes) of the branch, on disk if our chain is, None if it is not valid
+                 or no longer has more work than ours
+        """
+
+        new_blocks, hashes = self.staging()
+        height = fork_height
+        work = self.work_at(fork_height)
+        last = None
+        while True:
+            page = self.read_page(node, 'headers', height,
+                                  lambda lines: self.read_blocks(lines, height, self.total_work(), last))
+            if page is None or page == 'fork':
+                return None
+            length, headers, page_hashes = page
+            if not headers:
+                break
+
+            blocks = self.fetch_bodies(node, height, headers)
+            if blocks is None or not self.valid_transactions(blocks):
+                return None
+            for block, block_hash in zip(blocks, page_hashes):
+                if isinstance(new_blocks, BlockStore):
+                    new_blocks.append(block, block_hash)
+                else:
+                    new_blocks.append(block)
+                    hashes.append(block_hash)
+                work += block_work(block)
+
+            height += len(blocks)
+            last = blocks[-1], page_hashes[-1]
+            if height >= length:
+                break
+
+        if work <= self.total_work():
+            return None
+        return new_blocks, hashes
+
+    def staging(self):
+        """
+        :return: Empty (blocks, hashes) to stage a branch in, a block store
+                 next to ours when our chain is kept in one
+        """
+        if not isinstance(self.chain, BlockStore):
+            return [], []
+        if self.staging_store is None:
+            self.staging_store = BlockStore(os.path.join(self.chain.directory, 'staging'))
+        del self.staging_store[0:]
+        return self.staging_store, StoreList(self.staging_store, self.staging_store.hash_at)
+
+    def read_page(self, node, path, start, read):
+        """
+        Fetch a page of a neighbour's chain and read it as it streams in
+
+        :param node: Address of the neighbour node. Eg. '192.168.0.5:5000'
+        :param path: 'headers' or 'bodies'
+        :param start: Height of the first block of the page
+        :param read: Reads the NDJSON lines of the page
+        :return: What read returned, None if the page could not be fetched
+        """
+        params = {'start': start, 'limit': self.sync_page, 'format': 'ndjson'}
+        response = outbound.client.get(f'http://{node}/{path}', params=params, stream=True)
+        if response is None or response.status_code != requests.codes.ok:
+            return None
+        with response:
+            return read(response.iter_lines())
+
+    def fetch_bodies(self, node, height, headers):
+        """
+        Fetch the transactions of validated headers from a neighbour
+
+        :param node: Address of the neighbour node. Eg. '192.168.0.5:5000'
+        :param height: Height of the first header
+        :param headers: A page of headers returned by read_blocks()
+        :return: The full blocks, None if the neighbour did not send bodies matching the headers
+        """
+        return self.read_page(node, 'bodies', height, lambda lines: self.read_bodies(lines, headers))
+
+    def read_bodies(self, lines, headers):
+        """
+        Join the bodies a neighbour streams to the headers we validated before
+
+        :param lines: NDJSON lines from /bodies, a header followed by one body per line
+        :param headers: Headers returned by read_blocks()
+        :return: The full blocks, None if the bodies do not match the headers
+        """
+        blocks = []
+        try:
+            next(lines, None)
+            for block_header, line in zip(headers, lines):
+                # Only the transactions come from the body, it must not replace any field of the validated header
+                block_body = json.loads(line)
+                if not isinstance(block_body, dict) or set(block_body) != {'transactions', 'size'}:
+                    return None
+                block = dict(block_body, **block_header)
+                if not valid_body(block):
+                    return None
+                blocks.append(block)
+        except NEIGHBOUR_ERRORS:
+            return None
+
+        # The neighbour's chain may have changed since it sent the headers
+        if len(blocks) != len(headers):
+            return None
+        return blocks
+
+    def read_blocks(self, lines, height, min_work, last=None):
+        """
+        Read and validate a page of a neighbour's blocks as it is streamed
+
+        :param lines: NDJSON lines from /headers or /chain, a header followed by one block per line
+        :param height: Height of the first block of the page
+        :param min_work: Only chains of more work than this are of interest
+        :param last: (block, hash) the page follows in the neighbour's chain, None for
+                     the first page, which must link onto our chain at height
+        :return: (length of the neighbour's chain, blocks, their hashes) if valid, 'fork' if
+                 the blocks do not link onto our chain at height, None if not valid
+        """
+
+        # Whatever a neighbour sends, a malformed stream only rules out that neighbour
+        try:
+            header = next(lines, None)
+            if not header:
+                return None
+            header = json.loads(header)
+            # Neighbours that do not report their work are judged by the headers they send
+            work = header.get('work')
+            if work is not None and work <= min_work:
+                return None
+            length = header['length']
+            if last is None and length <= height:
+                # A shorter chain of more work forks off below our height
+                return 'fork' if work is not None and height > 0 else None
+
+            blocks = []
+            hashes = []
+            validator = None if last is None else validation.ChainValidator(*last)
+
+            # Full chunks of blocks are validated on the process pool while the rest streams in
+            for line in lines:
+                block = json.loads(line)
+                blocks.append(block)
+                if validator is None:
+                    if height == 0:
+                        # The neighbour's genesis block, the others are validated against it
+                        hashes.append(self.hash(block))
+                        validator = validation.ChainValidator(block, hashes[0])
+                        continue
+                    if block['previous_hash'] != self.block_hashes[height-1]:
+                        return 'fork'
+                    validator = validation.ChainValidator(self.chain[height-1], self.block_hashes[height-1])
+
+                if not validator.add(block):
+                    return None
+
+            if validator is None:
+                return None
+            suffix_hashes = validator.result()
+            if suffix_hashes is None:
+                return None
+            return length, blocks, hashes + suffix_hashes
+        except NEIGHBOUR_ERRORS:
+            return None
 
     def compose_block_transactions(self):
-        # Max size of block in "kilobytes"
-        max_size = 2000
-        block_size = 0
-        block_transactions = []
+        """
+        Pack the next block with the transactions paying the highest fee per size
 
-        for identifier, transaction in self.current_transactions.items():
-            transaction_size = transaction['size']
-            if (transaction_size + block_size) > max_size:
-                return block_transactions
-            else:
-                block_transactions.append(transaction)
-                block_size += transaction_size
-        return []
+        :return: Transactions of the block, [] if the block is too empty to mine yet
+        """
+        block_transactions, block_size = self.current_transactions.select(self.max_block_size)
+
+        if block_size < self.min_block_fill * self.max_block_size:
+            if self.current_transactions.oldest_age() < self.block_fill_timeout:
+                return []
+        return block_transactions
 
     def add_block(self, block):
         """
-        Add a new Block to the Blockchain
+        Add a new Block mined by our cluster to the Blockchain
 
         :param block: The block to add
-        :return: Block that was added
+        :return: Block that was added, None if it does not extend our chain
         """
-        # Ensure we are the longest chain
-        self.resolve_conflicts()
-        self.chain.append(block)
-        for transaction in block['transactions']:
-            if transaction['id'] in self.current_transactions:
-                self.current_transactions.pop(transaction['id'])
-        
+        if not self.extend_chain(block):
+            # Another cluster won the block, make sure we are on the longest chain
+            self.resolve_conflicts()
+            return None
+
         # Construct log entry
         payload = {
             'chain_height': len(self.chain),
@@ -184,10 +473,82 @@ class Blockchain:
             'manager_id': node_identifier,
             'time': str(datetime.now())
         }
-        # Send data to logging node
-        requests.post(url='http://0.0.0.0:4000/report', json=payload)
+        # Queue data for the logging node, sent in batches in the background
+        reporter.report(payload)
         return block
 
+    def new_block_template(self, block_transactions, node):
+        """
+        A block on top of our chain that only lacks its proof, which covers the rest of its header
+
+        :param block_transactions: Transactions of the block
+        :param node: Id of the miner of the block, who is paid the reward
+        :return: Block without 'proof'
+        """
+        block_transactions = [reward_transaction(node)] + block_transactions
+        block_size = 0
+        for t in block_transactions:
+            block_size += t['size']
+
+        return {
+            'version': BLOCK_VERSION,
+            'index': self.last_block()['index'] + 1,
+            'timestamp': datetime.now().isoformat(),
+            'transactions': block_transactions,
+            'previous_hash': self.last_hash(),
+            'size': block_size,   # 2MB max size
+            'merkle_root': merkle_root([t['id'] for t in block_transactions]),
+            'node': node,
+            'difficulty': proofofwork.DIFFICULTY,
+        }
+
+    def extend_chain(self, block, block_hash=None):
+        """
+        Append a block that builds on the tip of our chain, in constant time
+
+        :param block: The block
+        :param block_hash: Hash of the block, computed if not given
+        :return: True if the block was appended, False if it does not validly follow our tip
+        """
+        if block['previous_hash'] != self.last_hash() or not self.valid_link(self.last_block(), self.last_hash(), block):
+            return False
+        if not self.valid_transactions([block]):
+            return False
+
+        self.append_block(block, block_hash)
+        for transaction in block['transactions']:
+            self.current_transactions.pop(transaction['id'])
+        return True
+
+    def receive_block(self, block):
+        """
+        Handle a block a neighbour announced. A block on our tip is appended
+        directly, anything else falls back to a full sync with the neighbours.
+
+        :param block: The block
+        :return: True if our chain changed, False if not
+        """
+        block_hash = self.hash(block)
+        if block_hash in self.block_heights:
+            return False
+        if block['previous_hash'] == self.last_hash():
+            return self.extend_chain(block, block_hash)
+
+        # A branch no longer than ours is only worth a sync if its blocks are harder than ours
+        if block['index'] <= len(self.chain) and block_work(block) <= block_work(self.last_block()):
+            return False
+        return self.resolve_conflicts()
+
+    def announce_block(self, block):
+        """
+        Push a block we added to our chain to the neighbours, without waiting for them
+
+        :param block: The block
+        """
+        payload = {'block': block, 'sent': time()}
+        for node in self.neighbours():
+            outbound.client.send_later('POST', f'http://{node}/blocks/announce', json=payload)
+
     def new_genesis_block(self, proof, previous_hash, block_transactions):
         if not self.chain:
             block_size = 0
@@ -195,48 +556,324 @@ class Blockchain:
                 block_size += t['size']
 
             block = {
+                'version': BLOCK_VERSION,
                 'index': len(self.chain) + 1,
                 'timestamp': time(),
                 'transactions': block_transactions,
                 'proof': proof,
                 'previous_hash': previous_hash or self.hash(self.chain[-1]),
                 'size': block_size,   # 2MB max size
+                'merkle_root': merkle_root([t['id'] for t in block_transactions]),
             }
 
-            self.chain.append(block)
+            self.append_block(block)
             return block
 
-    def new_transaction(self, sender, recipient, amount):
+    def new_transaction(self, sender, recipient, amount, fee=0, check_funds=False):
         """
         Creates a new transaction to go into the next mined Block
 
         :param sender: Address of the Sender
         :param recipient: Address of the Recipient
         :param amount: Amount
-        :return: The index of the Block that will hold this transaction
-        """
-        transaction_id = str(uuid4()).replace('-', '')
-        self.current_transactions[transaction_id] = {
-            'sender': sender,
-            'recipient': recipient,
-            'amount': amount,
-            'size': random.randint(10,100),         # Simulated size in kilobytes
-            'id': transaction_id                    # Unique ID
-        }
+        :param fee: Fee paid to get the transaction mined
+        :param check_funds: Refuse the transaction if the sender can not pay for it
+        :return: The index of the Block that will hold this transaction, None if refused
+        """
+        values = {'sender': sender, 'recipient': recipient, 'amount': amount, 'fee': fee}
+        result, = self.new_transactions([values], check_funds)
+        if 'error' in result:
+            return None
         return len(self.chain)+1
 
+    def new_transactions(self, values, check_funds=False):
+        """
+        Creates many transactions at once, with their ids and sizes drawn in bulk.
+        Signed transactions keep the id that was signed, the signatures are checked in one batch.
+
+        :param values: <list> Dicts with the sender, recipient, amount and optionally
+                       the fee, nonce and signature of each transaction
+        :param check_funds: Refuse the transactions whose sender can not pay for them
+        :return: <list> {'id': <str>} for each transaction added, {'error': <str>} where it was refused
+        """
+        ids = os.urandom(16 * len(values)).hex()                    # Unique IDs
+        sizes = random.choices(range(10, 101), k=len(values))       # Simulated size in kilobytes
+
+        transactions = []
+        for number, value in enumerate(values):
+            transaction = {
+                'sender': value['sender'],
+                'recipient': value['recipient'],
+                'amount': value['amount'],
+                'fee': value.get('fee', 0),
+                'size': sizes[number],
+                'id': ids[32*number:32*(number+1)],
+            }
+            if 'signature' in value:
+                if 'nonce' in value:
+                    transaction['nonce'] = value['nonce']
+                transaction['id'] = value.get('id') or transaction_id(transaction)
+                transaction['signature'] = value['signature']
+            transactions.append(transaction)
+        signed = self.verifier.verify(transactions)
+
+        results = []
+        # Checked and added under the pool's lock, so two transactions can not spend the same funds
+        with self.current_transactions.lock:
+            for transaction, valid in zip(transactions, signed):
+                if not valid:
+                    results.append({'error': 'Error: Invalid signature'})
+                elif check_funds and spent(transaction) > self.spendable(transaction['sender']):
+                    results.append({'error': 'Error: Insufficient funds'})
+                elif not self.add_transaction(transaction):
+                    if transaction['id'] in self.current_transactions or transaction['id'] in self.transaction_index:
+                        results.append({'error': 'Error: Transaction already known'})
+                    else:
+                        results.append({'error': 'Error: The pool is full of transactions paying a higher fee'})
+                else:
+                    results.append({'id': transaction['id']})
+        return results
+
+    def valid_transactions(self, blocks):
+        """
+        Check the transactions of blocks before they join the chain, the signatures in one batch.
+        Transactions that came through our pool are found in the verified cache.
+        Nothing is changed before all of them are checked, so a bad block can not
+        leave the chain half updated.
+
+        :param blocks: <list> Blocks
+        :return: True if every block pays at most its reward and every transaction is well formed and validly signed
+        """
+        if not all(isinstance(block.get('transactions'), list) for block in blocks):
+            return False
+        transactions = [transaction for block in blocks for transaction in block['transactions']]
+        if not all(valid_transaction(transaction) for transaction in transactions):
+            return False
+        if not all(valid_rewards(block) for block in blocks):
+            return False
+        if not all(valid_test_transfer(transaction) for transaction in transactions):
+            return False
+        return all(self.verifier.verify(transactions))
+
+    def spendable(self, sender):
+        """
+        :param sender: Address
+        :return: Balance of the address in the chain minus what it pays in pending transactions
+        """
+        return self.balances.balance(sender) - self.current_transactions.pending_spend(sender)
 
-    # TODO: Fixa transaktionssync
-    def sync_transactions(self):
-        if len(self.nodes) > 1:
-            for node in self.nodes:
-                requests.post(url=f'http://{node}/transactions/update', json=self.current_transactions)
+    def add_transaction(self, transaction):
+        """
+        Adds a transaction to the pool and queues it to be announced to the neighbours
 
+        :param transaction: <dict> Transaction, as created by new_transaction()
+        :return: <bool> True if the transaction was new to us
+        """
+        if transaction['id'] in self.transaction_index:
+            return False
+        if not self.current_transactions.add(transaction):
+            return False
+
+        with self.announce_lock:
+            self.announcements.append(transaction['id'])
+        return True
+
+    def missing_transactions(self, transaction_ids):
+        """
+        :param transaction_ids: Ids announced by a neighbour
+        :return: The ids we have neither in the pool nor in the chain
+        """
+        return [transaction_id for transaction_id in transaction_ids
+                if transaction_id not in self.current_transactions and transaction_id not in self.transaction_index]
+
+    def relay_transactions(self):
+        """
+        Announce the ids of the transactions that arrived since the last call to the
+        neighbours, then send each neighbour the transactions it asked for
+        """
+        with self.announce_lock:
+            transaction_ids, self.announcements = self.announcements, []
+
+        # Only transactions still pending are worth announcing
+        transaction_ids = [transaction_id for transaction_id in transaction_ids if transaction_id in self.current_transactions]
+        if not transaction_ids:
+            return
+
+        def relay(node):
+            response = outbound.client.post(url=f'http://{node}/transactions/inv', json={'ids': transaction_ids})
+            if response is None or response.status_code != requests.codes.ok:
+                # Unreachable neighbour, it catches up through the next block instead
+                return
+
+            try:
+                transactions = self.requested_transactions(response.json())
+            except ValueError:
+                # Not JSON, only this neighbour is skipped
+                return
+            if transactions:
+                outbound.client.post(url=f'http://{node}/transactions/update', json={'transactions': transactions})
+
+        outbound.client.map(relay, self.neighbours())
+
+
+    def requested_transactions(self, values):
+        """
+        :param values: A neighbour's answer to /transactions/inv
+        :return: <list> The transactions of our pool it asked for, [] if the answer is malformed
+        """
+        transaction_ids = values.get('getdata') if isinstance(values, dict) else None
+        if not isinstance(transaction_ids, list):
+            return []
+        transactions = [self.current_transactions.get(transaction_id) for transaction_id in transaction_ids
+                        if isinstance(transaction_id, str)]
+        return [transaction for transaction in transactions if transaction]
 
     #@property
     def last_block(self):
         return self.chain[-1]
 
+    def append_block(self, block, block_hash=None):
+        """
+        Append a block to the chain and index its hash
+
+        :param block: The block to append
+        :param block_hash: Hash of the block, computed if not given
+        """
+        if block_hash is None:
+            block_hash = self.hash(block)
+        work = self.total_work() + block_work(block)
+        # Indexed before the block is stored, so a store never covers a block whose transactions it lacks
+        self.index_transactions(block, len(self.chain) + 1)
+        if isinstance(self.chain, BlockStore):
+            # The store keeps the hash, height and work on disk so they survive restarts
+            self.chain.append(block, block_hash, work)
+        else:
+            self.chain.append(block)
+            self.block_hashes.append(block_hash)
+            self.block_heights[block_hash] = len(self.chain)
+            self.chain_work.append(work)
+        self.balances.apply_block(block)
+
+        if isinstance(self.chain, BlockStore) and len(self.chain) % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    def index_transactions(self, block, height):
+        """
+        Add the transactions of a block to the transaction index
+
+        :param block: The block
+        :param height: Height of the block in the chain, the genesis block is at 1
+        """
+        for position, transaction in enumerate(block['transactions']):
+            self.transaction_index[transaction['id']] = (height, position)
+
+    def transaction_status(self, transaction_id):
+        """
+        Where a transaction is, without scanning the chain or the pool
+
+        :param transaction_id: <str> Id of the transaction
+        :return: <dict> 'status' is 'included', 'pending' or 'unknown'
+        """
+        location = self.transaction_index.get(transaction_id)
+        if location is not None:
+            height, position = location
+            return {
+                'status': 'included',
+                'height': height,
+                'position': position,
+                'block_hash': self.block_hashes[height-1],
+                'confirmations': len(self.chain) - height + 1,
+            }
+        if transaction_id in self.current_transactions:
+            return {'status': 'pending', 'confirmations': 0}
+        return {'status': 'unknown', 'confirmations': 0}
+
+    def open_store(self, directory):
+        """
+        Keep the chain in a block store on disk instead of in memory.
+        A store left by an earlier run replaces the chain we started with.
+        The hashes, heights, work and transaction locations stay on disk with
+        the store. The balances start from the store's last checkpoint, only
+        the blocks appended after it are read.
+
+        :param directory: <str> Directory of the block store
+        """
+        store = BlockStore(directory)
+        self.transaction_index = StoreTransactions(store)
+        if not len(store):
+            for height, (block, block_hash, work) in enumerate(zip(self.chain, self.block_hashes, self.chain_work)):
+                self.index_transactions(block, height + 1)
+                store.append(block, block_hash, work)
+
+        # Blocks stored after the transactions table last reached the disk
+        for height in range(min(store.transactions.mark, len(store)), len(store)):
+            self.index_transactions(store[height], height + 1)
+        store.sync()
+
+        self.chain = store
+        self.block_hashes = StoreList(store, store.hash_at)
+        self.block_heights = StoreHeights(store)
+        self.chain_work = StoreList(store, store.work_at)
+
+        checkpoint_height, state = store.load_checkpoint()
+        self.balances = Balances(state and state['balances'])
+        for height in range(checkpoint_height, len(store)):
+            self.balances.apply_block(store[height])
+
+    def save_checkpoint(self):
+        """
+        Save the balances with the block store, see open_store(). The store writes
+        them in the background, only the copy is made while the chain waits.
+        """
+        self.chain.save_checkpoint({'balances': dict(self.balances.balances)})
+
+    def truncate_chain(self, height):
+        """
+        Remove all blocks above a given height from the chain and the indexes
+
+        :param height: Number of blocks to keep
+        :return: <list> The removed blocks
+        """
+        dropped = list(self.chain[height:])
+        if not isinstance(self.chain, BlockStore):
+            for block_hash in self.block_hashes[height:]:
+                self.block_heights.pop(block_hash, None)
+            del self.block_hashes[height:]
+            del self.chain_work[height:]
+        # A store drops the hashes, heights and work with its blocks
+        del self.chain[height:]
+        for block in reversed(dropped):
+            for transaction in block['transactions']:
+                self.transaction_index.pop(transaction['id'], None)
+            self.balances.revert_block(block)
+        return dropped
+
+    def last_hash(self):
+        return self.block_hashes[-1]
+
+    def work_at(self, height):
+        """
+        :param height: Number of blocks
+        :return: Total work of the first height blocks of our chain
+        """
+        return self.chain_work[height-1] if height else 0
+
+    def total_work(self):
+        chain_work = self.chain_work
+        return chain_work[-1] if chain_work else 0
+
+    def block_by_hash(self, block_hash):
+        """
+        Look up a block in our chain by its hash
+
+        :param block_hash: <str> Hash of the block
+        :return: The block, or None if it is not in our chain
+        """
+        height = self.block_heights.get(block_hash)
+        if height is None:
+            return None
+        return self.chain[height-1]
+
     @staticmethod
     def hash(block):
         """
@@ -244,19 +881,8 @@ class Blockchain:
 
         :param block: Block
         """
+        return block_hash(block)
 
-        # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
-
-    def start_mining(self):
-        payload = {
-            'transactions': self.compose_block_transactions(),
-            'last_block': self.last_block()
-        }
-        for node in self.slave_nodes:
-            requests.post(url='http://'+node+'/start', json=payload)
-    
     def set_address(self, address):
         parsed_url = urlparse(address)
         self.address = parsed_url.netloc
@@ -266,27 +892,23 @@ class Blockchain:
 
     def get_cluster_start_port(self):
         return self.cluster_start_port
-    
-    def stop_all_clusters(self):
-        if len(self.nodes) > 1:
-            for node in self.nodes:
-                if node is not self.address:
-                    requests.get(url=f'http://{node}/cluster/stop')
 
-    
-    def start_all_clusters(self):
-        if len(self.nodes) > 1:
-            for node in self.nodes:
-                if node is not self.address:
-                    requests.get(url=f'http://{node}/cluster/start')
+
+class TransactionIdConverter(BaseConverter):
+    # Transaction ids are 32 hex digits, so the other /transactions/ routes never match one
+    regex = '[0-9a-f]{32}'
 
 
 # Instantiate the Node
 app = Flask(__name__)
+app.url_map.converters['transaction_id'] = TransactionIdConverter
 
 # Generate a globally unique id for this node
 node_identifier = str(uuid4()).replace('-', '')
 
+# Sends the block reports to the logging node
+reporter = Reporter('http://0.0.0.0:4000/report')
+
 # Instantiate the Blockchain
 manager = Blockchain()
 
@@ -295,6 +917,8 @@ is_syncing = True
 
 # For filtering of requests from miners
 block_found = False
+dispatched_at = time()
+block_lock = Lock()
 waiting_for_response = False
 cluster_running = False
 
@@ -309,56 +933,58 @@ class Manage(Thread):
         global waiting_for_response
         global block_found
         global cluster_running
+        global dispatched_at
 
         while True:
             if cluster_running and manager.current_transactions:
                 if not waiting_for_response and not block_found:
                     
                     transactions = manager.compose_block_transactions()
+                    if not transactions:
+                        # Wait for the block to fill up
+                        sleep(0.1)
+                        continue
+
                     last_block = manager.last_block()
-                    interval = len(manager.slave_nodes)
-                    start_value = 0
-
-                    for node in manager.slave_nodes:
-                        payload = {
-                            'transactions': transactions,
-                            'last_block': last_block,
-                            'interval': interval,
-                            'start_value': start_value
-                        }
-
-                        requests.post(url='http://'+node+'/start', json=payload)
-                        start_value+=1
+                    last_hash = manager.last_hash()
+
+                    # Miners and worker processes lease chunks of proofs from the scheduler as they need them
+                    round_id = scheduler.reset()
+                    dispatched_at = time()
+
+                    # Miners waiting on /work get the new block right away
+                    work_channel.publish({
+                        'transactions': transactions,
+                        'last_block': last_block,
+                        'last_hash': last_hash,
+                        'round': round_id,
+                        'difficulty': proofofwork.DIFFICULTY
+                    })
+                    if len(supervisor):
+                        template = manager.new_block_template(transactions, node_identifier)
+                        prefix = proofofwork.guess_prefix(last_block, template, last_hash)
+                        supervisor.start(template, prefix, proofofwork.DIFFICULTY, round_id)
                     waiting_for_response = True
                 # Miners are done, start on another block
                 elif block_found:
                     waiting_for_response = False
                     block_found = False
+                else:
+                    sleep(0.01)
             else:
                 sleep(0.1)
 
 
-class NewMiner(Thread):
+class Relay(Thread):
     def __init__(self, task_id):
         Thread.__init__(self)
         self.task_id = task_id
-    
-    def run(self):
-        #port = 6000+len(manager.slave_nodes)+len(manager.nodes)*100
-        port = manager.get_cluster_start_port()+len(manager.slave_nodes)
-        address = f'0.0.0.0:{port}'
-        manager.slave_nodes.add(address)
-
-        import sys
-        import importlib.util
 
-        # Create an instance of the miner.py module
-        SPEC_OS = importlib.util.find_spec('miner')
-        new_miner = importlib.util.module_from_spec(SPEC_OS)
-        SPEC_OS.loader.exec_module(new_miner)
-        sys.modules[f'miner_{address}'] = new_miner
-
-        new_miner.start(address='http://0.0.0.0', port=port, manager_address=manager.address)
+    def run(self):
+        # Batch the announcements of new transactions on a short timer
+        while True:
+            manager.relay_transactions()
+            sleep(0.5)
 
 
 class Sync(Thread):
@@ -379,6 +1005,7 @@ def sync_nodes():
     is_syncing = True
     async_task = Sync(task_id=2)
     async_task.setName('Syncing node lists')
+    async_task.daemon = True
     try:
         with app.test_request_context():
             async_task.start()
@@ -398,52 +1025,255 @@ def stop_syncing():
 def add_transaction():
     values = request.get_json()
 
+    error = transaction_error(values)
+    if error:
+        return error, 400
+
+    # Create a new Transaction, the sender must be able to pay for it
+    result, = manager.new_transactions([values], check_funds=True)
+    if 'error' in result:
+        if result['error'] == 'Error: Insufficient funds':
+            return f'Error: Insufficient funds, {values["sender"]} can spend {manager.spendable(values["sender"])}', 400
+        return result['error'], 400
+
+    response = {'message': f'Transaction will be added to Block {len(manager.chain)+1}', 'id': result['id']}
+    return jsonify(response), 200
+
+
+def transaction_error(values):
+    """
+    :param values: A transaction posted by a client
+    :return: <str> Why the transaction can not be accepted, None if it can
+    """
     # Check that the required fields are in the POST'ed data
     required = ['sender', 'recipient', 'amount']
-    if not all(k in values for k in required):
-        return 'Missing values', 400
+    if not isinstance(values, dict) or not all(k in values for k in required):
+        return 'Missing values'
+    if not valid_amounts(values):
+        return 'Error: The amount must be positive and the fee not negative'
+    # New coins are only created by the blocks that reward their miners
+    if address(values['sender']) == MINT:
+        return 'Error: New coins can not be sent'
+    # Test accounts need no signature nor funds, they are only for /transactions/generate
+    if test_account(values['sender']):
+        return 'Error: Numbered test accounts only send through /transactions/generate'
+    return None
+
+
+# Many transactions in one request, as a JSON array or one JSON object per line with Content-Type application/x-ndjson
+@app.route('/transactions/batch', methods=['POST'])
+def add_transactions():
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            values = [json.loads(line) for line in request.stream if line.strip()]
+        except ValueError:
+            return 'Error: Every line must be a JSON transaction', 400
+    else:
+        values = request.get_json(silent=True)
+    if not isinstance(values, list):
+        return 'Error: Please supply a list of transactions', 400
 
-    # Create a new Transaction
-    index = manager.new_transaction(values['sender'], values['recipient'], values['amount'])
+    results = [{'error': transaction_error(value)} for value in values]
+    accepted = [number for number, result in enumerate(results) if result['error'] is None]
 
-    response = {'message': f'Transaction will be added to Block {index}'}
+    # The senders must be able to pay for their transactions, like on /transactions/new
+    added = 0
+    for number, result in zip(accepted, manager.new_transactions([values[number] for number in accepted], check_funds=True)):
+        results[number] = result
+        added += 'id' in result
+
+    response = {
+        'accepted': added,
+        'rejected': len(values) - added,
+        'block': len(manager.chain) + 1,
+        'results': results,
+    }
+    return jsonify(response), 200
+
+
+@app.route('/balance/<address>', methods=['GET'])
+def get_balance(address):
+    balance = manager.balances.balance(address)
+    pending = manager.current_transactions.pending_spend(address)
+    response = {
+        'address': address,
+        'balance': balance,
+        'pending': pending,
+        'spendable': balance - pending,
+    }
     return jsonify(response), 200
 
 
+# Pending transactions a page at a time in the order they arrived, Eg. ?start=1000&limit=500
 @app.route('/transactions', methods=['GET'])
 def get_transactions():
+    start = max(request.args.get('start', default=0, type=int), 0)
+    limit = min(max(request.args.get('limit', default=1000, type=int), 0), 10000)
+    pool = manager.current_transactions
     response = {
-        'transactions': manager.current_transactions,
-        'size': len(manager.current_transactions)
+        'transactions': pool.page(start, limit),
+        'size': len(pool),
+        'kilobytes': pool.size,
+        'start': start,
+        'limit': limit,
     }
     return jsonify(response), 200
 
 
+# Whether a transaction was mined, and how deep in the chain
+@app.route('/transactions/<transaction_id:transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    response = manager.transaction_status(transaction_id)
+    response['id'] = transaction_id
+    if response['status'] == 'unknown':
+        return jsonify(response), 404
+    return jsonify(response), 200
+
+
 @app.route('/slave/done', methods=['POST'])
 def slave_done():
+    block = encoding.decode_request(request)
+    if block is None:
+        return 'Error: Please supply a valid block', 400
+    if accept_mined_block(block):
+        return 'Block recieved, restarting mining', 200
+    return 'Block already found, restarting mining', 400
+
+
+def accept_mined_block(block):
+    """
+    Add a block found by our cluster to the chain, announce it to the
+    neighbours and restart mining on the new tip
+
+    :param block: The block
+    :return: True if the block was added, False if another one was found first
+    """
     global block_found
-    if not block_found:     # Ignore all requests except first one
+    with block_lock:
+        if block_found:     # Ignore all blocks except first one
+            return False
         stop_cluster()
         block_found = True
-        block = request.get_json()
-        manager.add_block(block)
-        manager.stop_all_clusters()
-        manager.sync_transactions()
+        added = manager.add_block(block)
+        if added:
+            manager.announce_block(block)
+            blocks_mined.inc()
+            template_seconds.observe(time() - dispatched_at)
         start_cluster()
-        manager.start_all_clusters()
-        return 'Block recieved, restarting mining', 200
-    return 'Block already found, restarting mining', 400
+        return added is not None
+
+
+def found_proof(template, proof):
+    """
+    Called by the supervisor when one of our worker processes finds a proof
+    """
+    block = dict(template)
+    block['proof'] = proof
+    # The template already pays the reward to this node
+    accept_mined_block(block)
+
+
+def announced_block(values):
+    """
+    :param values: Body of a /blocks/announce request
+    :return: The block, None if the body does not carry a well-formed one
+    """
+    block = values.get('block') if isinstance(values, dict) else None
+    required = ['index', 'previous_hash', 'proof', 'transactions']
+    if not isinstance(block, dict) or not all(k in block for k in required):
+        return None
+    # The fields read before the block is validated
+    if not isinstance(block['index'], int) or not proofofwork.valid_int(block.get('difficulty', 0), 0, 257):
+        return None
+    if not isinstance(block['transactions'], list) or not all(isinstance(t, dict) for t in block['transactions']):
+        return None
+    return block
+
+
+# Neighbour pushes a block it added to its chain
+@app.route('/blocks/announce', methods=['POST'])
+def receive_block():
+    values = request.get_json()
 
+    block = announced_block(values)
+    if block is None:
+        return 'Error: Please supply a valid block', 400
+
+    if isinstance(values.get('sent'), (int, float)):
+        propagation_seconds.observe(max(time() - values['sent'], 0))
+    with block_lock:
+        received = manager.receive_block(block)
+    if received:
+        blocks_received.inc()
+        restart_mining()
+        return 'Block added, restarting mining', 200
+    return 'Block not added', 200
+
+
+def restart_mining():
+    """
+    Have the miners of our cluster drop their block and start over on the new tip of the chain
+    """
+    global block_found
+    if cluster_running:
+        stop_cluster()
+        block_found = True
+        start_cluster()
+
+
+def chain_page(key, part):
+    """
+    A page of the chain, Eg. ?start=100&limit=50. Syncing nodes ask for the blocks above their height
+
+    :param key: Key of the list in the JSON response
+    :param part: Function returning the part of a block to send
+    """
+    length = len(manager.chain)
+    work = manager.total_work()
+    start = max(request.args.get('start', default=request.args.get('from', default=0, type=int), type=int), 0)
+    limit = request.args.get('limit', default=length, type=int)
+    end = min(start + max(limit, 0), length)
+
+    # ?format=ndjson streams one block per line as it is serialized, after a header line
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            yield json.dumps({'length': length, 'start': start, 'work': work}) + '\n'
+            for height in range(start, end):
+                if height >= len(manager.chain):
+                    break
+                block = manager.chain[height]
+                yield json.dumps(part(block)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-@app.route('/chain', methods=['GET'])
-def full_chain():
     response = {
-        'chain': manager.chain,
-        'length': len(manager.chain),
+        key: [part(block) for block in manager.chain[start:end]],
+        'length': length,
+        'start': start,
+        'work': work,
     }
+    # ?format=binary or an Accept header asks for the binary encoding
+    if encoding.wants_binary(request):
+        return encoding.response(response)
     return jsonify(response), 200
 
 
+@app.route('/chain', methods=['GET'])
+def full_chain():
+    return chain_page('chain', lambda block: block)
+
+
+# Headers of the chain without the transactions, nodes sync these before the bodies
+@app.route('/headers', methods=['GET'])
+def chain_headers():
+    return chain_page('headers', header)
+
+
+# Transactions of the blocks, in the same pages as the headers
+@app.route('/bodies', methods=['GET'])
+def chain_bodies():
+    return chain_page('bodies', body)
+
+
 @app.route('/nodes', methods=['GET'])
 def get_nodes():
     response = {
@@ -472,38 +1302,50 @@ def register_nodes():
 
 @app.route('/nodes/resolve', methods=['GET'])
 def consensus():
-    replaced = manager.resolve_conflicts()
+    with block_lock:
+        replaced = manager.resolve_conflicts()
 
     if replaced:
         response = {
             'message': 'Our chain was replaced',
-            'new_chain': manager.chain
+            'new_chain': list(manager.chain)
         }
     else:
         response = {
             'message': 'Our chain is authoritative',
-            'chain': manager.chain
+            'chain': list(manager.chain)
         }
     return jsonify(response), 200
 
 
 @app.route('/cluster', methods=['GET'])
 def get_cluster():
-    return jsonify(list(manager.slave_nodes)), 200
+    return jsonify(list(manager.slave_nodes) + supervisor.describe()), 200
 
 
-# Adds a miner node to cluster
+# Adds miner worker processes to the cluster, ?processes=0 adds one per core
 @app.route('/cluster/add_miner', methods=['GET'])
 def add_miner():
-    async_task = NewMiner(task_id=3)
-    async_task.setName(f'New Miner: 0.0.0.0:{6000+len(manager.slave_nodes)}')
+    processes = request.args.get('processes', default=1, type=int)
+    processes = processes or os.cpu_count() or 1
     try:
-        with app.test_request_context():
-            async_task.start()
-    except RuntimeError:
+        supervisor.add_workers(processes)
+    except OSError:
         return 'Could not create a new miner', 400
 
-    return 'Miner node created and added to cluster!', 200
+    return f'{processes} miner processes created and added to cluster!', 200
+
+
+@app.route('/cluster/hashrate', methods=['GET'])
+def cluster_hash_rate():
+    hash_rates = supervisor.hash_rates()
+    response = {
+        'workers': hash_rates,
+        'total': sum(hash_rates),
+        'restarts': supervisor.restarts,
+        'cluster': scheduler.hash_rate(),
+    }
+    return jsonify(response), 200
 
 
 
@@ -514,7 +1356,7 @@ def start_cluster():
     global block_found
 
     if not cluster_running:
-        if manager.slave_nodes:
+        if manager.slave_nodes or len(supervisor):
             cluster_running = True
             return 'Cluster mining initiated!', 200
         return 'Error: No nodes in cluster', 400
@@ -526,35 +1368,133 @@ def start_cluster():
 def stop_cluster():
     global cluster_running
     cluster_running = False
-    for node in manager.slave_nodes:
-        r = requests.get(f'http://{node}/stop')
-        if not r.status_code == requests.codes.ok:
-            return f'Failed to deactivate miner {node} in cluster', 400
+    supervisor.stop()
+    work_channel.cancel()
     return 'Cluster mining deactivated!', 200
 
 
-# Generate transactions for testing
+# Long poll of the miner nodes, answered once the work differs from version ?after
+@app.route('/work', methods=['GET'])
+def get_work():
+    miner_id = request.args.get('miner')
+    if not miner_id:
+        return 'Error: Please supply a miner id', 400
+    # A miner joins the cluster by asking for work, it gets a chunk of the current block right away
+    manager.slave_nodes.add(miner_id)
+
+    after = request.args.get('after', default=-1, type=int)
+    timeout = min(request.args.get('timeout', default=25, type=float), 60)
+    version, work = work_channel.wait(after, timeout)
+
+    response = {
+        'version': version,
+        'work': miner_work(work, miner_id) if version != after else None,
+    }
+    return jsonify(response), 200
+
+
+# A miner searched its chunk of proofs to the end and asks for the next one
+@app.route('/work/chunk', methods=['POST'])
+def next_chunk():
+    values = request.get_json()
+
+    required = ['miner', 'round']
+    if values is None or not all(k in values for k in required):
+        return 'Missing values', 400
+
+    chunk = scheduler.next_chunk(values['miner'], values['round'])
+    response = {'chunk': chunk and {'start_value': chunk[0], 'count': chunk[1]}}
+    return jsonify(response), 200
+
+
+def miner_work(work, miner_id):
+    """
+    :return: The work of the cluster with a chunk of proofs leased to the miner, None if it has nothing to do
+    """
+    if work is None:
+        return None
+    chunk = scheduler.assign(miner_id, work['round'])
+    if chunk is None:
+        return None
+    payload = dict(work)
+    payload['start_value'], payload['count'] = chunk
+    payload['interval'] = 1
+    return payload
+
+
+# Generate transactions for testing, between the numbered test accounts
 @app.route('/transactions/generate', methods=['POST'])
 def generate_transactions():
     values = request.get_json()
-    number = values.get('number')
-
-    for i in range(0, number):
-        amount = random.randint(1,1000)
-        sender = random.randint(1,100)
-        recipient = random.randint(1,100)
-        while recipient == sender:
+    if not isinstance(values, dict):
+        return 'Error: Please supply the number of transactions or a list of them', 400
+
+    # Given transactions, as sent by benchmarks/cluster.py, must be test transfers like the drawn ones
+    transactions = values.get('transactions')
+    if transactions is not None:
+        if not isinstance(transactions, list) or not all(
+                isinstance(t, dict) and all(k in t for k in ('sender', 'recipient', 'amount'))
+                and test_account(t['sender']) and valid_test_transfer(t) and valid_amounts(t) for t in transactions):
+            return 'Error: Please supply a list of transactions between numbered test accounts', 400
+        number = len(transactions)
+    else:
+        number = values.get('number')
+        if not isinstance(number, int):
+            return 'Error: Please supply the number of transactions or a list of them', 400
+        transactions = []
+        for i in range(0, number):
+            amount = random.randint(1,1000)
+            sender = random.randint(1,100)
             recipient = random.randint(1,100)
-        
-        manager.new_transaction(sender, recipient, amount)
-    return f'{number} transactions generated!'
+            while recipient == sender:
+                recipient = random.randint(1,100)
+            fee = random.randint(0,10)
+            transactions.append({'sender': sender, 'recipient': recipient, 'amount': amount, 'fee': fee})
+
+    # Test transactions come from accounts without funds and are not checked
+    results = manager.new_transactions(transactions)
+    response = {
+        'message': f'{number} transactions generated!',
+        'ids': [result['id'] for result in results if 'id' in result],
+    }
+    return jsonify(response), 200
+
 
+# Neighbour announces the ids of its new transactions, answer with the ones we want
+@app.route('/transactions/inv', methods=['POST'])
+def transactions_inventory():
+    values = request.get_json()
+
+    transaction_ids = values.get('ids') if isinstance(values, dict) else None
+    if not isinstance(transaction_ids, list) or not all(isinstance(i, str) for i in transaction_ids):
+        return 'Error: Please supply a valid list of transaction ids', 400
 
-    @app.route('/transactions/update', methods=['POST'])
-    def update_transactions(self):
-        new_transactions = request.get_json()
-        self.current_transactions = new_transactions
-        return 'Transactions updated!', 200
+    response = {'getdata': manager.missing_transactions(transaction_ids)}
+    return jsonify(response), 200
+
+
+# Neighbour sends the transactions we asked for
+@app.route('/transactions/update', methods=['POST'])
+def update_transactions():
+    values = request.get_json()
+
+    transactions = values.get('transactions') if isinstance(values, dict) else None
+    if not isinstance(transactions, list):
+        return 'Error: Please supply a valid list of transactions', 400
+
+    # Pending transactions take space, so their size must be positive
+    transactions = [transaction for transaction in transactions if valid_transaction(transaction)
+                    and transaction['size'] > 0 and address(transaction['sender']) != MINT
+                    and valid_test_transfer(transaction)]
+
+    # Signatures are checked in one batch, the ones we verified before are skipped
+    added = 0
+    for transaction, valid in zip(transactions, manager.verifier.verify(transactions)):
+        if valid and manager.add_transaction(transaction):
+            added += 1
+
+    response = {'message': f'{added} new transactions added to the pool'}
+    return jsonify(response), 200
 
 
 @app.route('/address', methods=['GET'])
@@ -562,6 +1502,11 @@ def get_address():
     return f'{manager.address}', 200
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.exposition(), mimetype='text/plain; version=0.0.4')
+
+
 # Initialization --------------------
 # Activate syncing of manager node list
 sync_nodes()
@@ -569,9 +1514,34 @@ sync_nodes()
 # Get longest blockchain
 #manager.resolve_conflicts()
 
+# Activate relaying of new transactions
+relay_task = Relay(task_id=5)
+relay_task.setName('Relay transactions')
+relay_task.daemon = True
+with app.test_request_context():
+    relay_task.start()
+
+# Hands out the proofs to search to the miners and worker processes
+scheduler = NonceScheduler()
+
+# Runs the miner worker processes of the cluster
+supervisor = MinerSupervisor(found_proof, scheduler)
+
+# Pushes new work to the miner nodes of the cluster
+work_channel = WorkChannel()
+
+# Values read whenever /metrics is collected
+metrics.gauge('manager_chain_height', 'Blocks in the chain').set_function(lambda: len(manager.chain))
+metrics.gauge('manager_mempool_transactions', 'Pending transactions').set_function(lambda: len(manager.current_transactions))
+metrics.gauge('manager_mempool_kilobytes', 'Simulated size of the pending transactions').set_function(
+    lambda: manager.current_transactions.size)
+metrics.gauge('manager_cluster_hashes_per_second', 'Hash rate of the miners holding a chunk of proofs').set_function(
+    scheduler.hash_rate)
+
 # Activate manage thread
 manage_task = Manage(task_id=4)
 manage_task.setName('Manage Miners')
+manage_task.daemon = True
 with app.test_request_context():
     manage_task.start()
 
@@ -581,8 +1551,23 @@ def main():
 
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
+    parser.add_argument('--min-fill', default=0.5, type=float, help='fraction of a block to fill before mining it')
+    parser.add_argument('--fill-timeout', default=10, type=float, help='seconds to wait for a block to fill up')
+    parser.add_argument('--mempool-count', default=100000, type=int, help='max pending transactions')
+    parser.add_argument('--mempool-size', default=5000000, type=int, help='max size of the pending transactions in kilobytes')
+    parser.add_argument('--mempool-ttl', default=3600, type=float, help='seconds a transaction may wait to be mined')
+    parser.add_argument('--data-dir', help='directory to keep the chain in, kept in memory if not given')
+    parser.add_argument('--log-level', default='WARNING', help='DEBUG logs every block that is validated')
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
     port = args.port
+    manager.min_block_fill = args.min_fill
+    manager.block_fill_timeout = args.fill_timeout
+    manager.current_transactions.max_count = args.mempool_count
+    manager.current_transactions.max_size = args.mempool_size
+    manager.current_transactions.ttl = args.mempool_ttl
+    if args.data_dir:
+        manager.open_store(args.data_dir)
 
     # Add own address to node list
     address = f'http://0.0.0.0:{port}'
@@ -592,8 +1577,8 @@ def main():
     # Prevent address collisions when using the local network, change this in bigger networks
     manager.set_cluster_start_port(6000+(len(manager.nodes)*100))
 
-    # Start Flask app
-    app.run(host='0.0.0.0', port=port, threaded=False)
+    # Start Flask app, threaded so miners can wait on /work
+    app.run(host='0.0.0.0', port=port, threaded=True)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
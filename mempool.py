@@ -0,0 +1,237 @@
+import heapq
+from collections import deque
+from itertools import count, islice
+from threading import RLock
+from time import time
+
+import metrics
+from ledger import address, spent
+
+dropped = metrics.counter('mempool_dropped_transactions_total', 'Pending transactions dropped without being mined',
+                          ('reason',))
+
+
+def fee_rate(transaction):
+    """
+    Fee paid per "kilobyte" of block space
+
+    :param transaction: <dict> Transaction
+    :return: <float>
+    """
+    return transaction.get('fee', 0) / max(transaction['size'], 1)
+
+
+class Mempool:
+    def __init__(self, max_count=100000, max_size=5000000, ttl=3600):
+        """
+        Pending transactions, bounded in number and total size. When the pool is
+        full the transactions paying the lowest fee per size make room, and
+        transactions are dropped once they have waited ttl seconds.
+
+        :param max_count: <int> Max pending transactions, None for no limit
+        :param max_size: <int> Max total size of the pending transactions in "kilobytes", None for no limit
+        :param ttl: <float> Seconds a transaction may wait to be mined, None to wait forever
+        """
+        self.max_count = max_count
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # Pending transactions by id, in the order they arrived
+        self.transactions = dict()
+
+        # (arrival time, sequence number, id) in the order of arrival, removed transactions are skipped lazily
+        self.arrivals = deque()
+
+        # Total size of the pending transactions in "kilobytes"
+        self.size = 0
+
+        # Amount each sender pays in pending transactions, fees included
+        self.spending = dict()
+
+        # Heap of (-fee rate, sequence number, id), removed transactions are skipped lazily
+        self.fee_index = []
+        self.entries = dict()
+        self.sequence = count()
+
+        # Heap of (fee rate, -sequence number, id), the next transaction to evict on top
+        self.eviction_index = []
+
+        # Stop packing a block after this many transactions in a row did not fit
+        self.max_misses = 50
+
+        # The pool is shared by the request handlers and the background threads of a node
+        self.lock = RLock()
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.transactions
+
+    def __iter__(self):
+        return iter(self.transactions)
+
+    def get(self, transaction_id, default=None):
+        return self.transactions.get(transaction_id, default)
+
+    def items(self):
+        return self.transactions.items()
+
+    def values(self):
+        return self.transactions.values()
+
+    def add(self, transaction):
+        """
+        Add a transaction to the pool and the fee indexes, evicting the
+        transactions of the lowest fee rate if the pool is over its limits
+
+        :param transaction: <dict> Transaction with an id, size and optionally a fee
+        :return: <bool> True if added, False if it was already in the pool or pays too little to stay
+        """
+        transaction_id = transaction['id']
+        with self.lock:
+            if transaction_id in self.transactions:
+                return False
+            self.expire()
+
+            sequence = next(self.sequence)
+            rate = fee_rate(transaction)
+            self.transactions[transaction_id] = transaction
+            self.arrivals.append((time(), sequence, transaction_id))
+            self.size += transaction['size']
+            self.spend(transaction, 1)
+            self.entries[transaction_id] = sequence
+            heapq.heappush(self.fee_index, (-rate, sequence, transaction_id))
+            heapq.heappush(self.eviction_index, (rate, -sequence, transaction_id))
+
+            self.evict()
+            return transaction_id in self.transactions
+
+    def full(self):
+        return ((self.max_count is not None and len(self.transactions) > self.max_count)
+                or (self.max_size is not None and self.size > self.max_size))
+
+    def evict(self):
+        """
+        Drop the transactions paying the lowest fee per size until the pool is within its limits.
+        Of equal fee rates the latest arrival goes first.
+        """
+        while self.full() and self.eviction_index:
+            _, sequence, transaction_id = heapq.heappop(self.eviction_index)
+            if self.entries.get(transaction_id) == -sequence:
+                self.pop(transaction_id)
+                dropped.labels('full').inc()
+
+    def expire(self):
+        """
+        Drop the transactions that waited longer than the ttl, oldest first
+        """
+        with self.lock:
+            deadline = time() - self.ttl if self.ttl is not None else None
+            while self.arrivals:
+                arrival, sequence, transaction_id = self.arrivals[0]
+                if self.entries.get(transaction_id) != sequence:
+                    self.arrivals.popleft()
+                elif deadline is not None and arrival < deadline:
+                    self.arrivals.popleft()
+                    self.pop(transaction_id)
+                    dropped.labels('expired').inc()
+                else:
+                    break
+
+    def pop(self, transaction_id, default=None):
+        """
+        Remove a transaction from the pool, its heap entry is dropped when it is next reached
+
+        :param transaction_id: <str> Id of the transaction
+        :return: The removed transaction, default if it was not in the pool
+        """
+        with self.lock:
+            transaction = self.transactions.pop(transaction_id, None)
+            if transaction is None:
+                return default
+
+            del self.entries[transaction_id]
+            self.size -= transaction['size']
+            self.spend(transaction, -1)
+
+            # Rebuild the indexes once they are mostly made up of removed transactions
+            if len(self.fee_index) > 2 * len(self.transactions) + 64:
+                self.fee_index = [entry for entry in self.fee_index if self.entries.get(entry[2]) == entry[1]]
+                heapq.heapify(self.fee_index)
+            if len(self.eviction_index) > 2 * len(self.transactions) + 64:
+                self.eviction_index = [entry for entry in self.eviction_index if self.entries.get(entry[2]) == -entry[1]]
+                heapq.heapify(self.eviction_index)
+            if len(self.arrivals) > 2 * len(self.transactions) + 64:
+                self.arrivals = deque(entry for entry in self.arrivals if self.entries.get(entry[2]) == entry[1])
+            return transaction
+
+    def spend(self, transaction, sign):
+        paid = spent(transaction)
+        if not paid:
+            return
+        sender = address(transaction['sender'])
+        total = self.spending.get(sender, 0) + sign * paid
+        if total:
+            self.spending[sender] = total
+        else:
+            self.spending.pop(sender, None)
+
+    def pending_spend(self, sender):
+        """
+        :param sender: Address
+        :return: Amount the sender pays in pending transactions, fees included
+        """
+        return self.spending.get(address(sender), 0)
+
+    def select(self, max_size):
+        """
+        Pick the transactions with the highest fee per size that fit within max_size.
+        The transactions stay in the pool until they are mined.
+
+        :param max_size: <int> Max size of the block in "kilobytes"
+        :return: (<list> transactions, <int> their total size)
+        """
+        selected = []
+        reached = []
+        size = 0
+        misses = 0
+
+        with self.lock:
+            while self.fee_index and size < max_size and misses < self.max_misses:
+                entry = heapq.heappop(self.fee_index)
+                transaction_id = entry[2]
+                if self.entries.get(transaction_id) != entry[1]:
+                    continue
+
+                reached.append(entry)
+                transaction = self.transactions[transaction_id]
+                if size + transaction['size'] <= max_size:
+                    selected.append(transaction)
+                    size += transaction['size']
+                    misses = 0
+                else:
+                    misses += 1
+
+            for entry in reached:
+                heapq.heappush(self.fee_index, entry)
+        return selected, size
+
+    def oldest_age(self):
+        """
+        :return: <float> Seconds the oldest pending transaction has waited, 0 if the pool is empty
+        """
+        with self.lock:
+            self.expire()
+            if not self.arrivals:
+                return 0
+            return time() - self.arrivals[0][0]
+
+    def page(self, start=0, limit=1000):
+        """
+        :param start: <int> Number of transactions to skip, in the order they arrived
+        :param limit: <int> Max transactions to return
+        :return: <dict> Pending transactions by id
+        """
+        with self.lock:
+            return dict(islice(self.transactions.items(), start, start + limit))
@@ -0,0 +1,237 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+# Upper bounds in seconds of the buckets of a histogram, the last bucket is unbounded
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class CounterValue:
+    def __init__(self):
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield '', {}, self.value
+
+
+class GaugeValue:
+    def __init__(self):
+        self.lock = Lock()
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, function):
+        """
+        Read the value from function whenever the metrics are collected
+
+        :param function: Returns the current value
+        """
+        self.function = function
+
+    def samples(self):
+        yield '', {}, self.function() if self.function else self.value
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.lock = Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """
+        Observe the seconds spent in a with block
+        """
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', {'le': format_value(bound)}, cumulative
+        yield '_count', {}, cumulative
+        yield '_sum', {}, total
+
+
+class Metric:
+    kind = None
+    # Class of the value of each metric of the family
+    value_class = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        A metric, or a family of metrics told apart by the values of labelnames
+
+        :param name: <str> Name of the metric, Eg. 'manager_chain_height'
+        :param documentation: <str> What the metric measures
+        :param labelnames: Names of the labels, Eg. ('host',)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = Lock()
+        self.children = dict()
+
+        # A metric without labels is updated through itself
+        if not self.labelnames:
+            self.default = self.labels()
+
+    def new_value(self):
+        return self.value_class()
+
+    def labels(self, *values):
+        """
+        :return: The metric of the family with the given label values
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_value())
+        return child
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(values, None)
+
+    def collect(self):
+        """
+        :return: Lines of the metric in the Prometheus text format
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            children = list(self.children.items())
+        for values, child in children:
+            for suffix, extra, value in child.samples():
+                labels = dict(zip(self.labelnames, values))
+                labels.update(extra)
+                lines.append(f'{self.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+    value_class = CounterValue
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    value_class = GaugeValue
+
+    def set(self, value):
+        self.default.set(value)
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def dec(self, amount=1):
+        self.default.dec(amount)
+
+    def set_function(self, function):
+        self.default.set_function(function)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    value_class = HistogramValue
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        Metric.__init__(self, name, documentation, labelnames)
+
+    def new_value(self):
+        return self.value_class(self.buckets)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def time(self):
+        return self.default.time()
+
+
+class Registry:
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = dict()
+
+    def register(self, metric_class, name, documentation, labelnames=(), **kwargs):
+        """
+        Create a metric, or return the one registered under the name before
+
+        :return: The metric
+        """
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def exposition(self):
+        """
+        :return: <str> All metrics in the Prometheus text format
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.collect()) + '\n'
+
+
+# Metrics of this process, served on /metrics
+registry = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return registry.register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram, name, documentation, labelnames, buckets=buckets)
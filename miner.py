@@ -1,14 +1,28 @@
-import hashlib
 from datetime import date, datetime
-import json
 from uuid import uuid4
 from time import sleep
 from urllib.parse import urlparse
 import random
-from threading import Thread
+from threading import Condition, Thread
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+
+import encoding
+import metrics
+import outbound
+import proofofwork
+from blocks import BLOCK_VERSION, block_hash, merkle_root
+from ledger import reward_transaction
+
+hashes_total = metrics.counter('miner_hashes_total', 'Hashes computed while searching for proofs')
+worker_hash_rate = metrics.gauge('miner_hashes_per_second', 'Hash rate of each worker during the last search', ('worker',))
+search_seconds = metrics.histogram('miner_proof_search_seconds', 'Time spent on each search for a proof')
+blocks_found = metrics.counter('miner_blocks_found_total', 'Blocks found and accepted by the manager')
+
 
 class Miner:
     def __init__(self):
@@ -17,32 +31,55 @@ class Miner:
         self.node_address = ''
         self.current_transactions = []
         self.last_block = {}
+        self.last_hash = ''
         self.interval = 1
         self.start_value = 0
+        # Number of proofs in the chunk leased from the manager, None to search until stopped
+        self.count = None
+        self.difficulty = proofofwork.DIFFICULTY
 
         # Activates / Deactivates mining process
         self.is_mining = False
 
+        # Work from the manager and a counter of its changes, the search in
+        # progress stops as soon as the version moves on
+        self.work = None
+        self.work_version = 0
+        self.work_condition = Condition()
+
+        # Number of worker processes searching for the proof, 1 searches in the mining thread
+        self.processes = 1
+        self.pool = None
+        self.stop_event = None
+
+        # Hashes per second of each worker during the last proof search
+        self.hash_rates = []
+
     def new_block(self, proof, previous_hash, block_transactions, node_identifier, last_block):
         """
         Create a new Block for the manager node
 
-        :param proof: The proof given by the Proof of Work algorithm
+        :param proof: The proof given by the Proof of Work algorithm, None until it is found
         :param previous_hash: Hash of previous Block
         :return: New Block
         """
+        # The first transaction of the block pays us the reward
+        block_transactions = [reward_transaction(node_identifier)] + block_transactions
         block_size = 0
         for t in block_transactions:
             block_size += t['size']
 
         block = {
+            'version': BLOCK_VERSION,
             'index': last_block['index'] + 1,
             'timestamp': datetime.now().isoformat(),
             'transactions': block_transactions,
             'proof': proof,
             'previous_hash': previous_hash,
             'size': block_size,   # 2MB max size
+            'merkle_root': merkle_root([t['id'] for t in block_transactions]),
             'node': node_identifier,
+            'difficulty': self.difficulty,
         }
         return block
         
@@ -54,38 +91,103 @@ class Miner:
         :param block: Block
         :return <sha256 hash>
         """
+        return block_hash(block)
 
-        # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+    def set_work(self, work):
+        """
+        Switch to new work from the manager, the search in progress is cancelled
 
-    def proof_of_work(self, last_block):
+        :param work: <dict> Transactions, last block, last hash, interval, start value
+                     and difficulty of the next block, None to stop mining
+        """
+        with self.work_condition:
+            self.work = work
+            self.work_version += 1
+            self.is_mining = work is not None
+            if self.stop_event is not None:
+                self.stop_event.set()
+            self.work_condition.notify_all()
+
+    def next_work(self, version):
+        """
+        Wait for work newer than version
+
+        :return: (<int> version, <dict> work)
+        """
+        with self.work_condition:
+            self.work_condition.wait_for(lambda: self.work is not None and self.work_version != version)
+            return self.work_version, self.work
+
+    def proof_of_work(self, prefix, version=None):
         """
         Simple Proof of Work Algorithm:
 
-         - Find a number p' such that hash(pp') contains leading 4 zeroes
-         - Where p is the previous proof, and p' is the new proof
-         
-        :param last_block: <dict> last Block
+         - Find a number p' such that hash(h + p') is below the difficulty target
+         - Where h is the header of the new block without its proof and p' is the new proof
+
+        :param prefix: <bytes> The header without its proof, see proofofwork.guess_prefix()
+        :param version: <int> Version of the work being searched, the search stops when it changes
         :return: <int>
         """
 
-        last_proof = last_block['proof']
-        last_hash = self.hash(last_block)
+        if version is None:
+            version = self.work_version
+        if self.processes > 1:
+            return self.parallel_proof_of_work(prefix, version)
+
+        proof, hashes, seconds = proofofwork.search(prefix, self.start_value, self.interval,
+                                                    lambda: self.work_version != version, self.difficulty, self.count)
+        self.hash_rates = [hashes / seconds if seconds else 0]
+        self.record_search([(proof, hashes, seconds)])
+        return proof
 
-        proof = self.start_value
-        while self.is_mining:
-            if self.valid_proof(last_proof, proof, last_hash):
-                return proof
-            else:
-                proof += self.interval
-            #sleep(random.randint(1,4))
+    def parallel_proof_of_work(self, prefix, version):
+        """
+        Proof of Work spread over a pool of worker processes.
+
+        Worker k tries every (interval * processes):th proof starting from
+        start_value + k * interval, so together the workers cover the same
+        chunk of proofs that the manager assigned to this miner.
+
+        :param prefix: <bytes> The header without its proof, see proofofwork.guess_prefix()
+        :param version: <int> Version of the work being searched, the search stops when it changes
+        :return: <int> The proof, -1 if mining was stopped or the chunk was searched
+        """
+
+        if self.pool is None:
+            # Fork so the workers do not re-import the manager that started this miner
+            context = multiprocessing.get_context('fork')
+            self.stop_event = context.Event()
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                            initializer=proofofwork.init_worker,
+                                            initargs=(self.stop_event,))
+        self.stop_event.clear()
+
+        stride = self.interval * self.processes
+        count = None if self.count is None else -(-self.count // self.processes)
+        futures = [self.pool.submit(proofofwork.search_worker, prefix,
+                                    self.start_value + k*self.interval, stride, self.difficulty, count)
+                   for k in range(self.processes)]
+
+        # The first worker to find a proof stops the others, new work stops all of them
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            if self.work_version != version:
+                self.stop_event.set()
+
+        results = [future.result() for future in futures]
+        self.hash_rates = [hashes / seconds if seconds else 0 for _, hashes, seconds in results]
+        self.record_search(results)
+        proofs = [proof for proof, _, _ in results if proof > -1]
+        if proofs:
+            return min(proofs)
         return -1
 
     @staticmethod
     def valid_proof(last_proof, proof, last_hash):
         """
-        Validates the Proof
+        Validates the Proof, for blocks mined before the midstate proof format
 
         :param last_proof: <int> Previous Proof
         :param proof: <int> Current Proof
@@ -93,10 +195,47 @@ class Miner:
         :return: <bool> True if correct, False if not.
         """
 
-        guess = f'{last_proof}{proof}{last_hash}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:5] == "00000"         # Hash made easy to simulate mining
-    
+        return proofofwork.valid_proof(last_proof, proof, last_hash)
+
+    def record_search(self, results):
+        """
+        Update the metrics with the results of the workers of a search
+
+        :param results: List of (proof, hashes, seconds) per worker
+        """
+        hashes_total.inc(sum(hashes for _, hashes, _ in results))
+        search_seconds.observe(max(seconds for _, _, seconds in results))
+        for worker, rate in enumerate(self.hash_rates):
+            worker_hash_rate.labels(worker).set(rate)
+
+    def next_chunk(self, work):
+        """
+        Lease the next chunk of proofs from the manager
+
+        :param work: <dict> The work the chunk is for
+        :return: <bool> True if the miner got a chunk, False if the work is over
+        """
+        payload = {'miner': self.node_identifier, 'round': work['round']}
+        r = outbound.client.post(url=f'http://{self.manager_node}/work/chunk', json=payload)
+        if r is None or r.status_code != requests.codes.ok or r.json()['chunk'] is None:
+            return False
+
+        chunk = r.json()['chunk']
+        self.start_value = chunk['start_value']
+        self.count = chunk['count']
+        return True
+
+    def set_processes(self, processes):
+        """
+        Sets the number of worker processes used to search for proofs
+
+        :param processes: <int> Number of processes, 0 for one per available core
+        """
+        self.processes = processes or os.cpu_count() or 1
+
+    def stop(self):
+        self.set_work(None)
+
     def set_address(self, address):
         self.node_address = address
     
@@ -120,78 +259,98 @@ class Mine(Thread):
 
     def run(self):
         '''
-        Starts mining process
+        Mines each new piece of work from the manager, switching to newer work as soon as it arrives
+        '''
+        version = 0
+        while True:
+            version, work = miner.next_work(version)
+            self.completed = self.mine(work, version)
+
+    def mine(self, work, version):
+        '''
+        Searches the proof of one block
 
-        :param manager_node <string> Manager node of miner
         :return <bool> True if managed to mine block and it was included in the chain, False if not
         '''
         # Compose list of transactions of block
-        block_transactions = miner.current_transactions
+        block_transactions = work['transactions']
+        miner.current_transactions = block_transactions
+        miner.last_block = work['last_block']
+        miner.last_hash = work.get('last_hash', '')
+        miner.interval = work['interval']
+        miner.start_value = work['start_value']
+        miner.count = work.get('count')
+        miner.difficulty = work.get('difficulty', proofofwork.DIFFICULTY)
+
+        completed = False
         if block_transactions:
             last_block = miner.last_block
-            # Enter proof_of_work loop to find proof with algorithm
-            proof = miner.proof_of_work(last_block)
-            if proof > -1:
-                # Forge the new Block by adding it to the chain
-                previous_hash = miner.hash(last_block)
-                block = miner.new_block(proof, previous_hash, block_transactions, miner.node_identifier, last_block)
-                if block != None:
-                    # We must receive a reward for finding the proof.
-                    # The sender is "0" to signify that this node has mined a new coin.
-                    payload = {
-                        'sender': '0',
-                        'recipient': miner.node_identifier,
-                        'amount': 1
-                    }
-                    r = requests.post(url=f'http://{miner.manager_node}/slave/done', json=block)
-                    if r.status_code == requests.codes.ok:
-                        requests.post(url=f'http://{miner.manager_node}/transactions/new', json=payload)   # Reward miner for block
-                        self.completed = True
+            # The manager sends the hash along with the block, only hash it ourselves if it did not
+            previous_hash = miner.last_hash or miner.hash(last_block)
+            # The proof covers the header, so the block is forged before the search
+            block = miner.new_block(None, previous_hash, block_transactions, miner.node_identifier, last_block)
+            prefix = proofofwork.guess_prefix(last_block, block, previous_hash)
+            # Enter proof_of_work loop to find proof with algorithm, one chunk of proofs at a time
+            proof = miner.proof_of_work(prefix, version)
+            while proof == -1 and miner.work_version == version and miner.count is not None and miner.next_chunk(work):
+                proof = miner.proof_of_work(prefix, version)
+            if proof > -1 and miner.work_version == version:
+                block['proof'] = proof
+                # The manager syncs with its neighbours before answering, give it time
+                r = outbound.client.post(url=f'http://{miner.manager_node}/slave/done', data=encoding.encode(block),
+                                         headers={'Content-Type': encoding.CONTENT_TYPE}, timeout=60)
+                if r is not None and r.status_code == requests.codes.ok:
+                    blocks_found.inc()
+                    completed = True
 
         miner.current_transactions = []
         miner.last_block = dict()
+        miner.last_hash = ''
+        return completed
 
-    def join(self):
-        Thread.join(self)
-        return self.completed
 
+class Listen(Thread):
+    def __init__(self, task_id):
+        Thread.__init__(self)
+        self.task_id = task_id
 
+    def run(self):
+        '''
+        Long-polls the manager for work, every new version is handed to the mining thread at once
+        '''
+        version = -1
+        while True:
+            params = {'miner': miner.node_identifier, 'after': version, 'timeout': 25}
+            r = outbound.client.get(url=f'http://{miner.manager_node}/work', params=params, timeout=35)
+            if r is None or r.status_code != requests.codes.ok:
+                # Manager unreachable, try again shortly
+                sleep(1)
+                continue
+
+            values = r.json()
+            if values['version'] != version:
+                version = values['version']
+                miner.set_work(values['work'])
+
+
+# Work can also be pushed directly, the manager normally hands it out through /work
 @app.route('/start', methods=['POST'])
 def start_mining():
-    miner.is_mining = True
-    values = request.get_json()
+    values = encoding.decode_request(request)
 
     # Check that the required fields are in the POST'ed data
     required = ['transactions', 'last_block', 'interval']
-    if not all(k in values for k in required):
+    if values is None or not all(k in values for k in required):
         return 'Missing values', 400
 
-    if values != None:
-        miner.current_transactions = values['transactions']
-        miner.last_block = values['last_block']
-        miner.interval = values['interval']
-        miner.start_value = values['start_value']
-
-        # If block was mined correctly
-        async_task = Mine(task_id=1)
-        async_task.setName('Mine proof')
-        async_task.start()
-        #completed = async_task.join()
-        '''if completed:
-            response = {'message': 'Block found, stopped mining'}
-        else:
-            response = {'message': 'Block not found, stopped mining'}
-        return jsonify(response), 200'''
-        return 'Mining completed', 200
-
-    miner.current_transactions = []
-    miner.last_block = dict()
-    #return jsonify({'message': 'Transaction list was None, stopped mining'}), 400
+    values.setdefault('start_value', 0)
+    miner.set_work(values)
+    return 'Mining started', 200
 
 
 @app.route('/stop', methods=['GET'])
 def stop_mining():
-    miner.is_mining = False
+    miner.stop()
     return f'Mining process stoppped in node: {miner.node_address}', 200
 
 
@@ -204,6 +363,20 @@ def get_transactions():
     return jsonify(response), 200
 
 
+@app.route('/hashrate', methods=['GET'])
+def hash_rate():
+    response = {
+        'workers': miner.hash_rates,
+        'total': sum(miner.hash_rates),
+    }
+    return jsonify(response), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.exposition(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/mining', methods=['GET'])
 def mining():
     return miner.is_mining, 200
@@ -229,9 +402,36 @@ def get_address():
 
 
 # Starts a miner node
-def start(address, port, manager_address):
+def start(address, port, manager_address, processes=1):
     miner.set_address(f'{address}:{port}')
     miner.set_manager_address(f'{manager_address}')
+    miner.set_processes(processes)
+
+    # Mine in one long-lived thread, fed with work from the manager
+    mine_task = Mine(task_id=1)
+    mine_task.setName('Mine proof')
+    mine_task.daemon = True
+    mine_task.start()
+
+    listen_task = Listen(task_id=2)
+    listen_task.setName('Listen for work')
+    listen_task.daemon = True
+    listen_task.start()
 
     # Start flask app
-    app.run(host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, threaded=True)
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', default=6000, type=int, help='port to listen on')
+    parser.add_argument('-m', '--manager', default='0.0.0.0:5000', help='address of the manager node')
+    parser.add_argument('--processes', default=1, type=int, help='worker processes, 0 for one per core')
+    args = parser.parse_args()
+    start(address='http://0.0.0.0', port=args.port, manager_address=args.manager, processes=args.processes)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
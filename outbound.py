@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from time import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+request_seconds = metrics.histogram('outbound_request_seconds', 'Time taken by requests to other nodes', ('host',))
+request_errors = metrics.counter('outbound_request_errors_total', 'Requests to other nodes that failed', ('host',))
+
+
+class Client:
+    def __init__(self, timeout=5, workers=32, pool_size=8):
+        """
+        Outbound HTTP for a node: one keep-alive connection pool per host and a
+        thread pool to send requests to many hosts at once
+
+        :param timeout: <float> Seconds to wait for a host before giving up on it
+        :param workers: <int> Requests that can be in flight at the same time
+        :param pool_size: <int> Connections kept alive per host
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Outbound')
+
+        # Moving average of each host's response time in seconds
+        self.latencies = dict()
+        self.lock = Lock()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the shared session
+
+        :param method: <str> HTTP method, Eg. 'GET'
+        :param url: <str> Eg. 'http://192.168.0.5:5000/chain'
+        :return: <requests.Response>, None if the host could not be reached in time
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        started = time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            response = None
+            request_errors.labels(host).inc()
+        seconds = time() - started
+        self.record_latency(host, seconds)
+        request_seconds.labels(host).observe(seconds)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def send_later(self, method, url, **kwargs):
+        """
+        Send a request in the background, for messages that need no answer
+
+        :return: <Future> of the response
+        """
+        return self.executor.submit(self.request, method, url, **kwargs)
+
+    def dispatch(self, calls):
+        """
+        Send several requests at once
+
+        :param calls: List of (method, url, kwargs)
+        :return: List of (url, response or None), in the order the responses arrived
+        """
+        futures = {self.executor.submit(self.request, method, url, **kwargs): url for method, url, kwargs in calls}
+        return [(futures[future], future.result()) for future in as_completed(futures)]
+
+    def fan_out(self, method, urls, **kwargs):
+        """
+        Send the same request to several hosts at once
+
+        :param method: <str> HTTP method, Eg. 'GET'
+        :param urls: Urls to send the request to
+        :return: List of (url, response or None), in the order the responses arrived
+        """
+        return self.dispatch([(method, url, kwargs) for url in urls])
+
+    def map(self, function, items):
+        """
+        Run function on each item on the thread pool, for exchanges that take
+        more than one request per host
+
+        :return: List of results, in the order they completed
+        """
+        futures = [self.executor.submit(function, item) for item in items]
+        return [future.result() for future in as_completed(futures)]
+
+    def record_latency(self, host, seconds):
+        with self.lock:
+            previous = self.latencies.get(host)
+            self.latencies[host] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def by_latency(self, hosts):
+        """
+        :return: The hosts sorted from fastest to slowest, unknown hosts first
+        """
+        return sorted(hosts, key=lambda host: self.latencies.get(host, 0))
+
+
+# Shared by everything in this process that talks to other nodes
+client = Client()
@@ -0,0 +1,170 @@
+import hashlib
+from time import time
+
+from blocks import HEADER_FIELDS, header_bytes
+
+# Leading zero bits the hash of a proof needs, the same work as the five hex zeros of valid_proof
+DIFFICULTY = 20
+
+# Proofs are hashed as 8 big-endian bytes
+MAX_PROOF = 2 ** 64
+
+# Number of proofs tried between checks for cancellation
+CHECK_INTERVAL = 10000
+
+# Set by the miner to cancel the search in all worker processes
+stop_event = None
+
+
+def init_worker(event):
+    """
+    Initializes a worker process of a miner's process pool
+
+    :param event: <multiprocessing.Event> Set when the search should stop
+    """
+    global stop_event
+    stop_event = event
+
+
+def valid_proof(last_proof, proof, last_hash):
+    """
+    Validates the Proof, for blocks mined before the midstate proof format
+
+    :param last_proof: <int> Previous Proof
+    :param proof: <int> Current Proof
+    :param last_hash: <str> The hash of the Previous Block
+    :return: <bool> True if correct, False if not.
+    """
+
+    guess = f'{last_proof}{proof}{last_hash}'.encode()
+    guess_hash = hashlib.sha256(guess).hexdigest()
+    return guess_hash[:5] == "00000"         # Hash made easy to simulate mining
+
+
+def guess_prefix(last_block, block, last_hash):
+    """
+    The constant part of every guess for the proof of a block. Versioned blocks
+    hash their header without the proof, so the proof covers the whole header.
+    Unversioned blocks in the midstate format only hash the previous proof and hash.
+
+    :param last_block: <dict> The previous Block
+    :param block: <dict> The Block, its proof is left out
+    :param last_hash: <str> The hash of the Previous Block
+    :return: <bytes>
+    """
+    if 'version' in block:
+        return header_bytes({field: block[field] for field in HEADER_FIELDS if field in block and field != 'proof'})
+    return f'{last_block["proof"]}:{last_hash}:'.encode()
+
+
+def midstate(prefix):
+    """
+    SHA-256 state of the constant prefix of every guess for the next proof.
+    A guess is the prefix followed by the proof as 8 big-endian bytes, so the
+    state can be copied for each proof instead of hashing the prefix again.
+
+    :param prefix: <bytes> See guess_prefix()
+    :return: <hashlib.sha256>
+    """
+    return hashlib.sha256(prefix)
+
+
+def target(difficulty=DIFFICULTY):
+    """
+    The value a guess digest must be below, as 32 big-endian bytes so it can be
+    compared with the raw digest directly
+
+    :param difficulty: <int> Leading zero bits required, at least 1
+    :return: <bytes>
+    """
+    return (1 << (256 - difficulty)).to_bytes(32, 'big')
+
+
+def check_proof(prefix, proof, difficulty=DIFFICULTY):
+    """
+    Validates a Proof in the midstate format
+
+    :param prefix: <bytes> See guess_prefix()
+    :param proof: <int> Current Proof
+    :param difficulty: <int> Leading zero bits required
+    :return: <bool> True if correct, False if not.
+    """
+    guess = midstate(prefix)
+    guess.update(proof.to_bytes(8, 'big'))
+    return guess.digest() < target(difficulty)
+
+
+def valid_int(value, low, high):
+    """
+    :return: True if value is an int, not a bool, with low <= value < high
+    """
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value < high
+
+
+def verify(last_block, block, last_hash):
+    """
+    Validates the Proof of a block in whichever format it was mined.
+    Blocks mined in the midstate format record their difficulty, versioned
+    blocks must have one and their proof covers their header. Malformed
+    proofs and difficulties are invalid.
+
+    :param last_block: <dict> The previous Block
+    :param block: <dict> The Block to validate
+    :param last_hash: <str> The hash of the previous Block
+    :return: <bool> True if correct, False if not.
+    """
+    proof = block.get('proof')
+    if 'difficulty' in block or 'version' in block:
+        difficulty = block.get('difficulty')
+        if not valid_int(proof, 0, MAX_PROOF) or not valid_int(difficulty, DIFFICULTY, 257):
+            return False
+        try:
+            prefix = guess_prefix(last_block, block, last_hash)
+        except (TypeError, ValueError):
+            # Header fields the encoding does not support
+            return False
+        return check_proof(prefix, proof, difficulty)
+    return valid_int(proof, 0, MAX_PROOF) and valid_proof(last_block['proof'], proof, last_hash)
+
+
+def search(prefix, start_value, interval, stopped, difficulty=DIFFICULTY, count=None):
+    """
+    Searches every interval:th proof from start_value until a valid one is found,
+    count proofs were tried or the search is stopped
+
+    :param prefix: <bytes> See guess_prefix()
+    :param start_value: <int> First proof to try
+    :param interval: <int> Distance between the proofs tried
+    :param stopped: <callable> Returns True when the search should stop
+    :param difficulty: <int> Leading zero bits required
+    :param count: <int> Number of proofs to try, None to search until stopped
+    :return: (proof or -1 if stopped or exhausted, number of hashes computed, seconds spent)
+    """
+
+    started = time()
+    state = midstate(prefix)
+    limit = target(difficulty)
+    proof = start_value
+    remaining = count
+    while remaining != 0 and not stopped():
+        batch = CHECK_INTERVAL if remaining is None else min(CHECK_INTERVAL, remaining)
+        if remaining is not None:
+            remaining -= batch
+        for _ in range(batch):
+            guess = state.copy()
+            guess.update(proof.to_bytes(8, 'big'))
+            if guess.digest() < limit:
+                return proof, (proof - start_value) // interval + 1, time() - started
+            proof += interval
+    return -1, (proof - start_value) // interval, time() - started
+
+
+def search_worker(prefix, start_value, interval, difficulty=DIFFICULTY, count=None):
+    """
+    search() inside a worker process, cancelled through the shared stop event.
+    The first worker to find a proof stops the others.
+    """
+    result = search(prefix, start_value, interval, stop_event.is_set, difficulty, count)
+    if result[0] > -1:
+        stop_event.set()
+    return result
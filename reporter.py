@@ -0,0 +1,62 @@
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import time
+
+import outbound
+
+
+class Reporter:
+    def __init__(self, url, batch_size=100, flush_interval=1.0, max_queued=10000):
+        """
+        Sends reports to the logging node in batches from a background thread,
+        so reporting never holds up the caller. Reports that arrive while the
+        queue is full are dropped.
+
+        :param url: <str> Url of the logging node's report endpoint
+        :param batch_size: <int> Max reports per request
+        :param flush_interval: <float> Max seconds a report waits to be sent
+        :param max_queued: <int> Max reports waiting to be sent
+        """
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue(maxsize=max_queued)
+        self.dropped = 0
+
+        flusher = Thread(target=self.flush_loop, name='Reporter flush', daemon=True)
+        flusher.start()
+
+    def report(self, payload):
+        """
+        Queue a report to be sent
+
+        :param payload: <dict> The report
+        """
+        try:
+            self.queue.put_nowait(payload)
+        except Full:
+            self.dropped += 1
+
+    def next_batch(self):
+        """
+        Wait for a report, then collect more until the batch is full or flush_interval passed
+
+        :return: <list> Reports
+        """
+        batch = [self.queue.get()]
+        deadline = time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def flush_loop(self):
+        while True:
+            batch = self.next_batch()
+            # An unreachable logging node only loses this batch
+            outbound.client.post(url=self.url, json={'reports': batch})
@@ -0,0 +1,157 @@
+import heapq
+from threading import Lock
+from time import time
+
+
+class Lease:
+    def __init__(self, start, size, expires):
+        self.start = start
+        self.size = size
+        self.assigned = time()
+        self.expires = expires
+
+
+class NonceScheduler:
+    def __init__(self, chunk_size=1 << 18, chunk_seconds=1.0, min_chunk=1 << 14, max_chunk=1 << 26, lease_factor=3.0,
+                 min_lease=2.0):
+        """
+        Hands out contiguous chunks of proofs to the miners of a cluster on
+        demand. Each chunk is leased to one miner, a chunk whose lease runs out
+        before the miner finishes it goes back to the pool and is handed to
+        the next miner that asks, so the work of a slow or dead miner is taken
+        over by the others.
+
+        Chunks are sized to take each miner about chunk_seconds at the hash
+        rate measured from its earlier chunks.
+
+        :param chunk_size: <int> Proofs in the chunks of a miner with no measured hash rate
+        :param chunk_seconds: <float> Seconds a chunk should take a miner
+        :param min_chunk: <int> Smallest chunk handed out
+        :param max_chunk: <int> Largest chunk handed out
+        :param lease_factor: <float> Multiple of a chunk's expected time after which its lease runs out
+        :param min_lease: <float> Shortest lease in seconds
+        """
+        self.chunk_size = chunk_size
+        self.chunk_seconds = chunk_seconds
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.lease_factor = lease_factor
+        self.min_lease = min_lease
+
+        self.lock = Lock()
+
+        # Hashes per second of each miner, measured from the chunks it finished
+        self.rates = dict()
+
+        self.round = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Start handing out chunks for a new block, all earlier leases are void
+
+        :return: <int> Id of the new round
+        """
+        with self.lock:
+            self.round += 1
+            self.next_start = 0
+            # Heap of (start, size) of chunks given back before they were searched
+            self.free = []
+            self.leases = dict()
+            self.searched = 0
+            return self.round
+
+    def desired_size(self, miner_id):
+        rate = self.rates.get(miner_id)
+        if rate is None:
+            return self.chunk_size
+        return int(min(max(rate * self.chunk_seconds, self.min_chunk), self.max_chunk))
+
+    def expire(self, now):
+        for miner_id, lease in list(self.leases.items()):
+            if lease.expires <= now:
+                del self.leases[miner_id]
+                heapq.heappush(self.free, (lease.start, lease.size))
+
+    def assign(self, miner_id, round_id):
+        """
+        Lease the next chunk to a miner, the lowest unsearched chunk given back
+        by another miner first. A chunk the miner still holds is given back.
+
+        :param miner_id: <str> Id of the miner
+        :param round_id: <int> Round the miner is working on
+        :return: (<int> first proof, <int> number of proofs), None if the round is over
+        """
+        with self.lock:
+            if round_id != self.round:
+                return None
+            now = time()
+            self.expire(now)
+            self.give_back(miner_id)
+
+            size = self.desired_size(miner_id)
+            if self.free:
+                start, free_size = heapq.heappop(self.free)
+                if free_size > size:
+                    heapq.heappush(self.free, (start + size, free_size - size))
+                else:
+                    size = free_size
+            else:
+                start = self.next_start
+                self.next_start += size
+
+            rate = self.rates.get(miner_id)
+            expected = size / rate if rate else self.chunk_seconds
+            self.leases[miner_id] = Lease(start, size, now + max(expected * self.lease_factor, self.min_lease))
+            return start, size
+
+    def complete(self, miner_id, round_id):
+        """
+        Record that a miner searched its whole chunk without finding a proof
+
+        :param miner_id: <str> Id of the miner
+        :param round_id: <int> Round of the chunk
+        """
+        with self.lock:
+            if round_id != self.round:
+                return
+            lease = self.leases.pop(miner_id, None)
+            if lease is None:
+                # The lease ran out and the chunk went to another miner
+                return
+
+            self.searched += lease.size
+            seconds = time() - lease.assigned
+            if seconds > 0:
+                rate = lease.size / seconds
+                previous = self.rates.get(miner_id)
+                self.rates[miner_id] = rate if previous is None else 0.5 * previous + 0.5 * rate
+
+    def next_chunk(self, miner_id, round_id):
+        """
+        complete() the chunk of a miner and assign() it the next one
+        """
+        self.complete(miner_id, round_id)
+        return self.assign(miner_id, round_id)
+
+    def give_back(self, miner_id):
+        lease = self.leases.pop(miner_id, None)
+        if lease is not None:
+            heapq.heappush(self.free, (lease.start, lease.size))
+
+    def release(self, miner_id):
+        """
+        A miner left the cluster, its chunk goes to the next miner that asks
+
+        :param miner_id: <str> Id of the miner
+        """
+        with self.lock:
+            self.give_back(miner_id)
+            self.rates.pop(miner_id, None)
+
+    def hash_rate(self):
+        """
+        :return: <float> Hashes per second of the miners holding a chunk
+        """
+        with self.lock:
+            return sum(self.rates.get(miner_id, 0) for miner_id in self.leases)
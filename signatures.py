@@ -0,0 +1,164 @@
+import hashlib
+import re
+from collections import OrderedDict
+from threading import Lock
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+import encoding
+import metrics
+import validation
+from ledger import MINT, address, test_account
+
+verifications = metrics.counter('signature_verifications_total', 'Transaction signatures checked')
+cache_hits = metrics.counter('signature_cache_hits_total', 'Transaction signatures found in the verified cache')
+
+# Fields of a transaction covered by its signature and its id. The nonce tells apart equal transfers.
+SIGNED_FIELDS = ('sender', 'recipient', 'amount', 'fee', 'nonce')
+
+# Accounts owned by a key are the hex of their Ed25519 public key
+KEY_ADDRESS = re.compile('[0-9a-f]{64}')
+
+# Signatures checked per task on the process pool, smaller batches are checked in the calling process
+CHUNK_SIZE = 256
+
+
+def new_key():
+    """
+    :return: (<str> private key, <str> address) in hex
+    """
+    private_key = Ed25519PrivateKey.generate()
+    private_bytes = private_key.private_bytes(serialization.Encoding.Raw, serialization.PrivateFormat.Raw,
+                                              serialization.NoEncryption())
+    public_bytes = private_key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    return private_bytes.hex(), public_bytes.hex()
+
+
+def signed_payload(transaction):
+    """
+    :param transaction: <dict> Transaction
+    :return: <bytes> What the sender signs, the binary encoding of the signed fields
+    """
+    return encoding.encode({key: transaction[key] for key in SIGNED_FIELDS if key in transaction})
+
+
+def transaction_id(transaction):
+    """
+    :param transaction: <dict> Transaction
+    :return: <str> Id of a signed transaction, the hash of what was signed
+    """
+    return hashlib.sha256(signed_payload(transaction)).hexdigest()[:32]
+
+
+def sign(transaction, private_key):
+    """
+    Sign a transaction whose sender is the address of private_key
+
+    :param transaction: <dict> Transaction with the signed fields, the fee is 0 if not given
+    :param private_key: <str> Private key in hex, as returned by new_key()
+    :return: <dict> Copy of the transaction with its 'fee', 'id' and 'signature'
+    """
+    key = Ed25519PrivateKey.from_private_bytes(bytes.fromhex(private_key))
+    # Managers fill in a missing fee before they check the signature, so it is signed too
+    signed = dict(transaction)
+    signed.setdefault('fee', 0)
+    signed['id'] = transaction_id(signed)
+    signed['signature'] = key.sign(signed_payload(signed)).hex()
+    return signed
+
+
+def needs_signature(transaction):
+    """
+    Only the numbered test accounts of /transactions/generate and the mint are
+    not owned by anyone and send without a signature. Any other sender has to
+    be the address of a key and sign, so unsigned spends from it are refused.
+    Test accounts only pay each other, see ledger.valid_test_transfer().
+
+    :param transaction: <dict> Transaction
+    """
+    sender = transaction.get('sender')
+    return not test_account(sender) and address(sender) != MINT
+
+
+def verify(transaction):
+    """
+    :param transaction: <dict> Transaction
+    :return: True if the id and signature match the signed fields and the sender's key
+    """
+    try:
+        payload = signed_payload(transaction)
+        if transaction['id'] != hashlib.sha256(payload).hexdigest()[:32]:
+            return False
+        public_key = Ed25519PublicKey.from_public_bytes(bytes.fromhex(transaction['sender']))
+        public_key.verify(bytes.fromhex(transaction['signature']), payload)
+        return True
+    except (InvalidSignature, KeyError, TypeError, ValueError):
+        return False
+
+
+def verify_chunk(transactions):
+    """
+    :return: <list> verify() of every transaction, run on the process pool
+    """
+    return [verify(transaction) for transaction in transactions]
+
+
+class Verifier:
+    def __init__(self, cache_size=200000, parallel=True):
+        """
+        Checks the signatures of transactions in batches, on the process pool
+        when there are many. Ids whose signature was found valid are cached,
+        so a transaction relayed by several neighbours or validated again as
+        part of a block is only checked once.
+
+        :param cache_size: <int> Verified ids to remember
+        :param parallel: Use the process pool for large batches
+        """
+        self.cache_size = cache_size
+        self.parallel = parallel
+        self.verified = OrderedDict()
+        self.lock = Lock()
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.verified
+
+    def remember(self, transaction_ids):
+        with self.lock:
+            for transaction_id in transaction_ids:
+                self.verified[transaction_id] = None
+                self.verified.move_to_end(transaction_id)
+            while len(self.verified) > self.cache_size:
+                self.verified.popitem(last=False)
+
+    def verify(self, transactions):
+        """
+        :param transactions: <list> Transactions
+        :return: <list> True for every transaction that is validly signed or needs no signature
+        """
+        results = [True] * len(transactions)
+        unchecked = []
+        for number, transaction in enumerate(transactions):
+            if not needs_signature(transaction):
+                continue
+            # A cached id still has to be the hash of the fields, or it could be reused for other fields
+            if transaction.get('id') in self.verified and transaction['id'] == transaction_id(transaction):
+                cache_hits.inc()
+                continue
+            unchecked.append(number)
+        if not unchecked:
+            return results
+
+        batch = [transactions[number] for number in unchecked]
+        if self.parallel and len(batch) > CHUNK_SIZE:
+            chunks = [batch[start:start + CHUNK_SIZE] for start in range(0, len(batch), CHUNK_SIZE)]
+            checked = [result for part in validation.get_pool().map(verify_chunk, chunks) for result in part]
+        else:
+            checked = verify_chunk(batch)
+        verifications.inc(len(batch))
+
+        for number, valid in zip(unchecked, checked):
+            results[number] = valid
+        self.remember(transaction['id'] for transaction, valid in zip(batch, checked) if valid)
+        return results
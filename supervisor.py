@@ -0,0 +1,233 @@
+import logging
+import multiprocessing
+import os
+from multiprocessing.connection import wait
+from threading import RLock, Thread
+
+import metrics
+import proofofwork
+
+logger = logging.getLogger('supervisor')
+
+worker_hash_rate = metrics.gauge('supervisor_worker_hashes_per_second', 'Hash rate of each worker process during its last chunk', ('worker',))
+worker_hashes = metrics.counter('supervisor_hashes_total', 'Hashes computed by the worker processes')
+worker_restarts = metrics.counter('supervisor_worker_restarts_total', 'Worker processes started again after they exited')
+
+
+def worker_main(connection, parent):
+    """
+    Main loop of a miner worker process. Searches each chunk of proofs received
+    through the connection and sends back the result. Any new message, work or
+    stop, cancels the search in progress.
+
+    :param connection: <multiprocessing.connection.Connection> Worker's end of the pipe
+    :param parent: <int> Process id of the supervisor, the worker exits when it is gone
+    """
+    while True:
+        while not connection.poll(1.0):
+            if os.getppid() != parent:
+                return
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+
+        if message[0] == 'exit':
+            return
+        if message[0] != 'work':
+            continue
+
+        _, generation, prefix, start_value, count, difficulty = message
+        proof, hashes, seconds = proofofwork.search(prefix, start_value, 1, connection.poll, difficulty, count)
+        connection.send(('done', generation, proof, hashes, seconds))
+
+
+class Worker:
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.name = f'worker:{process.pid}'
+
+        # Hashes per second during the last search
+        self.hash_rate = 0
+
+
+class MinerSupervisor:
+    def __init__(self, on_proof, scheduler):
+        """
+        Runs the miners of a manager's cluster as worker processes, each
+        connected to the supervisor by a pipe. Each worker searches chunks of
+        proofs leased from the scheduler, one after the other. Workers that
+        crash are started again and their chunk goes back to the scheduler.
+
+        :param on_proof: Called with (work, proof) when a worker finds a proof for the current work
+        :param scheduler: <NonceScheduler> Hands out the chunks of proofs
+        """
+        self.on_proof = on_proof
+        self.scheduler = scheduler
+        self.context = multiprocessing.get_context('fork')
+        self.workers = []
+        self.lock = RLock()
+        self.restarts = 0
+
+        # Work being searched: (work, guess prefix, difficulty, scheduler round), None when idle.
+        # Results of an earlier generation of work are ignored.
+        self.work = None
+        self.generation = 0
+
+        monitor = Thread(target=self.monitor, name='Miner supervisor', daemon=True)
+        monitor.start()
+
+    def __len__(self):
+        return len(self.workers)
+
+    def spawn(self):
+        connection, worker_connection = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(worker_connection, os.getpid()), daemon=True)
+        process.start()
+        worker_connection.close()
+        return Worker(process, connection)
+
+    def add_workers(self, number):
+        """
+        Start new worker processes, they join the work in progress right away
+
+        :param number: <int> Number of workers to add
+        """
+        with self.lock:
+            for _ in range(number):
+                self.workers.append(self.spawn())
+                if self.work is not None:
+                    self.send_work(len(self.workers) - 1)
+
+    def start(self, work, prefix, difficulty, round_id):
+        """
+        Have the workers search for a proof in chunks from the scheduler
+
+        :param work: Passed back to on_proof with the proof
+        :param prefix: <bytes> Constant part of every guess, see proofofwork.guess_prefix()
+        :param difficulty: <int> Leading zero bits required
+        :param round_id: <int> Scheduler round of the work
+        """
+        with self.lock:
+            self.work = (work, prefix, difficulty, round_id)
+            self.dispatch()
+
+    def stop(self):
+        """
+        Cancel the search in progress
+        """
+        with self.lock:
+            self.work = None
+            self.generation += 1
+            for worker in self.workers:
+                self.send(worker, ('stop',))
+
+    def dispatch(self):
+        self.generation += 1
+        for index in range(len(self.workers)):
+            self.send_work(index)
+
+    def send_work(self, index, finished=False):
+        """
+        Send a worker the next chunk of the current work
+
+        :param index: <int> Index of the worker
+        :param finished: <bool> True if the worker searched its previous chunk to the end
+        """
+        _, prefix, difficulty, round_id = self.work
+        worker = self.workers[index]
+        if finished:
+            chunk = self.scheduler.next_chunk(worker.name, round_id)
+        else:
+            chunk = self.scheduler.assign(worker.name, round_id)
+        if chunk is None:
+            return
+        start_value, count = chunk
+        self.send(worker, ('work', self.generation, prefix, start_value, count, difficulty))
+
+    @staticmethod
+    def send(worker, message):
+        try:
+            worker.connection.send(message)
+        except OSError:
+            # The worker died, the monitor starts it again
+            pass
+
+    def monitor(self):
+        """
+        Collect results from the workers and restart the ones that exited
+        """
+        while True:
+            with self.lock:
+                connections = {worker.connection: worker for worker in self.workers}
+                sentinels = {worker.process.sentinel: index for index, worker in enumerate(self.workers)}
+
+            for ready in wait(list(connections) + list(sentinels), timeout=0.5):
+                if ready in sentinels:
+                    self.restart(sentinels[ready])
+                    continue
+                try:
+                    message = ready.recv()
+                except (EOFError, OSError):
+                    continue
+                self.handle(connections[ready], message)
+
+    def handle(self, worker, message):
+        _, generation, proof, hashes, seconds = message
+        with self.lock:
+            worker.hash_rate = hashes / seconds if seconds else 0
+            worker_hash_rate.labels(worker.name).set(worker.hash_rate)
+            worker_hashes.inc(hashes)
+            if generation != self.generation:
+                return
+            if proof < 0:
+                # The chunk was searched to the end
+                if worker in self.workers:
+                    self.send_work(self.workers.index(worker), finished=True)
+                return
+            work = self.work[0]
+            self.stop()
+        self.on_proof(work, proof)
+
+    def restart(self, index):
+        with self.lock:
+            worker = self.workers[index]
+            if worker.process.is_alive():
+                return
+            worker.process.join()
+            worker.connection.close()
+            self.scheduler.release(worker.name)
+            worker_hash_rate.remove(worker.name)
+            worker_restarts.inc()
+            logger.warning(f'Miner worker {worker.process.pid} exited with code {worker.process.exitcode}, restarting it')
+
+            self.workers[index] = self.spawn()
+            self.restarts += 1
+            if self.work is not None:
+                self.send_work(index)
+
+    def hash_rates(self):
+        """
+        :return: Hashes per second of each worker during its last search
+        """
+        with self.lock:
+            return [worker.hash_rate for worker in self.workers]
+
+    def describe(self):
+        """
+        :return: A name for each worker, Eg. 'worker:1234' with the process id
+        """
+        with self.lock:
+            return [worker.name for worker in self.workers]
+
+    def close(self):
+        with self.lock:
+            self.work = None
+            for worker in self.workers:
+                self.send(worker, ('exit',))
+            for worker in self.workers:
+                worker.process.join(timeout=1)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            self.workers = []
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from blocks import block_hash, block_work, body, header, merkle_root, valid_body
+
+
+class BlocksTestCase(TestCase):
+
+    def setUp(self):
+        self.transactions = [{'id': f'tx{i}', 'amount': i, 'size': 10} for i in range(5)]
+        self.block = {
+            'index': 2,
+            'timestamp': 1.0,
+            'transactions': self.transactions,
+            'proof': 35293,
+            'previous_hash': 'abc',
+            'size': 50,
+            'merkle_root': merkle_root([t['id'] for t in self.transactions]),
+            'node': 'miner',
+        }
+
+
+class TestMerkleRoot(BlocksTestCase):
+
+    def test_order_matters(self):
+        assert merkle_root(['a', 'b']) != merkle_root(['b', 'a'])
+
+    def test_odd_level_pairs_last(self):
+        assert merkle_root(['a', 'b', 'c']) == merkle_root(['a', 'b', 'c', 'c'])
+
+    def test_empty(self):
+        assert merkle_root([]) == merkle_root([])
+        assert merkle_root([]) != merkle_root([''])
+
+
+class TestHeader(BlocksTestCase):
+
+    def test_header_has_no_transactions(self):
+        assert 'transactions' not in header(self.block)
+        assert block_hash(header(self.block)) == block_hash(self.block)
+
+    def test_hash_covers_transactions_through_root(self):
+        self.transactions.append({'id': 'tx5', 'amount': 5, 'size': 10})
+        assert not valid_body(self.block)
+
+        self.block['merkle_root'] = merkle_root([t['id'] for t in self.transactions])
+        assert valid_body(self.block)
+
+    def test_body_completes_header(self):
+        block = dict(header(self.block))
+        block.update(body(self.block))
+        assert block == self.block
+
+    def test_legacy_block_is_hashed_whole(self):
+        del self.block['merkle_root']
+        assert header(self.block) is self.block
+        assert valid_body(self.block)
+
+
+class TestBlockWork(BlocksTestCase):
+
+    def test_work_doubles_with_difficulty(self):
+        self.block['difficulty'] = 20
+        work = block_work(self.block)
+
+        self.block['difficulty'] = 21
+        assert block_work(self.block) == 2 * work
+
+    def test_legacy_block_counts_once(self):
+        assert block_work(self.block) == 1
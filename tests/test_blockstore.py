@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import TestCase
+
+from blockstore import BlockStore, RECORD, StoreHeights, StoreList, StoreTransactions
+from hashtable import HashTable
+
+
+def make_block(index):
+    return {'index': index, 'transactions': [{'id': f'{index:032x}'}], 'proof': index}
+
+
+def block_hash(block):
+    return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+
+class BlockStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = self.directory.name
+        self.store = self.open()
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def open(self, **kwargs):
+        return BlockStore(self.path, **kwargs)
+
+    def reopen(self, **kwargs):
+        self.store.close()
+        self.store = self.open(**kwargs)
+
+    def append_blocks(self, start, end):
+        for index in range(start, end):
+            block = make_block(index)
+            self.store.append(block, block_hash(block), 2 ** 20 * index)
+
+
+class TestBlockStore(BlockStoreTestCase):
+
+    def test_read_back(self):
+        self.append_blocks(1, 6)
+
+        assert len(self.store) == 5
+        assert self.store[0] == make_block(1)
+        assert self.store[-1] == make_block(5)
+        assert self.store[3:] == [make_block(4), make_block(5)]
+        assert self.store.height_of(block_hash(make_block(2))) == 2
+
+    def test_survives_restart(self):
+        self.append_blocks(1, 6)
+
+        self.reopen(cache_size=1)
+
+        assert len(self.store) == 5
+        assert list(self.store) == [make_block(index) for index in range(1, 6)]
+        assert self.store.hash_at(4) == block_hash(make_block(5))
+
+    def test_truncate(self):
+        self.append_blocks(1, 6)
+
+        del self.store[2:]
+        self.append_blocks(10, 12)
+        self.reopen()
+
+        assert [block['index'] for block in self.store] == [1, 2, 10, 11]
+        assert self.store.height_of(block_hash(make_block(5))) is None
+
+    def test_new_segments(self):
+        self.reopen(segment_size=100)
+
+        self.append_blocks(1, 6)
+        self.reopen(segment_size=100)
+
+        assert os.path.exists(os.path.join(self.path, 'blocks_00004.dat'))
+        assert [block['index'] for block in self.store] == [1, 2, 3, 4, 5]
+
+    def test_recovers_from_partial_writes(self):
+        self.append_blocks(1, 4)
+        self.store.close()
+
+        # Half written index record and a record whose block data never reached the disk
+        with open(os.path.join(self.path, 'index.dat'), 'ab') as index:
+            index.write(RECORD.pack(0, 10000, 50, bytes(32), bytes(40)))
+            index.write(b'\x00' * 7)
+        with open(os.path.join(self.path, 'blocks_00000.dat'), 'ab') as segment:
+            segment.write(b'{"half')
+
+        self.store = self.open()
+        self.append_blocks(4, 5)
+        self.reopen()
+
+        assert [block['index'] for block in self.store] == [1, 2, 3, 4]
+
+    def test_hashes(self):
+        self.append_blocks(1, 4)
+        hashes = StoreList(self.store, self.store.hash_at)
+
+        assert len(hashes) == 3
+        assert hashes[-1] == block_hash(make_block(3))
+        assert hashes[1:] == [block_hash(make_block(2)), block_hash(make_block(3))]
+
+        self.append_blocks(4, 5)
+        assert list(hashes)[-1] == block_hash(make_block(4))
+
+    def test_work(self):
+        self.append_blocks(1, 4)
+        self.store.append(make_block(4), block_hash(make_block(4)), 2 ** 256 * 4)
+        self.reopen()
+
+        assert list(StoreList(self.store, self.store.work_at)) == [2 ** 20, 2 ** 21, 3 * 2 ** 20, 2 ** 258]
+
+    def test_heights_survive_restart(self):
+        self.append_blocks(1, 6)
+        del self.store[3:]
+        self.append_blocks(10, 11)
+        self.reopen()
+        heights = StoreHeights(self.store)
+
+        assert heights.get(block_hash(make_block(10))) == 4
+        assert block_hash(make_block(2)) in heights
+        assert block_hash(make_block(4)) not in heights
+        assert len(self.store.heights) == 4
+
+    def test_heights_after_a_crash(self):
+        self.append_blocks(1, 5)
+        self.store.close()
+
+        # The entry of block 2 never reached the disk, nor did the record of block 4
+        heights = HashTable(os.path.join(self.path, 'heights.dat'), 32, 4)
+        heights.delete(bytes.fromhex(block_hash(make_block(2))))
+        heights.mark = 1
+        heights.close()
+        with open(os.path.join(self.path, 'index.dat'), 'r+b') as index:
+            index.truncate(3 * RECORD.size)
+        self.store = self.open()
+
+        assert self.store.height_of(block_hash(make_block(2))) == 2
+        assert self.store.height_of(block_hash(make_block(4))) is None
+
+    def test_transactions(self):
+        self.append_blocks(1, 4)
+        transactions = StoreTransactions(self.store)
+        for index in range(1, 5):
+            transactions[f'{index:032x}'] = (index, 0)
+
+        assert transactions.get(f'{2:032x}') == (2, 0)
+        # Block 4 is not stored yet
+        assert f'{4:032x}' not in transactions
+        assert transactions.pop(f'{3:032x}') == (3, 0)
+        assert transactions.get(f'{3:032x}') is None
+
+        transactions[f'{1:032x}'] = (1, 1)
+        assert transactions.get(f'{1:032x}') is None
+
+    def test_checkpoint(self):
+        self.append_blocks(1, 4)
+        self.store.save_checkpoint({'blocks': 3})
+        self.append_blocks(4, 6)
+        self.reopen()
+
+        assert self.store.load_checkpoint() == (3, {'blocks': 3})
+
+    def test_checkpoint_is_written_in_the_background(self):
+        self.reopen(sync_interval=0.01)
+        self.append_blocks(1, 4)
+        self.store.save_checkpoint({'blocks': 3})
+
+        for _ in range(100):
+            if self.store.pending_checkpoint is None:
+                break
+            sleep(0.05)
+
+        assert self.store.load_checkpoint() == (3, {'blocks': 3})
+
+    def test_stale_checkpoint(self):
+        self.append_blocks(1, 4)
+        self.store.save_checkpoint({'blocks': 3})
+        self.store.write_checkpoint()
+
+        # The block the checkpoint was taken at is replaced
+        del self.store[2:]
+        self.append_blocks(10, 12)
+
+        assert self.store.load_checkpoint() == (0, None)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+from unittest import TestCase
+
+import encoding
+from blocks import BLOCK_VERSION, block_hash, header, merkle_root
+
+
+class EncodingTestCase(TestCase):
+
+    def setUp(self):
+        transactions = [{'sender': 1, 'recipient': 2, 'amount': 3, 'fee': 1, 'size': 50, 'id': f'{i:032x}'}
+                        for i in range(3)]
+        self.block = {
+            'version': 2,
+            'index': 2,
+            'timestamp': '2020-01-01T00:00:00.000001',
+            'transactions': transactions,
+            'proof': 35293,
+            'previous_hash': 'ab' * 32,
+            'size': 150,
+            'merkle_root': merkle_root([t['id'] for t in transactions]),
+            'node': 'miner',
+            'difficulty': 20,
+        }
+
+
+class TestEncoding(EncodingTestCase):
+
+    def test_round_trip(self):
+        assert encoding.decode(encoding.encode(self.block)) == self.block
+
+    def test_values(self):
+        for value in (None, True, False, 0, 127, 128, -1, -129, 2 ** 70, 1.5, '', 'abc', 'ABCD', 'abc1', 'ünï',
+                      [], [1, [2]], {'unknown key': {'index': 1}}):
+            assert encoding.decode(encoding.encode(value)) == value
+            assert type(encoding.decode(encoding.encode(value))) is type(value)
+
+    def test_key_order_does_not_matter(self):
+        reordered = dict(reversed(list(self.block.items())))
+        assert encoding.encode(reordered) == encoding.encode(self.block)
+
+    def test_smaller_than_json(self):
+        assert len(encoding.encode(self.block)) < len(json.dumps(self.block))
+
+    def test_invalid_data(self):
+        data = encoding.encode(self.block)
+        for broken in (data[:-1], data + b'\x00', b'\xff', b''):
+            with self.assertRaises(ValueError):
+                encoding.decode(broken)
+
+    def test_deep_nesting(self):
+        nested = encoding.encode([[[]]])
+        assert encoding.decode(nested) == [[[]]]
+        with self.assertRaises(ValueError):
+            encoding.decode(bytes([encoding.LIST, 1]) * 10 ** 5 + bytes([encoding.NONE]))
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            encoding.encode({'timestamp': object()})
+
+
+class TestBlockHash(EncodingTestCase):
+
+    def test_version_2_hashes_binary_header(self):
+        assert block_hash(self.block) == hashlib.sha256(encoding.encode(header(self.block))).hexdigest()
+
+    def test_legacy_block_hashes_json(self):
+        del self.block['version']
+        assert block_hash(self.block) == hashlib.sha256(json.dumps(header(self.block), sort_keys=True).encode()).hexdigest()
+
+    def test_current_version_hashes_json_header(self):
+        self.block['version'] = BLOCK_VERSION
+        assert block_hash(self.block) == hashlib.sha256(json.dumps(header(self.block), sort_keys=True).encode()).hexdigest()
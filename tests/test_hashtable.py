@@ -0,0 +1,85 @@
+import hashlib
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from hashtable import HashTable
+
+
+def key(number):
+    return hashlib.sha256(str(number).encode()).digest()
+
+
+def value(number):
+    return number.to_bytes(4, 'big')
+
+
+class TestHashTable(TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'table.dat')
+        self.table = HashTable(self.path, 32, 4, capacity=8)
+
+    def tearDown(self):
+        self.table.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.table.close()
+        self.table = HashTable(self.path, 32, 4)
+
+    def test_put_and_get(self):
+        for number in range(100):
+            self.table.put(key(number), value(number))
+        self.table.put(key(5), value(500))
+
+        assert len(self.table) == 100
+        assert self.table.capacity == 256
+        assert self.table.get(key(7)) == value(7)
+        assert self.table.get(key(5)) == value(500)
+        assert self.table.get(key(100)) is None
+        assert key(99) in self.table
+
+    def test_delete_keeps_colliding_keys(self):
+        # Keys sharing their first bytes all probe from the same slot
+        colliding = [bytes(8) + number.to_bytes(24, 'big') for number in range(3)]
+        for number, colliding_key in enumerate(colliding):
+            self.table.put(colliding_key, value(number))
+
+        assert self.table.delete(colliding[0])
+        assert not self.table.delete(colliding[0])
+        assert self.table.get(colliding[1]) == value(1)
+        assert self.table.get(colliding[2]) == value(2)
+        assert len(self.table) == 2
+
+    def test_delete_many(self):
+        for number in range(200):
+            self.table.put(key(number), value(number))
+        for number in range(0, 200, 3):
+            self.table.delete(key(number))
+
+        assert all((self.table.get(key(number)) is None) == (number % 3 == 0) for number in range(200))
+
+    def test_survives_restart(self):
+        for number in range(20):
+            self.table.put(key(number), value(number))
+        self.table.mark = 20
+        self.table.flush()
+
+        self.reopen()
+
+        assert len(self.table) == 20
+        assert self.table.mark == 20
+        assert self.table.get(key(19)) == value(19)
+
+    def test_damaged_file_starts_empty(self):
+        self.table.put(key(1), value(1))
+        self.table.close()
+        with open(self.path, 'ab') as table:
+            table.write(b'\x00' * 3)
+
+        self.table = HashTable(self.path, 32, 4)
+
+        assert len(self.table) == 0
+        assert self.table.mark == 0
@@ -0,0 +1,85 @@
+from unittest import TestCase
+
+from ledger import (Balances, reward_transaction, spent, valid_amounts, valid_rewards, valid_test_transfer,
+                    valid_transaction)
+
+
+class TestBalances(TestCase):
+
+    def setUp(self):
+        self.balances = Balances()
+        self.mint = {'index': 2, 'node': 'miner', 'transactions': [
+            {'sender': '0', 'recipient': 'alice', 'amount': 10, 'id': 'a'},
+        ]}
+        self.transfer = {'index': 3, 'node': 'miner', 'transactions': [
+            {'sender': 'alice', 'recipient': 5, 'amount': 4, 'fee': 1, 'id': 'b'},
+        ]}
+
+    def test_apply(self):
+        self.balances.apply_block(self.mint)
+        self.balances.apply_block(self.transfer)
+
+        assert self.balances.balance('alice') == 5
+        assert self.balances.balance('5') == 4
+        assert self.balances.balance('miner') == 1
+        assert self.balances.balance('nobody') == 0
+
+    def test_revert_restores_balances(self):
+        self.balances.apply_block(self.mint)
+        self.balances.apply_block(self.transfer)
+
+        self.balances.revert_block(self.transfer)
+        assert self.balances.balances == {'alice': 10}
+
+        self.balances.revert_block(self.mint)
+        assert len(self.balances) == 0
+
+    def test_test_accounts_pay_no_fees(self):
+        self.balances.apply_block({'index': 2, 'node': 'miner', 'transactions': [
+            {'sender': 1, 'recipient': 2, 'amount': 4, 'fee': 10 ** 9, 'id': 'a'},
+        ]})
+
+        assert self.balances.balance('miner') == 0
+        assert self.balances.balance('2') == 4
+
+    def test_spent(self):
+        assert spent(self.mint['transactions'][0]) == 0
+        assert spent(self.transfer['transactions'][0]) == 5
+
+    def test_valid_amounts(self):
+        assert valid_amounts({'amount': 1})
+        assert valid_amounts({'amount': 0.5, 'fee': 0})
+        assert not valid_amounts({'amount': 0})
+        assert not valid_amounts({'amount': 1, 'fee': -1})
+        assert not valid_amounts({'amount': '1'})
+        assert not valid_amounts({'amount': True})
+
+    def test_rewards(self):
+        block = {'version': 3, 'transactions': [reward_transaction('miner')]}
+        assert valid_rewards(block)
+
+        block['transactions'].append(reward_transaction('miner'))
+        assert not valid_rewards(block)
+
+        block['version'] = 2
+        assert not valid_rewards(block)
+
+        del block['version']
+        assert valid_rewards(block)
+
+    def test_test_accounts_only_pay_each_other(self):
+        assert valid_test_transfer({'sender': 1, 'recipient': 2})
+        assert valid_test_transfer({'sender': 'alice', 'recipient': 2})
+        assert not valid_test_transfer({'sender': 1, 'recipient': 'alice'})
+        assert not valid_test_transfer({'sender': 1, 'recipient': '2'})
+
+    def test_valid_transaction(self):
+        transaction = {'sender': 'alice', 'recipient': 'bob', 'amount': 1, 'size': 0, 'id': 'a'}
+        assert valid_transaction(transaction)
+        assert not valid_transaction([transaction])
+        assert not valid_transaction(dict(transaction, size=-1))
+        assert not valid_transaction(dict(transaction, size=1.5))
+        assert not valid_transaction(dict(transaction, size=True))
+        assert not valid_transaction(dict(transaction, id=1))
+        assert not valid_transaction(dict(transaction, amount=0))
+        assert not valid_transaction({key: value for key, value in transaction.items() if key != 'sender'})
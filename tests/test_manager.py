@@ -0,0 +1,454 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import manager
+import proofofwork
+from blocks import body, header
+from blockstore import LOCATION, StoreTransactions
+from hashtable import HashTable
+from ledger import MINT, address
+from manager import Blockchain
+from signatures import new_key, sign
+
+
+def mine(chain, transactions, node='miner'):
+    """
+    A block with a valid proof on top of chain
+    """
+    block = chain.new_block_template(transactions, node)
+    prefix = proofofwork.guess_prefix(chain.last_block(), block, chain.last_hash())
+    block['proof'], _, _ = proofofwork.search(prefix, 0, 1, lambda: False)
+    return block
+
+
+def transaction(sender, nonce):
+    return {'sender': sender, 'recipient': 99, 'amount': 1, 'fee': 0, 'size': 1, 'id': f'{sender}-{nonce}'}
+
+
+class ManagerTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Both branches share the genesis block and one block on top of it, mined once for all tests
+        cls.transactions = {name: transaction(sender, 0) for sender, name in enumerate(('ours', 'both', 'theirs'), 1)}
+        builder = Blockchain()
+        cls.genesis = builder.chain[0]
+        builder.append_block(mine(builder, []))
+        cls.common = builder.chain[1]
+
+        builder.append_block(mine(builder, [cls.transactions['ours'], cls.transactions['both']], node='us'))
+        cls.ours = [builder.chain[2]]
+        builder.truncate_chain(2)
+
+        builder.append_block(mine(builder, [cls.transactions['both']], node='them'))
+        builder.append_block(mine(builder, [cls.transactions['theirs']], node='them'))
+        cls.theirs = builder.chain[2:]
+
+    def new_chain(self, blocks):
+        chain = LocalChain()
+        chain.truncate_chain(0)
+        for block in [self.genesis, self.common] + blocks:
+            chain.append_block(block)
+        return chain
+
+    def setUp(self):
+        self.chain = self.new_chain(self.ours)
+        self.neighbour = self.new_chain(self.theirs)
+        self.chain.nodes = {'them'}
+        self.chain.neighbour_chains['them'] = self.neighbour
+
+    def headers(self, start):
+        """
+        The neighbour's /headers?start=start&format=ndjson
+        """
+        yield json.dumps({'length': len(self.neighbour.chain), 'start': start, 'work': self.neighbour.total_work()})
+        for block in self.neighbour.chain[start:]:
+            yield json.dumps(header(block))
+
+    def bodies(self, start, change=None):
+        """
+        The neighbour's /bodies?start=start&format=ndjson, each body updated with change
+        """
+        yield json.dumps({'length': len(self.neighbour.chain), 'start': start})
+        for block in self.neighbour.chain[start:]:
+            yield json.dumps(dict(body(block), **(change or {})))
+
+
+class LocalChain(Blockchain):
+    """
+    A chain whose neighbours are other chains in this process instead of nodes
+    """
+
+    def __init__(self):
+        Blockchain.__init__(self)
+        self.neighbour_chains = dict()
+
+    def read_page(self, node, path, start, read):
+        neighbour = self.neighbour_chains[node]
+        part = header if path == 'headers' else body
+        blocks = neighbour.chain[start:start + self.sync_page]
+        lines = [json.dumps({'length': len(neighbour.chain), 'start': start, 'work': neighbour.total_work()})]
+        return read(iter(lines + [json.dumps(part(block)) for block in blocks]))
+
+
+class TestReorganize(ManagerTestCase):
+
+    def test_branch_of_more_work_replaces_ours(self):
+        assert self.chain.missing_headers('them', self.chain.total_work()) == (2, self.neighbour.total_work())
+        assert self.chain.resolve_conflicts()
+
+        assert list(self.chain.block_hashes) == list(self.neighbour.block_hashes)
+        assert self.chain.total_work() == self.neighbour.total_work()
+
+    def test_branch_of_less_work_is_kept_out(self):
+        self.neighbour.nodes = {'us'}
+        self.neighbour.neighbour_chains['us'] = self.chain
+
+        assert self.neighbour.missing_headers('us', self.neighbour.total_work()) is None
+        assert not self.neighbour.resolve_conflicts()
+        assert self.neighbour.block_hashes[2] != self.chain.block_hashes[2]
+
+    def test_branch_is_synced_in_pages(self):
+        reorganized = manager.reorganized_blocks.default.value
+        self.chain.sync_page = 1
+
+        assert self.chain.resolve_conflicts()
+
+        assert list(self.chain.block_hashes) == list(self.neighbour.block_hashes)
+        assert self.chain.transaction_status(self.transactions['theirs']['id'])['height'] == 4
+        assert manager.reorganized_blocks.default.value == reorganized + 1
+
+    def test_malformed_streams_are_not_valid(self):
+        work = self.chain.total_work()
+        first, = list(self.headers(2))[:1]
+        for height, lines in ((2, ['[1, 2]']), (2, ['{']), (2, [json.dumps({'work': work + 1})]),
+                              (2, [json.dumps({'length': '4', 'work': work + 1})]), (2, [first, '[1]']),
+                              (2, [first, '{"index": 3}']), (0, [first, '"genesis"'])):
+            assert self.chain.read_blocks(iter(lines), height, work) is None
+
+        _, headers, _ = self.chain.read_blocks(self.headers(2), 2, work)
+        assert self.chain.read_bodies(iter(['{}', '{', '{}']), headers) is None
+
+    def test_pages_follow_the_page_before(self):
+        work = self.chain.total_work()
+        length, headers, hashes = self.chain.read_blocks(self.headers(3), 3, work, (self.theirs[0], self.neighbour.block_hashes[2]))
+
+        assert (length, headers, hashes) == (4, [header(self.theirs[1])], [self.neighbour.block_hashes[3]])
+        assert self.chain.read_blocks(self.headers(3), 3, work, (self.ours[0], self.chain.block_hashes[2])) is None
+        assert self.chain.read_blocks(self.headers(4), 4, work, (self.theirs[1], self.neighbour.block_hashes[3])) == (4, [], [])
+
+    def test_bodies_do_not_change_headers(self):
+        _, headers, _ = self.chain.read_blocks(self.headers(2), 2, self.chain.total_work())
+
+        assert self.chain.read_bodies(self.bodies(2), headers) == self.neighbour.chain[2:]
+        assert self.chain.read_bodies(self.bodies(2, {'node': 'evil'}), headers) is None
+        assert self.chain.read_bodies(self.bodies(2, {'transactions': []}), headers) is None
+
+    def test_shared_blocks_are_not_part_of_the_branch(self):
+        # A neighbour as long as us makes us step back to height 1, below the fork
+        self.chain.append_block(mine(self.chain, [], node='us'))
+
+        assert self.chain.missing_headers('them', 0) == (2, self.neighbour.total_work())
+
+    def test_dropped_transactions_return_to_the_pool(self):
+        self.chain.resolve_conflicts()
+
+        assert self.transactions['ours']['id'] in self.chain.current_transactions
+        assert self.chain.transaction_status(self.transactions['ours']['id'])['status'] == 'pending'
+
+    def test_included_transactions_leave_the_pool(self):
+        self.chain.add_transaction(self.transactions['theirs'])
+
+        self.chain.resolve_conflicts()
+
+        assert self.transactions['theirs']['id'] not in self.chain.current_transactions
+        assert self.transactions['both']['id'] not in self.chain.current_transactions
+        assert self.chain.transaction_status(self.transactions['both']['id'])['height'] == 3
+
+    def test_rewards_are_not_restored(self):
+        self.chain.resolve_conflicts()
+
+        assert all(address(pending['sender']) != MINT for pending in self.chain.current_transactions.values())
+        assert self.chain.balances.balance('us') == 0
+        assert self.chain.balances.balance('them') == 2
+
+
+class TestExtendChain(ManagerTestCase):
+
+    def test_malformed_transactions_leave_the_chain_unchanged(self):
+        hashes = list(self.chain.block_hashes)
+        balances = dict(self.chain.balances.balances)
+
+        # The merkle root only covers the ids, so the other fields can be changed after mining
+        for field, value in (('size', -5), ('size', 'x'), ('amount', '1'), ('recipient', None)):
+            block = mine(self.chain, [transaction(4, 0)])
+            if value is None:
+                del block['transactions'][1][field]
+            else:
+                block['transactions'][1][field] = value
+
+            assert not self.chain.extend_chain(block)
+            assert list(self.chain.block_hashes) == hashes
+            assert self.chain.balances.balances == balances
+            assert self.chain.transaction_status(block['transactions'][0]['id'])['status'] == 'unknown'
+
+
+class TestTransactionStatus(ManagerTestCase):
+
+    def test_included(self):
+        both, theirs = self.transactions['both']['id'], self.transactions['theirs']['id']
+
+        assert self.neighbour.transaction_status(both) == {
+            'status': 'included',
+            'height': 3,
+            'position': 1,
+            'block_hash': self.neighbour.block_hashes[2],
+            'confirmations': 2,
+        }
+        assert self.neighbour.transaction_status(theirs)['confirmations'] == 1
+
+    def test_pending(self):
+        pending = transaction(4, 0)
+        self.chain.add_transaction(pending)
+
+        assert self.chain.transaction_status(pending['id']) == {'status': 'pending', 'confirmations': 0}
+
+    def test_unknown(self):
+        assert self.chain.transaction_status('0' * 32) == {'status': 'unknown', 'confirmations': 0}
+
+    def test_truncated_blocks_leave_the_index(self):
+        self.chain.truncate_chain(2)
+
+        assert self.chain.transaction_status(self.transactions['ours']['id'])['status'] == 'unknown'
+        assert self.chain.transaction_status(self.chain.chain[1]['transactions'][0]['id'])['height'] == 2
+
+
+class TestNewTransactions(TestCase):
+
+    def setUp(self):
+        self.chain = Blockchain()
+        self.private_key, self.address = new_key()
+        self.chain.balances.credit(self.address, 10)
+
+    def signed(self, amount, nonce):
+        return sign({'sender': self.address, 'recipient': 'bob', 'amount': amount, 'fee': 0, 'nonce': nonce},
+                    self.private_key)
+
+    def test_results_per_transaction(self):
+        forged = dict(self.signed(1, 2), amount=2)
+
+        results = self.chain.new_transactions([self.signed(1, 1), forged, {'sender': 5, 'recipient': 6, 'amount': 1}])
+
+        assert results[0] == {'id': self.signed(1, 1)['id']}
+        assert results[1] == {'error': 'Error: Invalid signature'}
+        assert 'id' in results[2]
+        assert len(self.chain.current_transactions) == 2
+
+    def test_duplicates_in_one_batch(self):
+        transaction = self.signed(1, 1)
+
+        results = self.chain.new_transactions([transaction, transaction], check_funds=True)
+
+        assert results == [{'id': transaction['id']}, {'error': 'Error: Transaction already known'}]
+
+    def test_funds_are_checked_across_the_batch(self):
+        results = self.chain.new_transactions([self.signed(6, 1), self.signed(6, 2), {'sender': 5, 'recipient': 6, 'amount': 6}],
+                                              check_funds=True)
+
+        assert 'id' in results[0]
+        assert results[1] == {'error': 'Error: Insufficient funds'}
+        # Only /transactions/generate lets test accounts pay without funds
+        assert results[2] == {'error': 'Error: Insufficient funds'}
+        assert self.chain.spendable(self.address) == 4
+
+    def test_test_accounts_do_not_pay_keys_in_blocks(self):
+        block = {'index': 2, 'transactions': [{'sender': 5, 'recipient': self.address, 'amount': 1, 'size': 1, 'id': 'a'}]}
+
+        assert not self.chain.valid_transactions([block])
+        block['transactions'][0]['recipient'] = 6
+        assert self.chain.valid_transactions([block])
+
+
+class TestOpenStore(ManagerTestCase):
+
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self):
+        self.chain.chain.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        """
+        :return: The chain opened again from the store, and the indexes it had before
+        """
+        indexes = self.indexes(self.chain)
+        self.chain.chain.close()
+        reopened = Blockchain()
+        reopened.open_store(self.directory.name)
+        return reopened, indexes
+
+    def indexes(self, chain):
+        transaction_ids = [t['id'] for block in chain.chain for t in block['transactions']]
+        return {
+            'hashes': list(chain.block_hashes),
+            'heights': [chain.block_heights.get(block_hash) for block_hash in chain.block_hashes],
+            'statuses': [chain.transaction_status(transaction_id) for transaction_id in transaction_ids],
+            'dropped': chain.transaction_index.get(self.transactions['ours']['id']),
+            'balances': chain.balances.balances,
+            'work': list(chain.chain_work),
+        }
+
+    def test_indexes_survive_restart(self):
+        self.chain.open_store(self.directory.name)
+        self.chain.checkpoint_every = 2
+        self.chain.resolve_conflicts()
+
+        reopened, indexes = self.reopen()
+
+        assert reopened.chain.load_checkpoint()[0] == 4
+        assert self.indexes(reopened) == indexes
+        self.chain = reopened
+
+    def test_stale_checkpoint_is_rebuilt(self):
+        self.chain.open_store(self.directory.name)
+        self.chain.save_checkpoint()
+        self.chain.resolve_conflicts()
+
+        reopened, indexes = self.reopen()
+
+        assert reopened.chain.load_checkpoint() == (0, None)
+        assert self.indexes(reopened) == indexes
+        self.chain = reopened
+
+    def test_transactions_table_catches_up(self):
+        self.chain.open_store(self.directory.name)
+        self.chain.resolve_conflicts()
+        indexes = self.indexes(self.chain)
+        # The branch was staged next to the chain, and is not kept once it joined it
+        assert len(self.chain.staging_store) == 0
+        self.chain.staging_store.close()
+        self.chain.chain.close()
+
+        # As after a crash before the table reached the disk with the last blocks
+        table = HashTable(os.path.join(self.directory.name, 'transactions.dat'), 16, LOCATION.size)
+        table.delete(StoreTransactions.key(self.transactions['theirs']['id']))
+        table.mark = 2
+        table.close()
+        self.chain = Blockchain()
+        self.chain.open_store(self.directory.name)
+
+        assert self.indexes(self.chain) == indexes
+
+
+class TestRoutes(TestCase):
+
+    def setUp(self):
+        self.client = manager.app.test_client()
+
+    def test_announce_needs_a_block(self):
+        block = {'index': 2, 'previous_hash': 'a', 'proof': 1, 'transactions': []}
+        for values in ([1], {'block': [1]}, {'block': dict(block, transactions=[1])}, {'block': dict(block, index='2')},
+                       {'block': dict(block, difficulty=10 ** 9)}):
+            response = self.client.post('/blocks/announce', json=values)
+
+            assert response.status_code == 400
+
+    def test_relay_needs_lists(self):
+        for values in ([1], {'transactions': 1}):
+            assert self.client.post('/transactions/update', json=values).status_code == 400
+        for values in ([1], {'ids': 1}, {'ids': [['a']]}):
+            assert self.client.post('/transactions/inv', json=values).status_code == 400
+
+        assert self.client.post('/transactions/inv', json={'ids': ['a']}).get_json() == {'getdata': ['a']}
+
+    def test_relay_needs_valid_transactions(self):
+        valid = {'sender': 5, 'recipient': 6, 'amount': 1, 'size': 10, 'id': 'relayed-valid'}
+        invalid = [dict(valid, size='10', id='relayed-text-size'), dict(valid, size=-10 ** 6, id='relayed-negative-size'),
+                   dict(valid, size=0, id='relayed-no-size'), dict(valid, id=7)]
+        size = manager.manager.current_transactions.size
+
+        self.client.post('/transactions/update', json={'transactions': invalid + [valid]})
+
+        assert manager.manager.transaction_status('relayed-valid')['status'] == 'pending'
+        assert all(manager.manager.transaction_status(t['id'])['status'] == 'unknown' for t in invalid[:3])
+        assert manager.manager.current_transactions.size == size + 10
+
+    def test_requested_transactions(self):
+        pending = {'sender': 5, 'recipient': 6, 'amount': 1, 'size': 10, 'id': 'requested'}
+        manager.manager.add_transaction(pending)
+
+        assert manager.manager.requested_transactions({'getdata': ['requested', 'missing', ['requested']]}) == [pending]
+        for values in ([1], {'getdata': 'requested'}, {}):
+            assert manager.manager.requested_transactions(values) == []
+
+    def test_unknown_transaction_status(self):
+        response = self.client.get(f'/transactions/{"0" * 32}')
+
+        assert response.status_code == 404
+        assert response.get_json()['status'] == 'unknown'
+
+    def test_transaction_status_needs_an_id(self):
+        for path in ('new', 'batch', 'generate', 'inv', 'update'):
+            assert self.client.get(f'/transactions/{path}').status_code == 405
+        for transaction_id in ('0' * 31, '0' * 33, 'A' * 32):
+            assert self.client.get(f'/transactions/{transaction_id}').status_code == 404
+            assert self.client.get(f'/transactions/{transaction_id}').get_json() is None
+
+    def test_batch(self):
+        private_key, sender = new_key()
+        manager.manager.balances.credit(sender, 10)
+        transaction = sign({'sender': sender, 'recipient': 'bob', 'amount': 1, 'nonce': 1}, private_key)
+        values = [transaction, transaction, {'sender': sender}, dict(transaction, sender='0'), dict(transaction, nonce=2)]
+
+        response = self.client.post('/transactions/batch', json=values).get_json()
+
+        assert response['accepted'] == 1
+        assert response['rejected'] == 4
+        assert response['results'] == [
+            {'id': transaction['id']},
+            {'error': 'Error: Transaction already known'},
+            {'error': 'Missing values'},
+            {'error': 'Error: New coins can not be sent'},
+            {'error': 'Error: Invalid signature'},
+        ]
+
+    def test_batch_ndjson(self):
+        private_key, sender = new_key()
+        manager.manager.balances.credit(sender, 10)
+        lines = ''.join(json.dumps(sign({'sender': sender, 'recipient': 'bob', 'amount': amount}, private_key)) + '\n'
+                        for amount in (1, 2, 0))
+
+        response = self.client.post('/transactions/batch', data=lines, content_type='application/x-ndjson').get_json()
+
+        assert response['accepted'] == 2
+        assert all(manager.manager.transaction_status(result['id'])['status'] == 'pending'
+                   for result in response['results'][:2])
+        assert 'error' in response['results'][2]
+
+    def test_test_accounts_only_send_through_generate(self):
+        transaction = {'sender': 5, 'recipient': 6, 'amount': 10 ** 6}
+
+        assert self.client.post('/transactions/new', json=transaction).status_code == 400
+        response = self.client.post('/transactions/batch', json=[transaction]).get_json()
+        assert response['results'] == [{'error': 'Error: Numbered test accounts only send through /transactions/generate'}]
+
+        response = self.client.post('/transactions/generate', json={'transactions': [transaction]})
+        assert response.status_code == 200
+        assert manager.manager.transaction_status(response.get_json()['ids'][0])['status'] == 'pending'
+
+    def test_test_accounts_do_not_pay_keys(self):
+        _, owner = new_key()
+        transaction = {'sender': 5, 'recipient': owner, 'amount': 10 ** 6}
+
+        assert self.client.post('/transactions/generate', json={'transactions': [transaction]}).status_code == 400
+        relayed = dict(transaction, size=1, id='minted')
+        self.client.post('/transactions/update', json={'transactions': [relayed]})
+        assert manager.manager.transaction_status('minted')['status'] == 'unknown'
+
+    def test_batch_needs_a_list(self):
+        assert self.client.post('/transactions/batch', json={'sender': 5}).status_code == 400
+        assert self.client.post('/transactions/batch', data='{', content_type='application/x-ndjson').status_code == 400
@@ -0,0 +1,123 @@
+from unittest import TestCase
+
+from mempool import Mempool
+
+
+class MempoolTestCase(TestCase):
+
+    def setUp(self):
+        self.mempool = Mempool()
+
+    def add(self, transaction_id, size, fee):
+        self.mempool.add({'id': transaction_id, 'size': size, 'fee': fee})
+
+
+class TestBlockPacking(MempoolTestCase):
+
+    def test_highest_fee_rate_first(self):
+        self.add('a', 100, 1)
+        self.add('b', 10, 5)
+        self.add('c', 50, 10)
+
+        transactions, size = self.mempool.select(1000)
+
+        assert [t['id'] for t in transactions] == ['b', 'c', 'a']
+        assert size == 160
+
+    def test_skips_transactions_that_do_not_fit(self):
+        self.add('big', 90, 90)
+        self.add('small', 20, 1)
+
+        transactions, size = self.mempool.select(50)
+
+        assert [t['id'] for t in transactions] == ['small']
+        assert size == 20
+
+    def test_select_keeps_transactions(self):
+        self.add('a', 10, 1)
+
+        self.mempool.select(100)
+
+        assert 'a' in self.mempool
+        assert len(self.mempool.select(100)[0]) == 1
+
+    def test_removed_transactions_are_not_selected(self):
+        self.add('a', 10, 1)
+        self.add('b', 10, 2)
+
+        self.mempool.pop('b')
+        self.add('b', 10, 0)
+        transactions, _ = self.mempool.select(100)
+
+        assert [t['id'] for t in transactions] == ['a', 'b']
+
+    def test_duplicate_is_ignored(self):
+        self.add('a', 10, 1)
+
+        assert not self.mempool.add({'id': 'a', 'size': 10, 'fee': 1})
+        assert len(self.mempool) == 1
+
+    def test_oldest_age(self):
+        assert self.mempool.oldest_age() == 0
+
+        self.add('a', 10, 1)
+
+        assert self.mempool.oldest_age() >= 0
+
+    def test_pending_spend(self):
+        self.mempool.add({'id': 'a', 'size': 10, 'fee': 1, 'sender': 'alice', 'amount': 5})
+        self.mempool.add({'id': 'b', 'size': 10, 'fee': 0, 'sender': '0', 'amount': 5})
+
+        assert self.mempool.pending_spend('alice') == 6
+        assert self.mempool.pending_spend('0') == 0
+
+        self.mempool.pop('a')
+        assert self.mempool.pending_spend('alice') == 0
+
+
+class TestLimits(TestCase):
+
+    def setUp(self):
+        self.mempool = Mempool(max_count=3, max_size=100)
+
+    def add(self, transaction_id, size, fee):
+        return self.mempool.add({'id': transaction_id, 'size': size, 'fee': fee})
+
+    def test_lowest_fee_rate_is_evicted(self):
+        self.add('a', 10, 1)
+        self.add('b', 10, 5)
+        self.add('c', 10, 3)
+
+        assert self.add('d', 10, 4)
+        assert sorted(self.mempool) == ['b', 'c', 'd']
+
+    def test_refused_when_paying_least(self):
+        self.add('a', 10, 5)
+        self.add('b', 10, 5)
+        self.add('c', 10, 5)
+
+        assert not self.add('d', 10, 1)
+        assert 'd' not in self.mempool
+        assert len(self.mempool) == 3
+
+    def test_size_limit(self):
+        self.add('a', 60, 60)
+        self.add('b', 30, 3)
+
+        assert self.add('c', 30, 30)
+        assert sorted(self.mempool) == ['a', 'c']
+        assert self.mempool.size == 90
+
+    def test_expired_transactions_are_dropped(self):
+        self.mempool.ttl = 0
+        self.add('a', 10, 1)
+        self.mempool.arrivals[0] = (0, ) + self.mempool.arrivals[0][1:]
+
+        assert self.mempool.oldest_age() == 0
+        assert len(self.mempool) == 0
+
+    def test_page(self):
+        for transaction_id in 'abc':
+            self.add(transaction_id, 10, 1)
+
+        assert list(self.mempool.page(1, 5)) == ['b', 'c']
@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+from metrics import Registry, Counter, Gauge, Histogram
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(Counter, 'blocks_total', 'Blocks')
+        counter.inc()
+        counter.inc(2)
+        assert 'blocks_total 3.0' in self.registry.exposition()
+        assert self.registry.register(Counter, 'blocks_total', 'Blocks') is counter
+
+    def test_labels(self):
+        counter = self.registry.register(Counter, 'errors_total', 'Errors', ('host',))
+        counter.labels('a:5000').inc()
+        counter.labels('b"').inc(4)
+        exposition = self.registry.exposition()
+        assert 'errors_total{host="a:5000"} 1.0' in exposition
+        assert 'errors_total{host="b\\""} 4.0' in exposition
+
+    def test_gauge_function(self):
+        gauge = self.registry.register(Gauge, 'height', 'Height')
+        gauge.set_function(lambda: 7)
+        assert 'height 7.0' in self.registry.exposition()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.register(Histogram, 'seconds', 'Seconds', buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value)
+        lines = self.registry.exposition().splitlines()
+        assert 'seconds_bucket{le="0.1"} 1.0' in lines
+        assert 'seconds_bucket{le="1.0"} 3.0' in lines
+        assert 'seconds_bucket{le="+Inf"} 4.0' in lines
+        assert 'seconds_count 4.0' in lines
+        assert 'seconds_sum 4.25' in lines
@@ -0,0 +1,100 @@
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from unittest import TestCase
+
+import outbound
+from outbound import Client
+
+
+class Node(ThreadingHTTPServer):
+    """
+    Answers every request with its path, after /slow/<seconds> waits that long
+    """
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), PathHandler)
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def host(self):
+        return f'127.0.0.1:{self.server_address[1]}'
+
+
+class PathHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/slow/'):
+            sleep(float(self.path.split('/')[-1]))
+        data = self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def closed_host():
+    """
+    :return: A host nothing listens on
+    """
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        return f'127.0.0.1:{unused.getsockname()[1]}'
+
+
+class TestClient(TestCase):
+
+    def setUp(self):
+        self.node = Node()
+        self.client = Client(timeout=1)
+
+    def tearDown(self):
+        self.node.shutdown()
+        self.node.server_close()
+
+    def test_request(self):
+        response = self.client.get(f'http://{self.node.host}/chain')
+
+        assert response.status_code == 200
+        assert response.text == '/chain'
+        assert self.node.host in self.client.latencies
+
+    def test_unreachable_hosts_give_none(self):
+        host = closed_host()
+        errors = outbound.request_errors.labels(host).value
+
+        assert self.client.get(f'http://{host}/chain') is None
+        assert outbound.request_errors.labels(host).value == errors + 1
+
+    def test_slow_hosts_time_out(self):
+        assert self.client.get(f'http://{self.node.host}/slow/3') is None
+
+    def test_fan_out(self):
+        urls = [f'http://{self.node.host}/slow/0.2', f'http://{self.node.host}/slow/0', f'http://{closed_host()}/chain']
+
+        results = self.client.fan_out('GET', urls)
+
+        # Answers are returned as they arrive, the slow host last
+        assert results[-1][0] == urls[0]
+        assert sorted(url for url, _ in results) == sorted(urls)
+        answers = dict(results)
+        assert answers[urls[0]].text == '/slow/0.2'
+        assert answers[urls[2]] is None
+
+    def test_map(self):
+        results = self.client.map(lambda path: self.client.get(f'http://{self.node.host}/{path}').text, ['a', 'b', 'c'])
+
+        assert sorted(results) == ['/a', '/b', '/c']
+
+    def test_by_latency(self):
+        self.client.record_latency('slow', 2)
+        self.client.record_latency('fast', 1)
+        self.client.record_latency('fast', 3)
+
+        self.assertAlmostEqual(self.client.latencies['fast'], 1.4)
+        assert self.client.by_latency(['slow', 'fast', 'new']) == ['new', 'fast', 'slow']
@@ -0,0 +1,79 @@
+import hashlib
+from unittest import TestCase
+
+import proofofwork
+from blocks import BLOCK_VERSION
+
+
+class TestMidstateProof(TestCase):
+
+    def setUp(self):
+        self.last_hash = hashlib.sha256(b'last block').hexdigest()
+        self.prefix = f'100:{self.last_hash}:'.encode()
+
+    def search(self, difficulty, prefix=None):
+        return proofofwork.search(prefix or self.prefix, 0, 1, lambda: False, difficulty)
+
+    def test_found_proof_is_valid(self):
+        proof, hashes, _ = self.search(8)
+
+        assert proof > -1
+        assert hashes == proof + 1
+        assert proofofwork.check_proof(self.prefix, proof, 8)
+
+    def test_proof_meets_target(self):
+        proof, _, _ = self.search(8)
+
+        guess = hashlib.sha256(f'100:{self.last_hash}:'.encode() + proof.to_bytes(8, 'big')).digest()
+
+        assert int.from_bytes(guess, 'big') < 2 ** 248
+
+    def test_stopped_search(self):
+        proof, hashes, _ = proofofwork.search(self.prefix, 0, 1, lambda: True)
+
+        assert proof == -1
+        assert hashes == 0
+
+    def test_verify_uses_block_format(self):
+        proof, _, _ = self.search(proofofwork.DIFFICULTY)
+        last_block = {'proof': 100}
+
+        assert proofofwork.verify(last_block, {'proof': proof, 'difficulty': proofofwork.DIFFICULTY}, self.last_hash)
+        assert not proofofwork.verify(last_block, {'proof': proof, 'difficulty': 1}, self.last_hash)
+        assert proofofwork.verify(last_block, {'proof': proof}, self.last_hash) == \
+            proofofwork.valid_proof(100, proof, self.last_hash)
+
+    def test_exhausted_search(self):
+        proof, hashes, _ = proofofwork.search(self.prefix, 0, 3, lambda: False, 64, count=25000)
+
+        assert proof == -1
+        assert hashes == 25000
+
+    def test_malformed_block_is_invalid(self):
+        last_block = {'proof': 100}
+
+        assert not proofofwork.verify(last_block, {'proof': -1, 'difficulty': proofofwork.DIFFICULTY}, self.last_hash)
+        assert not proofofwork.verify(last_block, {'proof': 2 ** 64, 'difficulty': proofofwork.DIFFICULTY}, self.last_hash)
+        assert not proofofwork.verify(last_block, {'proof': '1', 'difficulty': proofofwork.DIFFICULTY}, self.last_hash)
+        assert not proofofwork.verify(last_block, {'proof': 1, 'difficulty': 300}, self.last_hash)
+        assert not proofofwork.verify(last_block, {'proof': 1, 'difficulty': True}, self.last_hash)
+        assert not proofofwork.verify(last_block, {'proof': 1, 'version': BLOCK_VERSION}, self.last_hash)
+
+    def test_proof_covers_header(self):
+        last_block = {'proof': 100}
+        block = {
+            'version': BLOCK_VERSION,
+            'index': 2,
+            'timestamp': 1600000000.0,
+            'previous_hash': self.last_hash,
+            'merkle_root': '0' * 64,
+            'node': 'miner',
+            'difficulty': proofofwork.DIFFICULTY,
+        }
+        block['proof'], _, _ = self.search(proofofwork.DIFFICULTY, proofofwork.guess_prefix(last_block, block, self.last_hash))
+
+        assert proofofwork.verify(last_block, block, self.last_hash)
+
+        for field, value in (('timestamp', 1600000001.0), ('merkle_root', '1' * 64), ('node', 'thief'), ('index', 3)):
+            changed = dict(block, **{field: value})
+            assert not proofofwork.verify(last_block, changed, self.last_hash)
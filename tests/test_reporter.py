@@ -0,0 +1,105 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Thread
+from time import sleep, time
+from unittest import TestCase
+
+from reporter import Reporter
+
+
+class LoggingNode(ThreadingHTTPServer):
+    """
+    Collects the batches of reports posted to it, holding each request until release is set
+    """
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), ReportHandler)
+        self.batches = []
+        self.received = Event()
+        self.release = Event()
+        self.release.set()
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/report'
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        values = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.batches.append(values['reports'])
+        self.server.received.set()
+        self.server.release.wait(10)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def wait_until(condition, timeout=10):
+    deadline = time() + timeout
+    while not condition():
+        if time() > deadline:
+            return False
+        sleep(0.01)
+    return True
+
+
+class TestReporter(TestCase):
+
+    def setUp(self):
+        self.node = LoggingNode()
+
+    def tearDown(self):
+        self.node.release.set()
+        self.node.shutdown()
+        self.node.server_close()
+
+    def test_reports_are_sent_in_batches(self):
+        reporter = Reporter(self.node.url, batch_size=3, flush_interval=0.5)
+        for number in range(5):
+            reporter.report({'number': number})
+
+        assert wait_until(lambda: sum(len(batch) for batch in self.node.batches) == 5)
+        assert [len(batch) for batch in self.node.batches] == [3, 2]
+        assert [report['number'] for batch in self.node.batches for report in batch] == list(range(5))
+
+    def test_batch_waits_at_most_the_flush_interval(self):
+        reporter = Reporter(self.node.url, batch_size=100, flush_interval=0.1)
+        started = time()
+        reporter.report({'number': 0})
+
+        assert self.node.received.wait(5)
+        assert time() - started < 2
+        assert self.node.batches == [[{'number': 0}]]
+
+    def test_reports_are_dropped_when_the_queue_is_full(self):
+        self.node.release.clear()
+        reporter = Reporter(self.node.url, flush_interval=0, max_queued=1)
+        reporter.report({'number': 0})
+        # The flusher is held up sending the first report, the queue has room for one more
+        assert self.node.received.wait(5)
+
+        reporter.report({'number': 1})
+        reporter.report({'number': 2})
+
+        assert reporter.dropped == 1
+        self.node.release.set()
+        assert wait_until(lambda: len(self.node.batches) == 2)
+        assert self.node.batches[1] == [{'number': 1}]
+
+    def test_unreachable_logging_node_loses_only_the_batch(self):
+        url = self.node.url
+        self.node.shutdown()
+        self.node.server_close()
+        reporter = Reporter(url, flush_interval=0)
+        reporter.report({'number': 0})
+
+        assert wait_until(lambda: reporter.queue.empty())
+        sleep(0.2)
+        # The flusher is still running and takes the next report
+        reporter.report({'number': 1})
+        assert wait_until(lambda: reporter.queue.empty())
@@ -0,0 +1,44 @@
+from time import sleep
+from unittest import TestCase
+
+from scheduler import NonceScheduler
+
+
+class TestNonceScheduler(TestCase):
+
+    def setUp(self):
+        self.scheduler = NonceScheduler(chunk_size=100, chunk_seconds=0.01, min_chunk=10, min_lease=0.05)
+        self.round = self.scheduler.reset()
+
+    def test_chunks_are_contiguous(self):
+        assert self.scheduler.assign('a', self.round) == (0, 100)
+        assert self.scheduler.assign('b', self.round) == (100, 100)
+        assert self.scheduler.next_chunk('a', self.round)[0] == 200
+        assert self.scheduler.searched == 100
+
+    def test_old_round(self):
+        self.scheduler.reset()
+        assert self.scheduler.assign('a', self.round) is None
+
+    def test_expired_lease_is_stolen(self):
+        self.scheduler.assign('slow', self.round)
+        sleep(0.1)
+        assert self.scheduler.assign('fast', self.round) == (0, 100)
+
+        # The slow miner finishing late does not count
+        self.scheduler.complete('slow', self.round)
+        assert self.scheduler.searched == 0
+
+    def test_released_chunk_is_split(self):
+        self.scheduler.assign('gone', self.round)
+        self.scheduler.release('gone')
+        self.scheduler.rates['fast'] = 4000
+        assert self.scheduler.assign('fast', self.round) == (0, 40)
+        assert self.scheduler.assign('new', self.round) == (40, 60)
+        assert self.scheduler.assign('other', self.round) == (100, 100)
+
+    def test_chunk_size_follows_hash_rate(self):
+        self.scheduler.assign('a', self.round)
+        self.scheduler.complete('a', self.round)
+        assert self.scheduler.rates['a'] > 0
+        assert self.scheduler.assign('a', self.round)[1] == self.scheduler.desired_size('a')
@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+import signatures
+from signatures import Verifier, new_key, sign, transaction_id, verify
+
+
+class SignaturesTestCase(TestCase):
+
+    def setUp(self):
+        self.private_key, self.address = new_key()
+        self.transaction = sign({'sender': self.address, 'recipient': 'bob', 'amount': 5, 'fee': 1, 'nonce': 1},
+                                self.private_key)
+
+
+class TestSignatures(SignaturesTestCase):
+
+    def test_signed_transaction_verifies(self):
+        assert self.transaction['id'] == transaction_id(self.transaction)
+        assert verify(self.transaction)
+
+    def test_changed_fields_do_not_verify(self):
+        changed = dict(self.transaction, amount=50)
+        assert not verify(changed)
+
+        changed['id'] = transaction_id(changed)
+        assert not verify(changed)
+
+    def test_other_key_does_not_verify(self):
+        _, other = new_key()
+        assert not verify(dict(self.transaction, sender=other))
+
+    def test_missing_fee_is_signed_as_zero(self):
+        transaction = sign({'sender': self.address, 'recipient': 'bob', 'amount': 5, 'nonce': 1}, self.private_key)
+
+        assert transaction['fee'] == 0
+        assert verify(transaction)
+
+    def test_nonce_changes_id(self):
+        again = sign(dict(self.transaction, nonce=2), self.private_key)
+        assert again['id'] != self.transaction['id']
+
+
+class TestVerifier(SignaturesTestCase):
+
+    def setUp(self):
+        SignaturesTestCase.setUp(self)
+        self.verifier = Verifier(cache_size=2, parallel=False)
+
+    def test_unsigned_transactions(self):
+        unsigned = dict(self.transaction)
+        del unsigned['signature']
+
+        assert self.verifier.verify([{'sender': 7, 'recipient': 8, 'amount': 1, 'id': 'a'}, unsigned]) == [True, False]
+
+    def test_only_test_accounts_and_mint_send_unsigned(self):
+        transactions = [{'sender': sender, 'recipient': 8, 'amount': 1, 'id': 'a'}
+                        for sender in (7, '0', '7', 'a' * 32, True, -1)]
+
+        assert self.verifier.verify(transactions) == [True, True, False, False, False, False]
+
+    def test_valid_ids_are_cached(self):
+        forged = dict(self.transaction, signature='00' * 64)
+
+        assert self.verifier.verify([self.transaction]) == [True]
+        assert self.transaction['id'] in self.verifier
+        assert self.verifier.verify([forged]) == [True]
+
+        # The cached id does not cover different fields
+        assert self.verifier.verify([dict(forged, amount=50)]) == [False]
+
+    def test_cache_size(self):
+        transactions = [sign(dict(self.transaction, nonce=nonce), self.private_key) for nonce in range(3)]
+
+        self.verifier.verify(transactions)
+
+        assert transactions[0]['id'] not in self.verifier
+        assert transactions[2]['id'] in self.verifier
+
+    def test_large_batch_on_pool(self):
+        transactions = [sign(dict(self.transaction, nonce=nonce), self.private_key)
+                        for nonce in range(signatures.CHUNK_SIZE + 10)]
+        transactions[-1] = dict(transactions[-1], amount=50)
+
+        results = Verifier().verify(transactions)
+
+        assert results[:-1] == [True] * (len(transactions) - 1)
+        assert results[-1] is False
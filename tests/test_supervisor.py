@@ -0,0 +1,70 @@
+from threading import Event
+from time import sleep, time
+from unittest import TestCase
+
+import proofofwork
+from scheduler import NonceScheduler
+from supervisor import MinerSupervisor
+
+
+def wait_until(condition, timeout=10):
+    deadline = time() + timeout
+    while not condition():
+        if time() > deadline:
+            return False
+        sleep(0.05)
+    return True
+
+
+class TestMinerSupervisor(TestCase):
+
+    def setUp(self):
+        self.proofs = []
+        self.found = Event()
+        self.scheduler = NonceScheduler(chunk_size=1 << 16)
+        self.supervisor = MinerSupervisor(self.on_proof, self.scheduler)
+        self.supervisor.add_workers(1)
+
+    def tearDown(self):
+        self.supervisor.close()
+
+    def on_proof(self, work, proof):
+        self.proofs.append((work, proof))
+        self.found.set()
+
+    def test_proof_is_found(self):
+        prefix = b'prefix'
+        self.supervisor.start('work', prefix, 4, self.scheduler.reset())
+
+        assert self.found.wait(10)
+        work, proof = self.proofs[0]
+        assert work == 'work'
+        assert proofofwork.check_proof(prefix, proof, 4)
+
+    def test_crashed_worker_is_restarted(self):
+        self.supervisor.start('work', b'prefix', 256, self.scheduler.reset())
+        crashed = self.supervisor.workers[0]
+        assert wait_until(lambda: crashed.name in self.scheduler.leases)
+
+        crashed.process.kill()
+
+        assert wait_until(lambda: self.supervisor.restarts == 1)
+        worker = self.supervisor.workers[0]
+        assert worker.process.pid != crashed.process.pid and worker.process.is_alive()
+        # The chunk of the crashed worker went back to the scheduler, the new worker searches the work in progress
+        assert crashed.name not in self.scheduler.leases
+        assert wait_until(lambda: worker.name in self.scheduler.leases)
+
+    def test_results_of_stale_work_are_ignored(self):
+        self.supervisor.start('old', b'old', 256, self.scheduler.reset())
+        generation = self.supervisor.generation
+        self.supervisor.start('new', b'new', 256, self.scheduler.reset())
+        worker = self.supervisor.workers[0]
+
+        self.supervisor.handle(worker, ('done', generation, 5, 100, 1.0))
+        assert self.proofs == []
+        assert self.supervisor.work[0] == 'new'
+
+        self.supervisor.handle(worker, ('done', self.supervisor.generation, 7, 100, 1.0))
+        assert self.proofs == [('new', 7)]
+        assert self.supervisor.work is None
@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+import validation
+from blocks import BLOCK_VERSION, block_hash
+
+
+class ValidationTestCase(TestCase):
+
+    def setUp(self):
+        self.chunk_size = validation.CHUNK_SIZE
+        validation.CHUNK_SIZE = 4
+        self.chain = [{'index': 1, 'proof': 100, 'previous_hash': '1', 'transactions': []}]
+        for index in range(2, 20):
+            self.chain.append({
+                'index': index,
+                'proof': index,
+                'previous_hash': block_hash(self.chain[-1]),
+                'transactions': [],
+            })
+
+    def tearDown(self):
+        validation.CHUNK_SIZE = self.chunk_size
+
+
+class TestValidation(ValidationTestCase):
+
+    def test_valid_chain(self):
+        for parallel in (False, True):
+            hashes = validation.validate(self.chain, parallel=parallel)
+
+            assert hashes == [block_hash(block) for block in self.chain[1:]]
+
+    def test_broken_link(self):
+        self.chain[13]['previous_hash'] = 'abc'
+
+        for parallel in (False, True):
+            assert validation.validate(self.chain, parallel=parallel) is None
+
+    def test_invalid_proof(self):
+        self.chain[6]['difficulty'] = 20
+
+        assert validation.validate(self.chain) is None
+
+    def test_validator_stops_early(self):
+        self.chain[2]['previous_hash'] = 'abc'
+        validator = validation.ChainValidator(self.chain[0], block_hash(self.chain[0]), parallel=False)
+
+        results = [validator.add(block) for block in self.chain[1:]]
+
+        assert results[:3] == [True, True, True]
+        assert results[3] is False
+        assert validator.result() is None
+
+    def test_index_must_follow(self):
+        self.chain[5]['index'] = 9
+        for block, last_block in zip(self.chain[6:], self.chain[5:]):
+            block['previous_hash'] = block_hash(last_block)
+
+        assert validation.validate(self.chain) is None
+
+    def test_versioned_block_needs_difficulty(self):
+        self.chain[-1]['version'] = 3
+
+        assert validation.validate(self.chain) is None
+
+    def test_malformed_block_is_invalid(self):
+        self.chain[-1]['difficulty'] = 300
+        self.chain.append(1)
+
+        for parallel in (False, True):
+            assert validation.validate(self.chain, parallel=parallel) is None
+
+    def test_versions_never_go_down(self):
+        last_block, block = self.chain[-2], self.chain[-1]
+        assert validation.valid_link(last_block, block_hash(last_block), block)
+
+        last_block['version'] = BLOCK_VERSION
+        block['previous_hash'] = block_hash(last_block)
+        assert not validation.valid_link(last_block, block_hash(last_block), block)
+
+        block['version'] = 2
+        block['difficulty'] = 20
+        assert not validation.valid_link(last_block, block_hash(last_block), block)
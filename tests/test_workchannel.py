@@ -0,0 +1,38 @@
+from threading import Thread
+from time import time
+from unittest import TestCase
+
+from workchannel import WorkChannel
+
+
+class TestWorkChannel(TestCase):
+
+    def test_wait_returns_newer_version(self):
+        channel = WorkChannel()
+        version = channel.publish({'proof': 1})
+        assert channel.wait(0, timeout=1) == (version, {'proof': 1})
+
+    def test_wait_times_out_on_same_version(self):
+        channel = WorkChannel()
+        version = channel.publish({'proof': 1})
+        started = time()
+        assert channel.wait(version, timeout=0.1) == (version, {'proof': 1})
+        assert time() - started >= 0.1
+
+    def test_publish_wakes_waiting_miner(self):
+        channel = WorkChannel()
+        results = []
+        waiter = Thread(target=lambda: results.append(channel.wait(0, timeout=5)))
+        waiter.start()
+        channel.publish({'proof': 2})
+        waiter.join(timeout=5)
+        assert results == [(1, {'proof': 2})]
+
+    def test_cancel(self):
+        channel = WorkChannel()
+        channel.cancel()
+        assert channel.version == 0
+
+        channel.publish({'proof': 1})
+        channel.cancel()
+        assert channel.wait(1, timeout=0) == (2, None)
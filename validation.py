@@ -0,0 +1,184 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import proofofwork
+from blocks import BLOCK_VERSION, block_hash, valid_body
+
+logger = logging.getLogger('validation')
+
+# Blocks validated per task on the process pool, smaller remainders are validated in the calling process
+CHUNK_SIZE = 500
+
+pool = None
+
+
+def get_pool():
+    global pool
+    if pool is None:
+        # Fork so the workers do not re-import the node that started them
+        context = multiprocessing.get_context('fork')
+        pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=context)
+    return pool
+
+
+def valid_link(last_block, last_hash, block):
+    """
+    Determine if a block correctly follows the block before it
+
+    :param last_block: The previous block
+    :param last_hash: Hash of the previous block
+    :param block: The block
+    :return: True if valid, False if not
+    """
+
+    # Check that the hash of the block is correct
+    if block.get('previous_hash') != last_hash:
+        return False
+
+    # Blocks are numbered consecutively
+    if block.get('index') != last_block['index'] + 1:
+        return False
+
+    # Versions never go down, and a versioned block must be in the current format
+    version = block.get('version', 1)
+    if version < last_block.get('version', 1) or ('version' in block and version != BLOCK_VERSION):
+        return False
+
+    # Headers are validated without their transactions, a block that has them must match its merkle root
+    if 'transactions' in block and not valid_body(block):
+        return False
+
+    # Check that the Proof of Work is correct. Only blocks from before versions
+    # and difficulties existed are not checked, mining was simulated for those
+    if 'difficulty' in block or 'version' in block:
+        return proofofwork.verify(last_block, block, last_hash)
+    return True
+
+
+def check_chunk(last_block, last_hash, blocks):
+    """
+    Validate a run of blocks, stopping at the first invalid link
+
+    :param last_block: The block before the first one of the run
+    :param last_hash: Hash of last_block, computed if None
+    :param blocks: The blocks
+    :return: The hashes of the blocks, None if a link is invalid
+    """
+
+    if last_hash is None:
+        last_hash = block_hash(last_block)
+
+    hashes = []
+    for block in blocks:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Validating the block after block %s', last_block.get('index'))
+        try:
+            valid = isinstance(block, dict) and valid_link(last_block, last_hash, block)
+            next_hash = block_hash(block) if valid else None
+        except (KeyError, TypeError, ValueError, OverflowError):
+            # A neighbour's malformed block is an invalid link, not an error of ours
+            valid = False
+        if not valid:
+            logger.info('The block after block %s is invalid', last_block.get('index'))
+            return None
+
+        last_block = block
+        last_hash = next_hash
+        hashes.append(last_hash)
+    return hashes
+
+
+class ChainValidator:
+    def __init__(self, last_block, last_hash, parallel=True):
+        """
+        Validates the blocks following last_block as they are added. Every full
+        chunk is handed to the process pool while more blocks arrive, the rest is
+        validated in this process when the result is asked for.
+
+        :param last_block: The block the added blocks follow
+        :param last_hash: Hash of last_block
+        :param parallel: Use the process pool for full chunks
+        """
+        self.last_block = last_block
+        self.last_hash = last_hash
+        self.parallel = parallel
+        self.chunk = []
+        self.parts = []
+        self.failed = False
+
+    def add(self, block):
+        """
+        :param block: The next block
+        :return: False once an invalid link has been found, so the caller can stop early
+        """
+        self.chunk.append(block)
+        if len(self.chunk) >= CHUNK_SIZE:
+            self.flush(self.parallel)
+        return not self.failed
+
+    def flush(self, parallel):
+        if not self.chunk:
+            return
+
+        if parallel:
+            part = get_pool().submit(check_chunk, self.last_block, self.last_hash, self.chunk)
+            # The next chunk's worker hashes the last block of this chunk itself
+            self.last_hash = None
+        else:
+            part = check_chunk(self.last_block, self.last_hash, self.chunk)
+            if part is None:
+                self.failed = True
+                self.chunk = []
+                return
+            self.last_hash = part[-1]
+
+        self.parts.append(part)
+        self.last_block = self.chunk[-1]
+        self.chunk = []
+
+        # Fail fast on chunks that have already come back invalid
+        if any(not isinstance(p, list) and p.done() and p.result() is None for p in self.parts):
+            self.failed = True
+
+    def result(self):
+        """
+        Wait for the chunks still being validated
+
+        :return: The hashes of all added blocks, None if any link is invalid
+        """
+        if not self.failed:
+            self.flush(parallel=False)
+
+        pending = {part for part in self.parts if not isinstance(part, list)}
+        while pending and not self.failed:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if any(part.result() is None for part in done):
+                self.failed = True
+
+        if self.failed:
+            for part in pending:
+                part.cancel()
+            return None
+
+        hashes = []
+        for part in self.parts:
+            hashes.extend(part if isinstance(part, list) else part.result())
+        return hashes
+
+
+def validate(chain, first_hash=None, parallel=True):
+    """
+    Determine if a given chain is valid
+
+    :param chain: List of blocks, starting with the block the others follow
+    :param first_hash: Hash of chain[0], computed if not given
+    :param parallel: Use the process pool for long chains
+    :return: The hashes of chain[1:], None if not valid
+    """
+    validator = ChainValidator(chain[0], first_hash or block_hash(chain[0]), parallel)
+    for block in chain[1:]:
+        if not validator.add(block):
+            return None
+    return validator.result()
@@ -0,0 +1,47 @@
+from threading import Condition
+
+
+class WorkChannel:
+    def __init__(self):
+        """
+        The current mining work of a cluster. Miners long-poll for a version
+        newer than the one they have and are answered as soon as it changes.
+        """
+        self.condition = Condition()
+        self.version = 0
+
+        # Work of the current version, None when the miners should stop
+        self.work = None
+
+    def publish(self, work):
+        """
+        Replace the current work and wake up all waiting miners
+
+        :param work: <dict> New work, None to cancel the current work
+        :return: <int> Version of the new work
+        """
+        with self.condition:
+            self.version += 1
+            self.work = work
+            self.condition.notify_all()
+            return self.version
+
+    def cancel(self):
+        """
+        Tell the miners to stop, unless they already have nothing to do
+        """
+        with self.condition:
+            if self.work is not None:
+                self.publish(None)
+
+    def wait(self, after, timeout):
+        """
+        Wait until the version differs from the one a miner has
+
+        :param after: <int> Version the miner has
+        :param timeout: <float> Max seconds to wait
+        :return: (<int> version, work of the version)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != after, timeout)
+            return self.version, self.work